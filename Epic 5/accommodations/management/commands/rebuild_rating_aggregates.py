@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from dbutils import REBUILD_RATING_AGGREGATES, REBUILD_RATING_AGGREGATES_RESET
+
+class Command(BaseCommand):
+    help = "Rebuild rating_sum, rating_count and average_rating of every accommodation from Rating."
+
+    def handle(self, *args, **options):
+        # One GROUP BY over Rating, updating only the accommodations whose values are wrong
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(REBUILD_RATING_AGGREGATES_RESET)
+            cleared = cursor.rowcount
+            cursor.execute(REBUILD_RATING_AGGREGATES)
+            rebuilt = cursor.rowcount
+        self.stdout.write(self.style.SUCCESS(
+            f"Corrected {rebuilt} rated and {cleared} unrated accommodations"
+        ))
\ No newline at end of file
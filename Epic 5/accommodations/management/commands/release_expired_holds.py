@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from accommodations.models import Accommodation, Reservation
+import time
+
+BATCH_SIZE = 500
+
+class Command(BaseCommand):
+    help = "Cancel temporary holds past their expires_at and release their accommodations, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--watch', action='store_true', help="Keep sweeping instead of exiting when no hold has expired")
+        parser.add_argument('--interval', type=int, default=60, help="Seconds between sweeps with --watch")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            released = self.release_batch(options['batch_size'])
+            total += released
+            if released:
+                continue
+            if not options['watch']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"Released {total} expired holds"))
+
+    def release_batch(self, batch_size):
+        """Cancel one batch of expired holds and return how many were released."""
+        with transaction.atomic():
+            # Range lookup on idx_reservation_status_expires, so a sweep reads only expired holds
+            expired = list(
+                Reservation.objects.filter(status=Reservation.TEMP, expires_at__lte=timezone.now())
+                .order_by('expires_at').values_list('reservation_id', 'accommodation_id')[:batch_size]
+            )
+            if not expired:
+                return 0
+
+            Reservation.objects.filter(
+                reservation_id__in=[reservation_id for reservation_id, _ in expired], status=Reservation.TEMP
+            ).update(status=Reservation.CANCELED)
+            # An accommodation stays reserved while any other reservation still holds it
+            active = Reservation.objects.filter(accommodation_id=OuterRef('pk')).exclude(
+                status__in=[Reservation.CANCELED, Reservation.COMPLETED]
+            )
+            Accommodation.objects.filter(
+                pk__in={accommodation_id for _, accommodation_id in expired}
+            ).update(is_reserved=Exists(active))
+        return len(expired)
\ No newline at end of file
@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from availability import claim_accommodation
 
 # User model
 class User(models.Model):
@@ -39,12 +40,27 @@ class Accommodation(models.Model):
     longitude = models.FloatField()
     geo_address = models.TextField()
     is_reserved = models.BooleanField(default=False)
-    rating_count = models.IntegerField(default=0)
-    average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.00)
+    # Kept up to date by the rating triggers in the database; save() does not write them back
+    rating_count = models.IntegerField(default=0, editable=False)
+    rating_sum = models.IntegerField(default=0, editable=False)  # Exact total of the ratings, average_rating = rating_sum / rating_count
+    average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0.00, editable=False)
     class Meta:
         db_table = 'Accommodation'  # Match the exact table name in your database
         managed = False            # Tell Django this table is managed externally
 
+    # Columns written only by database triggers
+    DB_MAINTAINED = ['rating_count', 'rating_sum', 'average_rating']
+
+    def save(self, *args, **kwargs):
+        # A full save of a row loaded earlier would write back stale copies of the
+        # columns the triggers maintain, so only the other columns are updated
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DB_MAINTAINED
+            ]
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.type} at {self.address}"
 
@@ -56,6 +72,8 @@ class Reservation(models.Model):
     CANCELED = 'canceled'
     COMPLETED = 'completed'
     
+    TEMP_HOLD = timezone.timedelta(hours=2)
+    
     STATUS_CHOICES = [
         (TEMP, 'Temporary (2h)'),
         (CONFIRMED, 'Confirmed'),
@@ -67,8 +85,12 @@ class Reservation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     accommodation = models.ForeignKey(Accommodation, on_delete=models.CASCADE)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=TEMP)  
-    # created_at = models.DateTimeField(auto_now_add=True)
-    # expires_at = models.DateTimeField()
+    # Stay from check_in up to (not including) check_out; without dates the whole listing is held
+    check_in = models.DateField(null=True, blank=True)
+    check_out = models.DateField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, null=True)
+    # Temporary holds are released by the release_expired_holds command once this has passed
+    expires_at = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         db_table = 'Reservation'  # Match the exact table name in your database
@@ -76,18 +98,33 @@ class Reservation(models.Model):
 
     def save(self, *args, **kwargs):
         if self.status == self.TEMP and not self.expires_at:
-            self.expires_at = timezone.now() + timezone.timedelta(hours=24)
-        if self.status == self.CONFIRMED:
-            self.accommodation.is_reserved = True
-            self.accommodation.save()
-        elif self.status in [self.CANCELED, self.COMPLETED]:
-            self.accommodation.is_reserved = False
-            self.accommodation.save()
-        
-        super().save(*args, **kwargs)
+            self.expires_at = timezone.now() + self.TEMP_HOLD
+        # The accommodation and the reservation are written together or not at all
+        with transaction.atomic():
+            if self._state.adding and self.status not in [self.CANCELED, self.COMPLETED]:
+                self.claim_accommodation()
+            elif self.status == self.CONFIRMED:
+                self.accommodation.is_reserved = True
+                self.accommodation.save(update_fields=['is_reserved'])
+            elif self.status in [self.CANCELED, self.COMPLETED]:
+                # Other reservations of the same accommodation may still hold it
+                self.accommodation.is_reserved = Reservation.objects.filter(
+                    accommodation_id=self.accommodation_id
+                ).exclude(status__in=[self.CANCELED, self.COMPLETED]).exclude(pk=self.pk).exists()
+                self.accommodation.save(update_fields=['is_reserved'])
+
+            super().save(*args, **kwargs)
+
+    def claim_accommodation(self):
+        """
+        Mark the accommodation reserved with one conditional UPDATE that only matches
+        while the stay lies inside the listing and no active reservation overlaps it,
+        so two bookings made at the same time cannot both claim it
+        """
+        claim_accommodation(self)
 
     def is_active(self):
-        return self.status == self.TEMP and timezone.now() < self.expires_at
+        return self.status == self.TEMP and self.expires_at is not None and timezone.now() < self.expires_at
 
     def __str__(self):
         return f"Reservation {self.reservation_id} - {self.get_status_display()}"
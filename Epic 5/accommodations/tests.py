@@ -1,3 +1,300 @@
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import Client, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
+from create_dbV3 import create_schema, drop_schema
+from . import views
+from .management.commands import release_expired_holds
+from .models import Accommodation, Rating, Reservation, User
+import io
+import json
 
 # Create your tests here.
+
+class UnihavenSchemaTestCase(TransactionTestCase):
+    """
+    The models are unmanaged, so each test builds the tables, triggers and indexes
+    of unihaven.db in the test database from create_dbV3.py and migrate.py
+    """
+
+    def setUp(self):
+        connection.ensure_connection()
+        self.schema_tables = create_schema(connection.connection)
+
+    def tearDown(self):
+        connection.ensure_connection()
+        drop_schema(connection.connection, self.schema_tables)
+
+class ConcurrentRatingTest(UnihavenSchemaTestCase):
+    ratings = [5, 4, 3, 5, 1, 0, 2, 4, 5, 3] * 4
+
+    def setUp(self):
+        super().setUp()
+        self.accommodation = Accommodation.objects.create(
+            type="Flat", availability_start="2025-01-01", availability_end="2025-06-30",
+            beds=2, bedrooms=1, price=10000, address="1 Pok Fu Lam Road",
+            latitude=22.28, longitude=114.14, geo_address="",
+        )
+        self.requests = []
+        for i, rating in enumerate(self.ratings):
+            user = User.objects.create(name=f"Student {i}", email=f"student{i}@connect.hku.hk", password="x", role=User.STUDENT)
+            reservation = Reservation.objects.create(user=user, accommodation=self.accommodation, status=Reservation.COMPLETED)
+            self.requests.append({
+                'userId': user.user_id,
+                'accId': self.accommodation.accommodation_id,
+                'reservId': reservation.reservation_id,
+                'rating': rating,
+                'date': '2025-04-14',
+            })
+
+    def rate(self, data):
+        try:
+            return Client().post('/accommodations/api_rate', data).status_code
+        finally:
+            connection.close()
+
+    def test_parallel_ratings_are_all_counted_once(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            statuses = list(executor.map(self.rate, self.requests))
+        self.assertEqual(statuses, [200] * len(self.ratings))
+
+        self.accommodation.refresh_from_db()
+        self.assertEqual(self.accommodation.rating_count, len(self.ratings))
+        self.assertEqual(self.accommodation.rating_sum, sum(self.ratings))
+        self.assertEqual(Rating.objects.count(), len(self.ratings))
+        # The model reads average_rating with two decimal places; the mean of the ratings is exactly 3.2
+        self.assertEqual(self.accommodation.average_rating, Decimal('3.20'))
+        self.assertEqual(Decimal(sum(self.ratings)) / len(self.ratings), Decimal('3.2'))
+
+
+class RatingBatchTest(UnihavenSchemaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.flats = [
+            Accommodation.objects.create(
+                type="Flat", availability_start="2025-01-01", availability_end="2025-06-30",
+                beds=2, bedrooms=1, price=10000, address=f"{i} Pok Fu Lam Road",
+            )
+            for i in range(2)
+        ]
+        self.reservations = []
+        for i in range(6):
+            user = User.objects.create(name=f"Student {i}", email=f"student{i}@connect.hku.hk", password="x", role=User.STUDENT)
+            self.reservations.append(Reservation.objects.create(
+                user=user, accommodation=self.flats[i % 2], status=Reservation.COMPLETED,
+            ))
+
+    def rate_batch(self, items):
+        try:
+            response = Client().post('/accommodations/api_rate_batch', json.dumps({'ratings': items}), content_type='application/json')
+            return response.status_code, response.json()
+        finally:
+            connection.close()
+
+    def rate(self, reservation, rating):
+        try:
+            return Client().post('/accommodations/api_rate', {
+                'userId': reservation.user_id, 'reservId': reservation.reservation_id, 'rating': rating, 'date': '2025-04-14',
+            }).status_code
+        finally:
+            connection.close()
+
+    def assertAggregatesMatchRatings(self):
+        for flat in self.flats:
+            flat.refresh_from_db()
+            ratings = list(Rating.objects.filter(reservation__accommodation=flat).values_list('rating', flat=True))
+            self.assertEqual((flat.rating_sum, flat.rating_count), (sum(ratings), len(ratings)))
+            average = Decimal(sum(ratings)) / len(ratings) if ratings else Decimal(0)
+            self.assertEqual(flat.average_rating, average.quantize(Decimal('0.01')))
+
+    def test_invalid_and_repeated_items_are_reported(self):
+        first, second, third, fourth = (reservation.reservation_id for reservation in self.reservations[:4])
+        Rating.objects.create(reservation=self.reservations[3], rating=1)
+        status, body = self.rate_batch([
+            {'reservId': first, 'rating': 5},
+            {'reservId': second, 'rating': 9},
+            {'reservId': 'x', 'rating': 3},
+            {'rating': 3},
+            {'reservId': 999999, 'rating': 3},
+            {'reservId': fourth, 'rating': 3},
+            {'reservId': first, 'rating': 2},
+            {'reservId': third, 'rating': 4},
+        ])
+        self.assertEqual(status, 200)
+        self.assertEqual(body['message'], '2 of 8 ratings added')
+        self.assertEqual([result['status'] for result in body['results']], ['success', 'error', 'error', 'error', 'error', 'error', 'error', 'success'])
+        self.assertEqual([result.get('error') for result in body['results'][1:7]], [
+            'Rating must be an integer between 0 and 5',
+            'reservId and rating must be integers',
+            'reservId and rating must be integers',
+            'Reservation not found',
+            'Reservation already rated',
+            'Reservation rated twice in this request',
+        ])
+        self.assertEqual(Rating.objects.get(reservation_id=first).rating, 5)
+        self.assertEqual(Rating.objects.count(), 3)
+        self.assertAggregatesMatchRatings()
+        # first and third are the two ratings of the first flat (with fourth's on the second)
+        self.assertEqual(body['accommodations'], [
+            {'accommodation_id': self.flats[0].accommodation_id, 'average_rating': '4.50', 'rating_count': 2},
+        ])
+
+    def test_aggregates_are_maintained_by_the_triggers(self):
+        ratings = [5, 4, 0, 2, 3, 3]
+        with CaptureQueriesContext(connection) as queries:
+            status, body = self.rate_batch([
+                {'reservId': reservation.reservation_id, 'rating': rating}
+                for reservation, rating in zip(self.reservations, ratings)
+            ])
+        self.assertEqual(status, 200)
+        # The view only inserts; it does not recompute the aggregates itself
+        self.assertFalse([query['sql'] for query in queries if query['sql'].startswith('UPDATE')])
+        self.assertEqual(body['message'], '6 of 6 ratings added')
+        self.assertAggregatesMatchRatings()
+        self.assertEqual([flat.rating_sum for flat in self.flats], [sum(ratings[0::2]), sum(ratings[1::2])])
+
+    def test_batch_size_is_limited(self):
+        status, body = self.rate_batch([{'reservId': self.reservations[0].reservation_id, 'rating': 5}] * (views.MAX_BATCH_RATINGS + 1))
+        self.assertEqual(status, 400)
+        self.assertEqual(body['error'], f'At most {views.MAX_BATCH_RATINGS} ratings per request')
+        self.assertEqual(self.rate_batch([])[0], 400)
+        self.assertFalse(Rating.objects.exists())
+
+    def test_overlapping_batches_and_single_ratings_rate_each_reservation_once(self):
+        items = [{'reservId': reservation.reservation_id, 'rating': 4} for reservation in self.reservations]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            batches = [executor.submit(self.rate_batch, items[i:] + items[:i]) for i in range(4)]
+            singles = [executor.submit(self.rate, reservation, 2) for reservation in self.reservations]
+            batches = [batch.result() for batch in batches]
+            singles = [single.result() for single in singles]
+
+        self.assertEqual([status for status, _ in batches], [200] * 4)
+        self.assertTrue(set(singles) <= {200, 400})
+        added = sum(1 for _, body in batches for result in body['results'] if result['status'] == 'success')
+        self.assertEqual(added + singles.count(200), len(self.reservations))
+        self.assertEqual(Rating.objects.count(), len(self.reservations))
+        self.assertAggregatesMatchRatings()
+
+    def test_rebuild_command_repairs_the_aggregates(self):
+        self.rate_batch([{'reservId': reservation.reservation_id, 'rating': 4} for reservation in self.reservations[:3]])
+        # Wrong totals on the rated flat, and leftovers on the other one once its only rating is gone
+        Rating.objects.filter(reservation__accommodation=self.flats[1]).delete()
+        Accommodation.objects.filter(pk=self.flats[0].pk).update(rating_sum=1, rating_count=9, average_rating=0.1)
+        Accommodation.objects.filter(pk=self.flats[1].pk).update(rating_sum=7, rating_count=2, average_rating=3.5)
+        output = io.StringIO()
+        call_command('rebuild_rating_aggregates', stdout=output)
+        self.assertIn("Corrected 1 rated and 1 unrated accommodations", output.getvalue())
+        self.assertAggregatesMatchRatings()
+
+class ConcurrentReservationTest(UnihavenSchemaTestCase):
+    # Many students book the same flat at once; Reservation.save must let exactly one
+    # booking per stay through on its own, so the overlap triggers are dropped here
+    stays = [('2025-02-01', '2025-02-08'), ('2025-02-08', '2025-02-15'), ('2025-03-01', '2025-03-04')]
+    students_per_stay = 8
+
+    def setUp(self):
+        super().setUp()
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER prevent_reservation_overlap_insert')
+            cursor.execute('DROP TRIGGER prevent_reservation_overlap_update')
+
+        self.accommodation = Accommodation.objects.create(
+            type="Flat", availability_start="2025-01-01", availability_end="2025-06-30",
+            beds=2, bedrooms=1, price=10000, address="1 Pok Fu Lam Road",
+            latitude=22.28, longitude=114.14, geo_address="",
+        )
+        self.bookings = []
+        for i in range(self.students_per_stay):
+            for stay in self.stays:
+                user = User.objects.create(
+                    name=f"Student {len(self.bookings)}", email=f"student{len(self.bookings)}@connect.hku.hk",
+                    password="x", role=User.STUDENT,
+                )
+                self.bookings.append((user.user_id, *stay))
+
+    def book(self, booking):
+        user_id, check_in, check_out = booking
+        try:
+            Reservation(
+                user_id=user_id, accommodation_id=self.accommodation.accommodation_id,
+                status=Reservation.TEMP, check_in=check_in, check_out=check_out,
+            ).save()
+            return True
+        except IntegrityError:
+            return False
+        finally:
+            connection.close()
+
+    def test_parallel_bookings_never_overlap(self):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            booked = list(executor.map(self.book, self.bookings))
+        self.assertEqual(sum(booked), len(self.stays))
+
+        reservations = list(Reservation.objects.order_by('check_in').values_list('check_in', 'check_out'))
+        self.assertEqual([(str(check_in), str(check_out)) for check_in, check_out in reservations], sorted(self.stays))
+        self.accommodation.refresh_from_db()
+        self.assertTrue(self.accommodation.is_reserved)
+
+class ReleaseExpiredHoldsTest(UnihavenSchemaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.flats = [
+            Accommodation.objects.create(
+                type="Flat", availability_start="2025-01-01", availability_end="2025-06-30",
+                beds=2, bedrooms=1, price=10000, address=f"{i} Pok Fu Lam Road",
+            )
+            for i in range(3)
+        ]
+        self.user = User.objects.create(name="Student", email="student@connect.hku.hk", password="x", role=User.STUDENT)
+        expired = timezone.now() - timezone.timedelta(minutes=1)
+        # The first flat is only held by expired holds, the second is also confirmed
+        # for another stay, and the third is held by a hold that has not expired yet
+        self.expired = [
+            self.reserve(self.flats[0], Reservation.TEMP, '2025-02-01', '2025-02-08', expired),
+            self.reserve(self.flats[0], Reservation.TEMP, '2025-03-01', '2025-03-08', expired),
+            self.reserve(self.flats[1], Reservation.TEMP, '2025-02-01', '2025-02-08', expired),
+        ]
+        self.confirmed = self.reserve(self.flats[1], Reservation.CONFIRMED, '2025-03-01', '2025-03-08', expired)
+        self.pending = self.reserve(self.flats[2], Reservation.TEMP, '2025-02-01', '2025-02-08')
+
+    def reserve(self, flat, status, check_in, check_out, expires_at=None):
+        return Reservation.objects.create(
+            user=self.user, accommodation=flat, status=status,
+            check_in=check_in, check_out=check_out, expires_at=expires_at,
+        )
+
+    def release(self, **options):
+        output = io.StringIO()
+        call_command('release_expired_holds', stdout=output, **options)
+        return output.getvalue()
+
+    def test_expired_holds_are_canceled_and_their_flats_released(self):
+        self.assertIn("Released 3 expired holds", self.release())
+
+        statuses = dict(Reservation.objects.values_list('reservation_id', 'status'))
+        for reservation in self.expired:
+            self.assertEqual(statuses[reservation.pk], Reservation.CANCELED)
+        # Only temporary holds expire, whatever expires_at says
+        self.assertEqual(statuses[self.confirmed.pk], Reservation.CONFIRMED)
+        self.assertEqual(statuses[self.pending.pk], Reservation.TEMP)
+
+        reserved = dict(Accommodation.objects.values_list('accommodation_id', 'is_reserved'))
+        self.assertEqual([reserved[flat.pk] for flat in self.flats], [False, True, True])
+
+    def test_holds_are_released_in_batches(self):
+        release_batch = release_expired_holds.Command.release_batch
+        with mock.patch.object(release_expired_holds.Command, 'release_batch', autospec=True, side_effect=release_batch) as batches:
+            self.assertIn("Released 3 expired holds", self.release(batch_size=2))
+        # Two batches of expired holds and the empty one that ends the sweep
+        self.assertEqual([call.args[1] for call in batches.call_args_list], [2, 2, 2])
+        self.assertEqual(Reservation.objects.filter(status=Reservation.CANCELED).count(), 3)
+
+    def test_nothing_to_release(self):
+        self.release()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIn("Released 0 expired holds", self.release())
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
\ No newline at end of file
@@ -3,4 +3,5 @@ from . import views
 
 urlpatterns = [
     path('api_rate', views.api_rate,name='api_rate'),
+    path('api_rate_batch', views.api_rate_batch, name='api_rate_batch'),
 ]
@@ -2,6 +2,7 @@ from django.shortcuts import render, HttpResponse, get_object_or_404
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 from django.http import JsonResponse
+from django.db import IntegrityError, transaction
 from .models import Accommodation,Rating, User, Reservation
 from .serializers import AccommodationSerializer, RatingSerializer, ReservationSerializer
 # Create your views here.
@@ -12,26 +13,42 @@ def api_rate(request):
     userId = request.POST.get('userId')
     try:
         user = User.objects.get(user_id=userId)
-        print(user.name)
     except User.DoesNotExist:
         return JsonResponse({'error': 'User not found'}, status=404)  
     reservation_id = request.POST.get('reservId')
     accommodation_id = request.POST.get('accId')
     newRating = request.POST.get('rating')
     date = request.POST.get('date')
-    rating = Rating.objects.create(
-            reservation=Reservation.objects.get(reservation_id=reservation_id),
-            rating=newRating,
-            date=date
-        )
     try:
-        accommodation = Accommodation.objects.get(accommodation_id=accommodation_id)
-        count = accommodation.rating_count
-        accommodation.rating_count = count + 1
-        accommodation.average_rating = (accommodation.average_rating * count + int(newRating)) / (count + 1)
-        accommodation.save()
-    except Accommodation.DoesNotExist:
+        newRating = int(newRating)
+        if not 0 <= newRating <= 5:
+            raise ValueError
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Rating must be an integer between 0 and 5'}, status=400)
+    try:
+        reservation = Reservation.objects.only('reservation_id', 'accommodation_id').get(reservation_id=reservation_id)
+    except Reservation.DoesNotExist:
+        return JsonResponse({'error': 'Reservation not found'}, status=404)
+    if accommodation_id and str(reservation.accommodation_id) != str(accommodation_id):
         return JsonResponse({'error': 'Accommodation not found'}, status=404)
+
+    # The update_accommodation_rating_insert trigger updates rating_count and
+    # average_rating inside the INSERT itself, so concurrent ratings cannot
+    # overwrite each other and the aggregate is only counted once.
+    # Lookups stay outside the transaction so it starts with the write.
+    try:
+        with transaction.atomic():
+            rating = Rating.objects.create(
+                    reservation=reservation,
+                    rating=newRating,
+                    date=date
+                )
+            accommodation = Accommodation.objects.only('average_rating', 'rating_count').get(
+                accommodation_id=reservation.accommodation_id
+            )
+    except IntegrityError:
+        # Rating.reservation_id is UNIQUE
+        return JsonResponse({'error': 'Reservation already rated'}, status=400)
     serializers_rating = RatingSerializer(rating)
     serializers_accommodation = AccommodationSerializer(accommodation)
     serializer = [serializers_rating.data, serializers_accommodation.data]
@@ -41,3 +58,75 @@ def api_rate(request):
         'data': serializer
     }
     return Response(content)
+
+# Most ratings accepted by one api_rate_batch request
+MAX_BATCH_RATINGS = 5000
+
+# api for adding many ratings at once Epic5
+@api_view(['POST'])
+def api_rate_batch(request):
+    """
+    Add a list of ratings, e.g. {"ratings": [{"reservId": 5, "rating": 4}, ...]}.
+    Every item is validated with a few set-based queries and the valid ratings
+    are inserted together; the rating triggers update the aggregates of each
+    accommodation as the rows are inserted.
+    """
+    items = request.data.get('ratings') if isinstance(request.data, dict) else None
+    if not isinstance(items, list) or not items:
+        return JsonResponse({'error': 'ratings must be a non-empty list'}, status=400)
+    if len(items) > MAX_BATCH_RATINGS:
+        return JsonResponse({'error': f'At most {MAX_BATCH_RATINGS} ratings per request'}, status=400)
+
+    # Parse the items and reject malformed or repeated ones
+    results = [None] * len(items)
+    parsed = {}
+    for index, item in enumerate(items):
+        try:
+            reservation_id = int(item['reservId'])
+            rating = int(item['rating'])
+        except (TypeError, KeyError, ValueError):
+            results[index] = {'index': index, 'status': 'error', 'error': 'reservId and rating must be integers'}
+            continue
+        if not 0 <= rating <= 5:
+            results[index] = {'index': index, 'status': 'error', 'error': 'Rating must be an integer between 0 and 5'}
+        elif reservation_id in parsed:
+            results[index] = {'index': index, 'status': 'error', 'error': 'Reservation rated twice in this request'}
+        else:
+            parsed[reservation_id] = (index, rating)
+
+    # The transaction takes the write lock when it begins (transaction_mode IMMEDIATE),
+    # so no other request can rate these reservations between the checks and the insert
+    with transaction.atomic():
+        # One query for the reservations and one for the ratings that already exist
+        accommodations = dict(
+            Reservation.objects.filter(reservation_id__in=parsed).values_list('reservation_id', 'accommodation_id')
+        )
+        already_rated = set(Rating.objects.filter(reservation_id__in=parsed).values_list('reservation_id', flat=True))
+
+        new_ratings = []
+        for reservation_id, (index, rating) in parsed.items():
+            if reservation_id not in accommodations:
+                results[index] = {'index': index, 'status': 'error', 'error': 'Reservation not found'}
+            elif reservation_id in already_rated:
+                results[index] = {'index': index, 'status': 'error', 'error': 'Reservation already rated'}
+            else:
+                new_ratings.append((index, Rating(reservation_id=reservation_id, rating=rating)))
+
+        # update_accommodation_rating_insert runs for every inserted row
+        created = Rating.objects.bulk_create([rating for _, rating in new_ratings])
+
+    affected = sorted({accommodations[rating.reservation_id] for _, rating in new_ratings})
+
+    for (index, _), rating in zip(new_ratings, created):
+        results[index] = {'index': index, 'status': 'success', 'rating_id': rating.rating_id}
+
+    aggregates = Accommodation.objects.filter(accommodation_id__in=affected).only('average_rating', 'rating_count')
+    content = {
+        'status': 'success',
+        'message': f'{len(created)} of {len(items)} ratings added',
+        'results': results,
+        'accommodations': [
+            {'accommodation_id': acc.accommodation_id, **AccommodationSerializer(acc).data} for acc in aggregates
+        ],
+    }
+    return Response(content)
\ No newline at end of file
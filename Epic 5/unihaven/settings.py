@@ -11,10 +11,14 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Shared helpers in ../database (create_dbV3, dbutils, ...) are imported as top-level modules
+sys.path.append(str(BASE_DIR.parent / "database"))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -77,6 +81,13 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "unihaven.db",
+        # A file rather than the default in-memory database, so tests running
+        # requests in parallel threads get SQLite's real locking
+        "TEST": {"NAME": BASE_DIR / "test_unihaven.db"},
+        # Transactions take the write lock when they begin, waiting up to "timeout"
+        # seconds for another writer, instead of failing with "database is locked"
+        # when a transaction that has read tries to write
+        "OPTIONS": {"transaction_mode": "IMMEDIATE", "timeout": 5},
     }
 }
 
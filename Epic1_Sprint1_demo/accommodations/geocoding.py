@@ -0,0 +1,48 @@
+# accommodations/geocoding.py
+from django.conf import settings
+from geoclient import UNAVAILABLE, GeocodingClient, django_geocoder
+import requests
+import xml.etree.ElementTree as ET
+
+ALS_LOOKUP_URL = getattr(settings, 'ALS_LOOKUP_URL', "https://www.als.gov.hk/lookup")
+
+client = GeocodingClient()
+
+geocoder = django_geocoder(client.max_concurrent)
+memory_cache = geocoder.memory_cache
+
+def fetch_geocode(address):
+    """
+    (None, latitude, longitude) from DATA.GOV.HK API, None if ALS cannot locate the
+    address and UNAVAILABLE if the request fails.
+    """
+    try:
+        response = client.get(ALS_LOOKUP_URL, params={"q": address})
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Geocoding request failed for '{address}': {e}")
+        return UNAVAILABLE
+    try:
+        root = ET.fromstring(response.content)
+        lat = float(root.find(".//Latitude").text)
+        lon = float(root.find(".//Longitude").text)
+        return None, lat, lon
+    except (ET.ParseError, AttributeError, TypeError, ValueError) as e:
+        print(f"Geocoding failed for '{address}': {e}")
+        return None
+
+def geocode_many(addresses):
+    """
+    Latitude and longitude for each address, in order, (None, None) where it cannot be found.
+    Cached results come from the in-process LRU or the GeocodeCache table;
+    the remaining addresses are looked up in ALS concurrently.
+    """
+    return [(result[1], result[2]) if result else (None, None)
+            for result in geocoder.geocode_many(addresses, fetch_geocode)]
+
+def get_geocode_by_address(address):
+    """
+    Latitude and longitude for an address, (None, None) if it cannot be found.
+    Checks the in-process LRU, then the GeocodeCache table, and only then calls ALS.
+    """
+    return geocode_many([address])[0]
\ No newline at end of file
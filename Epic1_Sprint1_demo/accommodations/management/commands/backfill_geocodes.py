@@ -0,0 +1,64 @@
+# accommodations/management/commands/backfill_geocodes.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
+from accommodations.geocoding import geocode_many
+from accommodations.models import Accommodation, GeocodeQueue
+import time
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(minutes=10)  # Doubled after every failed attempt
+
+class Command(BaseCommand):
+    help = "Geocode accommodations saved without coordinates, in batches from GeocodeQueue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+        parser.add_argument('--watch', action='store_true', help="Keep polling the queue instead of exiting when it is empty")
+        parser.add_argument('--interval', type=int, default=30, help="Seconds between polls with --watch")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            done = self.process_batch(options['batch_size'], options['max_attempts'])
+            total += done
+            if done:
+                continue
+            if not options['watch']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {total} queued accommodations"))
+
+    def process_batch(self, batch_size, max_attempts):
+        """Geocode one batch of due queue entries and return how many were processed."""
+        now = timezone.now()
+        batch = list(
+            GeocodeQueue.objects.select_related('accommodation')
+            .filter(next_attempt_at__lte=now, attempts__lt=max_attempts)
+            .order_by('next_attempt_at', 'accommodation_id')[:batch_size]
+        )
+        if not batch:
+            return 0
+
+        # Look up every address before writing so the batch is saved in one short transaction
+        results = zip(batch, geocode_many([entry.accommodation.address for entry in batch]))
+        with transaction.atomic():
+            for entry, (lat, lon) in results:
+                accommodation = entry.accommodation
+                if lat is None or lon is None:
+                    entry.attempts += 1
+                    entry.next_attempt_at = now + RETRY_DELAY * 2 ** (entry.attempts - 1)
+                    entry.last_error = "Address not found"
+                    entry.save()
+                    self.stderr.write(f"Could not geocode accommodation {accommodation.accommodation_id}: {accommodation.address}")
+                    continue
+
+                # The campus distance triggers store its distances along with the coordinates
+                Accommodation.objects.filter(pk=accommodation.pk).update(
+                    latitude=lat, longitude=lon, geo_address=accommodation.address
+                )
+                entry.delete()
+        return len(batch)
\ No newline at end of file
@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from availability import claim_accommodation
 
 # User model
 class User(models.Model):
@@ -39,11 +40,28 @@ class Accommodation(models.Model):
     longitude = models.FloatField()
     geo_address = models.TextField()
     is_reserved = models.BooleanField(default=False)
+    # Kept up to date by the rating triggers in the database; save() does not write them back
+    average_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0, editable=False)
+    rating_count = models.IntegerField(default=0, editable=False)
+    rating_score = models.FloatField(default=3.0, editable=False)  # Bayesian score, see database/dbutils.py
 
     class Meta:
         db_table = 'Accommodation'  # Match the exact table name in your database
         managed = False            # Tell Django this table is managed externally
 
+    # Columns written only by database triggers
+    DB_MAINTAINED = ['average_rating', 'rating_count', 'rating_score']
+
+    def save(self, *args, **kwargs):
+        # A full save of a row loaded earlier would write back stale copies of the
+        # columns the triggers maintain, so only the other columns are updated
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DB_MAINTAINED
+            ]
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.type} at {self.address}"
 
@@ -66,6 +84,9 @@ class Reservation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     accommodation = models.ForeignKey(Accommodation, on_delete=models.CASCADE)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=TEMP)  
+    # Stay from check_in up to (not including) check_out; without dates the whole listing is held
+    check_in = models.DateField(null=True, blank=True)
+    check_out = models.DateField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
 
@@ -76,14 +97,29 @@ class Reservation(models.Model):
     def save(self, *args, **kwargs):
         if self.status == self.TEMP and not self.expires_at:
             self.expires_at = timezone.now() + timezone.timedelta(hours=24)
-        if self.status == self.CONFIRMED:
-            self.accommodation.is_reserved = True
-            self.accommodation.save()
-        elif self.status in [self.CANCELED, self.COMPLETED]:
-            self.accommodation.is_reserved = False
-            self.accommodation.save()
-        
-        super().save(*args, **kwargs)
+        # The accommodation and the reservation are written together or not at all
+        with transaction.atomic():
+            if self._state.adding and self.status not in [self.CANCELED, self.COMPLETED]:
+                self.claim_accommodation()
+            elif self.status == self.CONFIRMED:
+                self.accommodation.is_reserved = True
+                self.accommodation.save(update_fields=['is_reserved'])
+            elif self.status in [self.CANCELED, self.COMPLETED]:
+                # Other reservations of the same accommodation may still hold it
+                self.accommodation.is_reserved = Reservation.objects.filter(
+                    accommodation_id=self.accommodation_id
+                ).exclude(status__in=[self.CANCELED, self.COMPLETED]).exclude(pk=self.pk).exists()
+                self.accommodation.save(update_fields=['is_reserved'])
+
+            super().save(*args, **kwargs)
+
+    def claim_accommodation(self):
+        """
+        Mark the accommodation reserved with one conditional UPDATE that only matches
+        while the stay lies inside the listing and no active reservation overlaps it,
+        so two bookings made at the same time cannot both claim it
+        """
+        claim_accommodation(self)
 
     def is_active(self):
         return self.status == self.TEMP and timezone.now() < self.expires_at
@@ -120,4 +156,50 @@ class Campus(models.Model):
         managed = False     # Tell Django this table is managed externally
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+# Precomputed distance from an accommodation to a campus
+class AccommodationCampusDistance(models.Model):
+    pk = models.CompositePrimaryKey('accommodation_id', 'campus_id')
+    accommodation = models.ForeignKey(Accommodation, on_delete=models.CASCADE, related_name='campus_distances')
+    campus = models.ForeignKey(Campus, on_delete=models.CASCADE, related_name='accommodation_distances')
+    distance = models.FloatField()
+
+    class Meta:
+        db_table = 'AccommodationCampusDistance'  # Match the exact table name in your database
+        managed = False                         # Tell Django this table is managed externally
+
+    def __str__(self):
+        return f"{self.distance:.2f} km from {self.campus_id} to {self.accommodation_id}"
+
+
+# Cached ALS address lookup (found=False caches a failed lookup)
+class GeocodeCache(models.Model):
+    address_key = models.CharField(max_length=255, primary_key=True)
+    geo_address = models.TextField(null=True)
+    latitude = models.FloatField(null=True)
+    longitude = models.FloatField(null=True)
+    found = models.BooleanField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'GeocodeCache'  # Match the exact table name in your database
+        managed = False           # Tell Django this table is managed externally
+
+    def __str__(self):
+        return self.address_key
+
+
+# Accommodation waiting for the geocode backfill worker (see backfill_geocodes)
+class GeocodeQueue(models.Model):
+    accommodation = models.OneToOneField(Accommodation, on_delete=models.CASCADE, primary_key=True, related_name='geocode_queue')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(null=True)
+
+    class Meta:
+        db_table = 'GeocodeQueue'  # Match the exact table name in your database
+        managed = False           # Tell Django this table is managed externally
+
+    def __str__(self):
+        return f"Geocode accommodation {self.accommodation_id} (attempt {self.attempts})"
\ No newline at end of file
@@ -0,0 +1,54 @@
+from django.db.models import FloatField, Q, Value
+import base64
+import binascii
+import json
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(sort_key, accommodation_id):
+    """Opaque cursor for the position after (sort_key, accommodation_id)"""
+    data = json.dumps([sort_key, accommodation_id]).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+def decode_cursor(cursor):
+    """(sort_key, accommodation_id) from a cursor, ValueError if it is malformed"""
+    try:
+        sort_key, accommodation_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(accommodation_id, int) or not isinstance(sort_key, (int, float)):
+        raise ValueError("Invalid cursor")
+    return sort_key, accommodation_id
+
+def after_cursor(queryset, sort_field, cursor, descending=False):
+    """
+    Rows ordered after the cursor by (sort_field, accommodation_id),
+    or by (sort_field DESC, accommodation_id DESC) when descending
+    """
+    sort_key, accommodation_id = cursor
+    after = 'lt' if descending else 'gt'
+    # Compare as a float so DecimalField rounding cannot skip or repeat rows
+    sort_key = Value(sort_key, output_field=FloatField())
+    # The first condition alone is a range on the sort index, so a later page seeks
+    # to the cursor instead of reading every row before it
+    return queryset.filter(
+        Q(**{f'{sort_field}__{after}e': sort_key}),
+        Q(**{f'{sort_field}__{after}': sort_key}) | Q(**{f'accommodation_id__{after}': accommodation_id}),
+    )
+
+def paginate(request, queryset, sort_field, limit, cursor=None, descending=False):
+    """One page of a queryset ordered by (sort_field, accommodation_id) and the URL of the next page"""
+    if cursor is not None:
+        queryset = after_cursor(queryset, sort_field, cursor, descending)
+
+    # Fetch one extra row to know whether there is a next page
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    params = request.GET.copy()
+    params['cursor'] = encode_cursor(getattr(last, sort_field), last.accommodation_id)
+    return rows, request.build_absolute_uri('?' + params.urlencode())
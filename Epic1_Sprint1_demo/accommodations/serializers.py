@@ -3,7 +3,13 @@ from rest_framework import serializers
 from .models import Accommodation
 
 class AccommodationSerializer(serializers.ModelSerializer):
+    geocode_pending = serializers.SerializerMethodField()
+
     class Meta:
         model = Accommodation
         fields = '__all__'
-        read_only_fields = ('is_reserved',)
\ No newline at end of file
+        read_only_fields = ('is_reserved',)
+
+    def get_geocode_pending(self, obj):
+        # Coordinates are filled in later by the backfill_geocodes command
+        return obj.latitude is None or obj.longitude is None
\ No newline at end of file
@@ -1,3 +1,200 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.utils import timezone
+from create_dbV3 import create_schema, drop_schema
+from dbutils import haversine
+from .management.commands import backfill_geocodes
+from .models import Accommodation, AccommodationCampusDistance, Campus, GeocodeQueue, Rating, Reservation, User
+from .pagination import encode_cursor
+import base64
+import json
 
 # Create your tests here.
+
+class UnihavenSchemaTestCase(TestCase):
+    """
+    The models are unmanaged, so the test database gets the tables, triggers and
+    indexes of unihaven.db from create_dbV3.py and migrate.py.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        connection.ensure_connection()
+        cls.schema_tables = create_schema(connection.connection)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        drop_schema(connection.connection, cls.schema_tables)
+
+def create_accommodation(address, latitude=None, longitude=None, price=10000):
+    return Accommodation.objects.create(
+        type="Flat", availability_start="2025-01-01", availability_end="2025-06-30",
+        beds=2, bedrooms=1, price=price, address=address,
+        latitude=latitude, longitude=longitude, geo_address="",
+    )
+
+class GeocodeQueueTest(UnihavenSchemaTestCase):
+    def test_accommodation_saved_without_coordinates_is_queued(self):
+        queued = create_accommodation("1 Pok Fu Lam Road")
+        located = create_accommodation("2 Pok Fu Lam Road", 22.283, 114.137)
+        self.assertTrue(GeocodeQueue.objects.filter(accommodation=queued).exists())
+        self.assertFalse(GeocodeQueue.objects.filter(accommodation=located).exists())
+
+    def test_address_change_is_queued_once_coordinates_are_cleared(self):
+        accommodation = create_accommodation("1 Pok Fu Lam Road", 22.283, 114.137)
+        accommodation.address = "3 Pok Fu Lam Road"
+        accommodation.latitude = accommodation.longitude = None
+        accommodation.save()
+        self.assertEqual(GeocodeQueue.objects.get().accommodation_id, accommodation.pk)
+
+        # Saving it again while it waits does not queue it twice
+        accommodation.save()
+        self.assertEqual(GeocodeQueue.objects.count(), 1)
+
+    def test_deleted_accommodation_leaves_the_queue(self):
+        accommodation = create_accommodation("1 Pok Fu Lam Road")
+        accommodation.delete()
+        self.assertFalse(GeocodeQueue.objects.exists())
+
+class BackfillGeocodesTest(UnihavenSchemaTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.campus = Campus.objects.create(campus_id=1, name="Main Campus", latitude=22.283, longitude=114.137)
+        cls.accommodations = [create_accommodation(f"{i} Pok Fu Lam Road") for i in range(5)]
+
+    def stub_geocoder(self, locate):
+        """Replace ALS with locate(address) -> (lat, lon), recording the batches it is given."""
+        batches = []
+
+        def geocode_many(addresses):
+            batches.append(list(addresses))
+            return [locate(address) for address in addresses]
+
+        patcher = mock.patch.object(backfill_geocodes, 'geocode_many', side_effect=geocode_many)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return batches
+
+    def backfill(self, **options):
+        call_command('backfill_geocodes', stdout=StringIO(), stderr=StringIO(), **options)
+
+    def test_queue_is_geocoded_in_batches(self):
+        batches = self.stub_geocoder(lambda address: (22.28 + int(address[0]) / 1000, 114.14))
+        self.backfill(batch_size=2)
+
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(sorted(sum(batches, [])), sorted(a.address for a in self.accommodations))
+        self.assertFalse(GeocodeQueue.objects.exists())
+        for i, accommodation in enumerate(self.accommodations):
+            accommodation.refresh_from_db()
+            self.assertEqual((accommodation.latitude, accommodation.longitude), (22.28 + i / 1000, 114.14))
+
+    def test_geocoded_accommodations_get_their_campus_distances(self):
+        self.stub_geocoder(lambda address: (22.28 + int(address[0]) / 1000, 114.14))
+        self.assertFalse(AccommodationCampusDistance.objects.exists())
+        self.backfill()
+
+        for i, accommodation in enumerate(self.accommodations):
+            stored = AccommodationCampusDistance.objects.get(accommodation=accommodation, campus=self.campus)
+            expected = haversine(22.28 + i / 1000, 114.14, self.campus.latitude, self.campus.longitude)
+            self.assertAlmostEqual(stored.distance, expected, places=6)
+
+    def test_failed_lookups_are_retried_with_backoff(self):
+        batches = self.stub_geocoder(lambda address: (None, None))
+        before = timezone.now()
+        self.backfill(max_attempts=3)
+        self.assertEqual(len(batches), 1)
+
+        for attempt in (1, 2):
+            entry = GeocodeQueue.objects.get(accommodation=self.accommodations[0])
+            self.assertEqual(entry.attempts, attempt)
+            self.assertEqual(entry.last_error, "Address not found")
+            delay = backfill_geocodes.RETRY_DELAY * 2 ** (attempt - 1)
+            self.assertAlmostEqual(entry.next_attempt_at - before, delay, delta=timedelta(minutes=1))
+
+            # Entries are skipped until they are due again
+            self.backfill(max_attempts=3)
+            self.assertEqual(len(batches), attempt)
+            before = timezone.now()
+            GeocodeQueue.objects.update(next_attempt_at=before)
+            self.backfill(max_attempts=3)
+            self.assertEqual(len(batches), attempt + 1)
+
+        # After max_attempts the entries stay queued but are no longer looked up
+        GeocodeQueue.objects.update(next_attempt_at=timezone.now())
+        self.backfill(max_attempts=3)
+        self.assertEqual(len(batches), 3)
+        self.assertEqual(set(GeocodeQueue.objects.values_list('attempts', flat=True)), {3})
+
+class SearchPaginationTest(UnihavenSchemaTestCase):
+    # Several rows share each price, rating score and location, so every order has ties
+    PRICES = [9000, 8000, 9000, 8000, 9000, 10000, 8000]
+    LATITUDES = [22.29, 22.3, 22.29, 22.31, 22.3, 22.29, 22.31]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.campus = Campus.objects.create(campus_id=1, name="Main Campus", latitude=22.283, longitude=114.137)
+        cls.accommodations = [
+            create_accommodation(f"{i} Pok Fu Lam Road", latitude, 114.137, price)
+            for i, (price, latitude) in enumerate(zip(cls.PRICES, cls.LATITUDES))
+        ]
+        user = User.objects.create(name="Student", email="student@connect.hku.hk", password="x", role=User.STUDENT)
+        for accommodation in cls.accommodations[:2]:
+            reservation = Reservation.objects.create(user=user, accommodation=accommodation, status=Reservation.COMPLETED)
+            Rating.objects.create(reservation=reservation, rating=5)
+
+    def search(self, **params):
+        return self.client.get('/accommodations/api/search/', params)
+
+    def walk(self, **params):
+        """accommodation_id of every row, following the next links page by page."""
+        response = self.search(limit=2, **params)
+        ids = []
+        while True:
+            self.assertEqual(response.status_code, 200, response.content)
+            body = response.json()
+            self.assertLessEqual(len(body['accommodations']), 2)
+            ids += [row['accommodation_id'] for row in body['accommodations']]
+            if not body['next']:
+                return ids
+            response = self.client.get(body['next'])
+
+    def test_page_walk_has_no_duplicates_or_gaps(self):
+        rows = Accommodation.objects.all()
+        by_price = [a.pk for a in sorted(rows, key=lambda a: (a.price, a.pk))]
+        by_rating = [a.pk for a in sorted(rows, key=lambda a: (a.rating_score, a.pk), reverse=True)]
+        by_distance = [a.pk for a in sorted(rows, key=lambda a: (a.latitude, a.pk))]
+        self.assertEqual(self.walk(sort='price'), by_price)
+        self.assertEqual(self.walk(sort='rating'), by_rating)
+        self.assertEqual(self.walk(campus=1, sort='distance'), by_distance)
+        self.assertEqual(self.walk(campus=1, sort='price'), by_price)
+
+    def test_sort_defaults_to_price_without_a_campus(self):
+        body = self.search().json()
+        self.assertIn("Sorted by price", body['filters'])
+        self.assertEqual(
+            [row['accommodation_id'] for row in body['accommodations']],
+            [a.pk for a in sorted(self.accommodations, key=lambda a: (a.price, a.pk))],
+        )
+        self.assertIn("Sorted by distance from: Main Campus", self.search(campus=1).json()['filters'])
+
+    def test_invalid_and_tampered_cursors_are_rejected(self):
+        def encode(value):
+            return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+        valid = encode_cursor(9000.0, self.accommodations[0].pk)
+        self.assertEqual(self.search(cursor=valid).status_code, 200)
+        for cursor in [
+            "not a cursor", valid[:-4], base64.urlsafe_b64encode(b"not json").decode(),
+            encode(["9000", 1]), encode([9000, "1"]), encode([9000, 1, 2]), encode({"price": 9000}),
+        ]:
+            with self.subTest(cursor=cursor):
+                response = self.search(cursor=cursor)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['errors']['cursor'], ['Invalid cursor.'])
\ No newline at end of file
@@ -4,14 +4,14 @@ from django.shortcuts import render
 from .forms import AccommodationSearchForm
 from .models import Accommodation, Campus
 from .serializers import AccommodationSerializer
-import requests
-import xml.etree.ElementTree as ET
-import math
 from rest_framework.response import Response
 from datetime import datetime
 from rest_framework.views import APIView
 from rest_framework import status
 from django.shortcuts import get_object_or_404
+from django.db.models import ExpressionWrapper, F, FilteredRelation, FloatField, Q
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, paginate
+from availability import available_between
 
 class Search_Accommodations_API(APIView):
     def get(self, request):
@@ -87,6 +87,32 @@ class Search_Accommodations_API(APIView):
             else:
                 errors['is_reserved'] = ['A valid boolean value is required (e.g., true, 1, false, 0).']
         
+        # Validate page size and keyset cursor
+        limit = params.get('limit')
+        if limit is None:
+            limit = DEFAULT_PAGE_SIZE
+        else:
+            try:
+                limit = int(limit)
+                if not 1 <= limit <= MAX_PAGE_SIZE:
+                    errors['limit'] = [f'Ensure this value is between 1 and {MAX_PAGE_SIZE}.']
+            except ValueError:
+                errors['limit'] = ['A valid integer is required.']
+        
+        cursor = params.get('cursor')
+        if cursor is not None:
+            try:
+                cursor = decode_cursor(cursor)
+            except ValueError:
+                errors['cursor'] = ['Invalid cursor.']
+        
+        # Validate sort order, by distance when a campus is given and by price otherwise
+        sort = params.get('sort', 'distance' if campus_id is not None else 'price')
+        if sort not in ('distance', 'price', 'rating'):
+            errors['sort'] = ['Must be one of distance, price, rating.']
+        elif sort == 'distance' and campus_id is None:
+            errors['sort'] = ['Sorting by distance requires a campus.']
+        
         if errors:
             return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
         
@@ -95,9 +121,12 @@ class Search_Accommodations_API(APIView):
         
         if accommodation_type:
             queryset = queryset.filter(type=accommodation_type)
-        if start_date:
+        if start_date and end_date:
+            # Free for the whole window, answered from the availability interval index
+            queryset = available_between(queryset, start_date, end_date)
+        elif start_date:
             queryset = queryset.filter(availability_start__lte=start_date)
-        if end_date:
+        elif end_date:
             queryset = queryset.filter(availability_end__gte=end_date)
         if min_beds is not None:
             queryset = queryset.filter(beds__gte=min_beds)
@@ -108,30 +137,34 @@ class Search_Accommodations_API(APIView):
         if is_reserved_bool is not None:
             queryset = queryset.filter(is_reserved=is_reserved_bool)
         
-        # Process accommodations: geocode if needed
-        accommodations = list(queryset)
-        for acc in accommodations:
-            if acc.latitude is None or acc.longitude is None:
-                lat, lon = get_geocode_by_address(acc.address)
-                if lat is not None and lon is not None:
-                    acc.latitude = lat
-                    acc.longitude = lon
-                    acc.geo_address = acc.address  # Assuming geo_address is the same as address
-                    acc.save()
-        
-        # Calculate distances and sort if campus is provided
-        campus_name = None
-        if campus:
-            campus_lat = campus.latitude
-            campus_lon = campus.longitude
-            campus_name = campus.name
-            for acc in accommodations:
-                distance = calc_distance(acc.latitude, acc.longitude, campus_lat, campus_lon)
-                acc.distance = distance
-            accommodations.sort(key=lambda x: x.distance)
+        # Order by distance from the campus, price or rating score and fetch one
+        # page with a keyset cursor on (sort key, accommodation_id); price and
+        # rating walk idx_accommodation_price / idx_accommodation_rating_score
+        descending = False
+        tie_field = 'accommodation_id'
+        if sort == 'distance':
+            queryset = nearest_first(queryset, campus)
+            sort_field = 'distance'
+            tie_field = 'campus_distances__accommodation_id'
         else:
-            for acc in accommodations:
-                acc.distance = None
+            if campus:
+                queryset = with_campus_distance(queryset, campus)
+            if sort == 'price':
+                queryset = queryset.annotate(price_key=ExpressionWrapper(F('price'), output_field=FloatField()))
+                sort_field = 'price_key'
+            else:
+                sort_field = 'rating_score'
+                descending = True
+        if descending:
+            queryset = queryset.order_by(F(sort_field).desc(), F(tie_field).desc())
+        else:
+            queryset = queryset.order_by(sort_field, tie_field)
+        accommodations, next_url = paginate(request, queryset, sort_field, limit, cursor, descending)
+        
+        # Rows without coordinates are geocoded by the backfill_geocodes command,
+        # search only reads what is stored and marks them geocode_pending
+        
+        campus_name = campus.name if campus else None
         
         # Build filters list
         filters = []
@@ -152,14 +185,19 @@ class Search_Accommodations_API(APIView):
         if is_reserved_bool is not None:
             status_str = "Reserved accommodations only" if is_reserved_bool else "Available for reservation only"
             filters.append(status_str)
-        if campus:
+        if sort == 'distance':
             filters.append(f"Sorted by distance from: {campus_name}")
+        elif sort == 'rating':
+            filters.append("Sorted by rating")
+        else:
+            filters.append("Sorted by price")
         
         # Serialize data
         serializer = AccommodationSerializer(accommodations, many=True)
         response_data = {
             'filters': filters,
-            'accommodations': serializer.data
+            'accommodations': serializer.data,
+            'next': next_url
         }
         
         return Response(response_data, status=status.HTTP_200_OK)
@@ -168,7 +206,6 @@ class Search_Accommodations_API(APIView):
 
 
     
-# 保持其他函数（get_geocode_by_address, calc_distance, search_accommodations）不变
 def search_accommodations(request):
     form = AccommodationSearchForm(request.GET or None)
     accommodations = []
@@ -184,9 +221,10 @@ def search_accommodations(request):
             query = query.filter(type=form.cleaned_data['accommodation_type'])
 
         if form.cleaned_data['availability_start'] and form.cleaned_data['availability_end']:
-            query = query.filter(
-                availability_start__lte=form.cleaned_data['availability_end'].isoformat(),
-                availability_end__gte=form.cleaned_data['availability_start'].isoformat()
+            query = available_between(
+                query,
+                form.cleaned_data['availability_start'],
+                form.cleaned_data['availability_end']
             )
 
         if form.cleaned_data['min_beds']:
@@ -198,24 +236,13 @@ def search_accommodations(request):
         if form.cleaned_data['max_price']:
             query = query.filter(price__lte=form.cleaned_data['max_price'])
 
-        accommodations = list(query)
-
-        # Sort by distance if a campus is selected
+        # Sort by distance if a campus is selected, rows still waiting to be geocoded last
         if form.cleaned_data['campus']:
-            campus = form.cleaned_data['campus']
-            campus_lat, campus_lon = campus.latitude, campus.longitude
-
-            for acc in accommodations:
-                # Geocode address if coordinates are missing
-                if not acc.latitude or not acc.longitude:
-                    acc.latitude, acc.longitude = get_geocode_by_address(acc.address)
-                    acc.save()  # Save coordinates to the database
-
-                # Calculate distance
-                acc.distance = calc_distance(acc.latitude, acc.longitude, campus_lat, campus_lon)
+            query = with_campus_distance(query, form.cleaned_data['campus']).order_by(
+                F('distance').asc(nulls_last=True), 'accommodation_id'
+            )
 
-            # Sort accommodations by distance
-            accommodations.sort(key=lambda x: x.distance)
+        accommodations = list(query)
         # Collect applied filters
         accommodation_type = form.cleaned_data.get('accommodation_type')
         if accommodation_type:
@@ -252,24 +279,23 @@ def search_accommodations(request):
         'active_filters': active_filters  # Add to context
     })
 
-def get_geocode_by_address(address):
-    """Fetch latitude and longitude from DATA.GOV.HK API."""
-    try:
-        response = requests.get("https://www.als.gov.hk/lookup", params={"q": address}, timeout=10)
-        response.raise_for_status()
-        root = ET.fromstring(response.content)
-        lat = float(root.find(".//Latitude").text)
-        lon = float(root.find(".//Longitude").text)
-        return lat, lon
-    except Exception as e:
-        print(f"Geocoding failed for '{address}': {e}")
-        return None, None
+def with_campus_distance(queryset, campus):
+    """
+    Annotate the distance stored in AccommodationCampusDistance, which triggers keep
+    for every geocoded row (None for rows still waiting to be geocoded).
+    """
+    return queryset.annotate(
+        campus_distance=FilteredRelation(
+            'campus_distances', condition=Q(campus_distances__campus_id=campus.campus_id)
+        ),
+    ).annotate(distance=F('campus_distance__distance'))
 
-def calc_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance using equirectangular approximation."""
-    if None in (lat1, lon1, lat2, lon2):
-        return float('inf')
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-    x = (lon2 - lon1) * math.cos((lat1 + lat2) / 2)
-    y = lat2 - lat1
-    return math.sqrt(x**2 + y**2) * 6371  # Earth radius in km
\ No newline at end of file
+def nearest_first(queryset, campus):
+    """
+    Geocoded rows annotated with their stored distance from the campus, joined from
+    the campus's entries in idx_campus_distance so ordering by (distance,
+    campus_distances__accommodation_id) reads that index without sorting.
+    """
+    return queryset.filter(campus_distances__campus_id=campus.campus_id).annotate(
+        distance=F('campus_distances__distance'),
+    )
\ No newline at end of file
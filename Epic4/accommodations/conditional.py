@@ -0,0 +1,32 @@
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+import hashlib
+
+def etag_for(accommodations, *extra):
+    """
+    ETag for a response showing these accommodations. It changes whenever one of
+    them gets a new version; extra values (such as the next page cursor) are
+    folded into it as well.
+    """
+    parts = [f'{a.accommodation_id}:{a.version}' for a in accommodations]
+    parts += [str(value) for value in extra]
+    return quote_etag(hashlib.sha256(','.join(parts).encode()).hexdigest()[:32])
+
+def validators(accommodation):
+    """(ETag, Last-Modified timestamp) for a response showing a single accommodation"""
+    last_modified = int(accommodation.updated_at.timestamp()) if accommodation.updated_at else None
+    return etag_for([accommodation]), last_modified
+
+def not_modified(request, etag, last_modified=None):
+    """A 304 response if the client's copy is still current, otherwise None"""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+def set_validators(response, etag, last_modified=None):
+    """Add the ETag and, if given, Last-Modified headers to a response"""
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
\ No newline at end of file
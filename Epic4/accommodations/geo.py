@@ -0,0 +1,47 @@
+from django.db.models.expressions import RawSQL
+import math
+
+EARTH_RADIUS_KM = 6371
+
+# nearest=k searches start with this radius and double it until k results are found
+NEAREST_START_KM = 0.5
+NEAREST_MAX_KM = 64
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between two points, None if a coordinate is missing"""
+    if None in (lat1, lon1, lat2, lon2):
+        return None
+    lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    return EARTH_RADIUS_KM * 2 * math.asin(math.sqrt(a))
+
+def bounding_box(lat, lon, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) of the box enclosing a circle around a point"""
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    dlon = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(lat))))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+def within_radius(queryset, campus, radius_km):
+    """Accommodations within radius_km of the campus; the queryset must be annotated with distance"""
+    # The AccommodationLocation R*Tree narrows the search to the bounding box,
+    # so only the rows inside it have their exact distance checked
+    min_lat, max_lat, min_lon, max_lon = bounding_box(campus.latitude, campus.longitude, radius_km)
+    in_box = RawSQL(
+        'SELECT accommodation_id FROM AccommodationLocation '
+        'WHERE max_lat >= %s AND min_lat <= %s AND max_lon >= %s AND min_lon <= %s',
+        (min_lat, max_lat, min_lon, max_lon),
+    )
+    return queryset.filter(accommodation_id__in=in_box, distance__lte=radius_km)
+
+def nearest(queryset, campus, k):
+    """The k accommodations closest to the campus; the queryset must be ordered by distance"""
+    # Once a circle holds at least k rows it holds the k nearest ones
+    radius_km = NEAREST_START_KM
+    while radius_km <= NEAREST_MAX_KM:
+        candidates = within_radius(queryset, campus, radius_km)
+        if candidates.count() >= k:
+            return candidates[:k]
+        radius_km *= 2
+    return queryset[:k]
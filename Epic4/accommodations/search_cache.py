@@ -0,0 +1,31 @@
+from django.core.cache import cache
+import hashlib
+import json
+import time
+
+# Cached api_search responses also expire on their own, which bounds how stale a
+# worker can be when another process changed the data
+SEARCH_CACHE_TIMEOUT = 300
+
+VERSION_KEY = 'api_search:version'
+
+def search_version():
+    """Current search cache version, started from the clock so a lost counter never reuses an old one"""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+def invalidate_search():
+    """Bump the version so every cached search response is ignored; call after changing accommodations"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns(), None)
+
+def search_cache_key(host, **search):
+    """Cache key for a search given its validated parameters, whatever order or spelling the URL used"""
+    data = json.dumps(search, sort_keys=True, default=str)
+    digest = hashlib.sha256(f'{host} {data}'.encode()).hexdigest()
+    return f'api_search:{search_version()}:{digest}'
\ No newline at end of file
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from .models import Accommodation
-import math
+from .geo import haversine
 
 class AccommodationSerializer(serializers.ModelSerializer):
     id = serializers.CharField(source='accommodation_id')
@@ -16,18 +16,18 @@ class AccommodationSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'startDate', 'endDate', 'type', 'numOfBeds',
             'numOfBedrooms', 'price', 'address',
-            'latitude', 'longitude', 'is_reserved', 'distance'
+            'latitude', 'longitude', 'is_reserved', 'distance',
+            'average_rating', 'rating_count'
         ]
 
     def get_is_reserved(self, obj):
         return "yes" if obj.is_reserved else "no"
 
     def get_distance(self, obj):
+        # api_search annotates the distance computed in SQL
+        if getattr(obj, 'distance', None) is not None:
+            return obj.distance
         campus = self.context.get('campus')
         if campus:
-            lon1, lat1, lon2, lat2 = map(math.radians, [obj.longitude, obj.latitude, campus.longitude, campus.latitude])
-            dlon = lon2 - lon1
-            dlat = lat2 - lat1
-            a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-            return 6371 * 2 * math.asin(math.sqrt(a))  # Earth radius in km
+            return haversine(obj.latitude, obj.longitude, campus.latitude, campus.longitude)
         return None
\ No newline at end of file
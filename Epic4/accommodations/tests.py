@@ -1,3 +1,339 @@
-from django.test import TestCase
+from datetime import date
+from decimal import Decimal
+from math import cos, degrees, radians
+from unittest import mock
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from availability import available_between
+from specialist.tests import UnihavenSchemaTestCase
+from . import geo
+from .geo import haversine
+from .models import Accommodation, AccommodationCampusDistance, Campus, Rating, Reservation, User
+from .pagination import MAX_PAGE_SIZE
+from .search_cache import invalidate_search
 
 # Create your tests here.
+
+class AccommodationSaveTest(UnihavenSchemaTestCase):
+    def test_full_save_keeps_trigger_maintained_columns(self):
+        accommodation = Accommodation.objects.create(
+            type="Flat", availability_start="2025-01-01", availability_end="2025-06-30",
+            beds=2, bedrooms=1, price=10000, address="1 Pok Fu Lam Road",
+        )
+        stale = Accommodation.objects.get(pk=accommodation.pk)
+        user = User.objects.create(name="Student", email="student@connect.hku.hk", password="x", role=User.STUDENT)
+        reservation = Reservation.objects.create(user=user, accommodation=accommodation, status=Reservation.COMPLETED)
+        Rating.objects.create(reservation=reservation, rating=4)
+        rated = Accommodation.objects.get(pk=accommodation.pk)
+
+        stale.price = 9000
+        stale.save()
+        accommodation.refresh_from_db()
+        self.assertEqual(accommodation.price, 9000)
+        self.assertEqual((accommodation.average_rating, accommodation.rating_count), (Decimal('4.00'), 1))
+        self.assertEqual(accommodation.rating_score, rated.rating_score)
+        # The version moves on from the rating's bump instead of going back to the stale copy's
+        self.assertGreater(accommodation.version, rated.version)
+
+class SearchCacheTest(UnihavenSchemaTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Campus.objects.create(campus_id=1, name="Main Campus", latitude=22.283, longitude=114.137)
+        cls.accommodations = [
+            Accommodation.objects.create(
+                type="Flat", availability_start="2025-01-01", availability_end="2025-06-30",
+                beds=2, bedrooms=1, price=10000 + i, address=f"{i} Pok Fu Lam Road",
+                latitude=22.28 + i / 1000, longitude=114.14, geo_address="",
+            )
+            for i in range(3)
+        ]
+        user = User.objects.create(name="Student", email="student@connect.hku.hk", password="x", role=User.STUDENT)
+        cls.reservation = Reservation.objects.create(user=user, accommodation=cls.accommodations[0], status=Reservation.CONFIRMED)
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, **params):
+        return self.client.get('/accommodations/api_search', {'campus_id': 1, **params})
+
+    def test_repeated_search_is_served_from_the_cache(self):
+        first = self.search(sort='price')
+        # Only the campus is read; the results come from the cache
+        with self.assertNumQueries(1):
+            second = self.search(sort='price')
+        self.assertEqual(second.json(), first.json())
+
+    def test_link_header_is_built_for_each_request(self):
+        first = self.search(limit=2, ref='a')
+        # ref is not a search parameter, so this is a cache hit for the same search
+        second = self.search(limit=2, ref='b')
+        self.assertIn('ref=a', first['Link'])
+        self.assertIn('ref=b', second['Link'])
+        self.assertNotIn('ref=a', second['Link'])
+
+        rest = self.client.get(second['Link'][1:second['Link'].index('>')])
+        self.assertNotIn('Link', rest)
+        ids = [row['id'] for row in second.json() + rest.json()]
+        self.assertEqual(sorted(ids), sorted(str(accommodation.pk) for accommodation in self.accommodations))
+
+    def test_writes_invalidate_cached_searches(self):
+        before = self.search().json()
+        self.assertEqual(next(row for row in before if row['id'] == str(self.accommodations[0].pk))['is_reserved'], "yes")
+
+        with mock.patch('specialist.views.geocode', return_value=("9 POK FU LAM ROAD", 22.285, 114.14)):
+            self.client.post('/specialist/api_add/', {
+                'startDate': '2025-01-01', 'endDate': '2025-06-30', 'type': 'Room',
+                'beds': 1, 'bedrooms': 1, 'price': 5000, 'address': '9 Pok Fu Lam Road',
+            })
+        after_add = self.search().json()
+        self.assertEqual(len(after_add), len(before) + 1)
+
+        self.client.post(f'/specialist/api_cancel?reservation_id={self.reservation.pk}')
+        after_cancel = self.search().json()
+        self.assertEqual(next(row for row in after_cancel if row['id'] == str(self.accommodations[0].pk))['is_reserved'], "no")
+
+class ConditionalRequestTest(UnihavenSchemaTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Campus.objects.create(campus_id=1, name="Main Campus", latitude=22.283, longitude=114.137)
+        cls.accommodations = [
+            Accommodation.objects.create(
+                type="Flat", availability_start="2025-01-01", availability_end="2025-06-30",
+                beds=2, bedrooms=1, price=10000 + i, address=f"{i} Pok Fu Lam Road",
+                latitude=22.28 + i / 1000, longitude=114.14, geo_address="",
+            )
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def change_price(self, accommodation, price):
+        Accommodation.objects.filter(pk=accommodation.pk).update(price=price)
+        invalidate_search()
+
+    def test_view_answers_304_while_the_accommodation_is_unchanged(self):
+        url = f'/accommodations/api_view?id={self.accommodations[0].pk}'
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Last-Modified', first)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+        self.change_price(self.accommodations[0], 9000)
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+
+    def test_search_answers_304_only_for_a_matching_etag(self):
+        url = '/accommodations/api_search?campus_id=1&max_price=10001'
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn('Last-Modified', first)
+
+        # Once from the database and once from the cache
+        for _ in range(2):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        # A date cannot tell that a row left the results, so it is never enough on its own
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE='Fri, 31 Dec 2100 00:00:00 GMT').status_code, 200)
+
+        self.change_price(self.accommodations[1], 20000)
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual([row['id'] for row in changed.json()], [str(self.accommodations[0].pk)])
+
+class AvailableBetweenTest(UnihavenSchemaTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Campus.objects.create(campus_id=1, name="Main Campus", latitude=22.283, longitude=114.137)
+        cls.spring, cls.summer, cls.booked = [
+            Accommodation.objects.create(
+                type="Flat", availability_start=start, availability_end=end,
+                beds=2, bedrooms=1, price=10000, address=f"{i} Pok Fu Lam Road",
+                latitude=22.28, longitude=114.14, geo_address="",
+            )
+            for i, (start, end) in enumerate([
+                ("2025-01-01", "2025-04-30"), ("2025-05-01", "2025-08-31"), ("2025-01-01", "2025-08-31"),
+            ])
+        ]
+        user = User.objects.create(name="Student", email="student@connect.hku.hk", password="x", role=User.STUDENT)
+        Reservation.objects.create(
+            user=user, accommodation=cls.booked, status=Reservation.CONFIRMED,
+            check_in=date(2025, 3, 1), check_out=date(2025, 3, 10),
+        )
+        Reservation.objects.create(
+            user=user, accommodation=cls.summer, status=Reservation.CANCELED,
+            check_in=date(2025, 6, 1), check_out=date(2025, 6, 10),
+        )
+
+    def available(self, start, end):
+        return set(available_between(Accommodation.objects.all(), start, end))
+
+    def test_listing_must_cover_the_whole_window(self):
+        self.assertEqual(self.available(date(2025, 2, 1), date(2025, 2, 10)), {self.spring, self.booked})
+        self.assertEqual(self.available(date(2025, 4, 25), date(2025, 5, 5)), {self.booked})
+
+    def test_active_reservations_block_only_their_own_days(self):
+        self.assertNotIn(self.booked, self.available(date(2025, 3, 9), date(2025, 3, 12)))
+        # check_out is the day the stay is over, so the next stay may start on it
+        self.assertIn(self.booked, self.available(date(2025, 3, 10), date(2025, 3, 12)))
+        self.assertIn(self.booked, self.available(date(2025, 2, 20), date(2025, 2, 28)))
+
+    def test_canceled_reservations_do_not_block(self):
+        self.assertIn(self.summer, self.available(date(2025, 6, 1), date(2025, 6, 10)))
+
+    def test_search_applies_the_window(self):
+        response = self.client.get('/accommodations/api_search', {
+            'campus_id': 1, 'start_date': '2025-03-05', 'end_date': '2025-03-20',
+        })
+        self.assertEqual([row['id'] for row in response.json()], [str(self.spring.pk)])
+
+class ClaimAccommodationTest(UnihavenSchemaTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.flat = Accommodation.objects.create(
+            type="Flat", availability_start="2025-01-01", availability_end="2025-06-30",
+            beds=2, bedrooms=1, price=10000, address="1 Pok Fu Lam Road",
+            latitude=22.28, longitude=114.14, geo_address="",
+        )
+        cls.user = User.objects.create(name="Student", email="student@connect.hku.hk", password="x", role=User.STUDENT)
+
+    def book(self, check_in, check_out):
+        return Reservation.objects.create(
+            user=self.user, accommodation=self.flat, status=Reservation.PENDING, check_in=check_in, check_out=check_out,
+        )
+
+    def test_stay_must_lie_inside_the_listing(self):
+        with self.assertRaisesMessage(IntegrityError, "is not listed from 2025-06-25 to 2025-07-05"):
+            self.book(date(2025, 6, 25), date(2025, 7, 5))
+        self.assertFalse(Reservation.objects.exists())
+        self.flat.refresh_from_db()
+        self.assertFalse(self.flat.is_reserved)
+
+        self.book(date(2025, 6, 20), date(2025, 6, 30))
+        self.flat.refresh_from_db()
+        self.assertTrue(self.flat.is_reserved)
+
+    def test_stay_must_not_overlap_an_active_reservation(self):
+        self.book(date(2025, 3, 1), date(2025, 3, 10))
+        with self.assertRaisesMessage(IntegrityError, "already reserved for these dates"):
+            self.book(date(2025, 3, 9), date(2025, 3, 12))
+        self.book(date(2025, 3, 10), date(2025, 3, 12))
+        self.assertEqual(Reservation.objects.count(), 2)
+
+class CampusDistanceTest(UnihavenSchemaTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.campus = Campus.objects.create(campus_id=1, name="Main Campus", latitude=22.283, longitude=114.137)
+        cls.accommodations = [
+            Accommodation.objects.create(
+                type="Flat", availability_start="2025-01-01", availability_end="2025-06-30",
+                beds=2, bedrooms=1, price=10000, address=f"{i} Pok Fu Lam Road",
+                latitude=22.283 + i / 100, longitude=114.137, geo_address="",
+            )
+            for i in range(3, 0, -1)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def stored(self, accommodation):
+        return AccommodationCampusDistance.objects.filter(accommodation=accommodation).values_list('campus_id', 'distance')
+
+    def test_triggers_keep_the_distances_complete(self):
+        flat = self.accommodations[0]
+        [(campus_id, distance)] = self.stored(flat)
+        self.assertEqual(campus_id, self.campus.pk)
+        self.assertAlmostEqual(distance, haversine(flat.latitude, flat.longitude, self.campus.latitude, self.campus.longitude))
+
+        Accommodation.objects.filter(pk=flat.pk).update(latitude=self.campus.latitude)
+        self.assertAlmostEqual(self.stored(flat)[0][1], 0)
+        Accommodation.objects.filter(pk=flat.pk).update(latitude=None)
+        self.assertFalse(self.stored(flat).exists())
+
+        other = Campus.objects.create(campus_id=2, name="Other Campus", latitude=22.3, longitude=114.2)
+        self.assertEqual(AccommodationCampusDistance.objects.filter(campus=other).count(), 2)
+
+    def test_distance_order_reads_the_distance_index(self):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = self.client.get('/accommodations/api_search', {'campus_id': 1, 'limit': 2})
+        self.assertEqual([row['id'] for row in response.json()], [str(a.pk) for a in self.accommodations[:0:-1]])
+        rest = self.client.get(response['Link'][1:response['Link'].index('>')]).json()
+        self.assertEqual([row['id'] for row in rest], [str(self.accommodations[0].pk)])
+
+        with connection.cursor() as cursor:
+            sql, params = statements[-1]
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[3] for row in cursor.fetchall()]
+        self.assertTrue(plan[0].startswith('SEARCH AccommodationCampusDistance USING COVERING INDEX idx_campus_distance'), plan)
+        self.assertFalse([detail for detail in plan if 'TEMP B-TREE' in detail], plan)
+
+class NearbySearchTest(UnihavenSchemaTestCase):
+    # Distances north of the campus, and one north-east corner of the 1 km bounding box
+    # that is 1.3 km away, so it passes the R*Tree filter but not the exact distance check
+    NORTH_KM = [0.99, 1.01, 1.9, 2.2, 5]
+    CORNER_KM = 1.3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.campus = Campus.objects.create(campus_id=1, name="Main Campus", latitude=22.283, longitude=114.137)
+        step = degrees(cls.CORNER_KM / 2 ** 0.5 / geo.EARTH_RADIUS_KM)
+        locations = [(cls.campus.latitude + degrees(km / geo.EARTH_RADIUS_KM), cls.campus.longitude) for km in cls.NORTH_KM]
+        locations.append((cls.campus.latitude + step, cls.campus.longitude + step / cos(radians(cls.campus.latitude))))
+        cls.accommodations = [
+            Accommodation.objects.create(
+                type="Flat", availability_start="2025-01-01", availability_end="2025-06-30",
+                beds=2, bedrooms=1, price=10000, address=f"{i} Pok Fu Lam Road",
+                latitude=latitude, longitude=longitude, geo_address="",
+            )
+            for i, (latitude, longitude) in enumerate(locations)
+        ]
+        cls.corner = cls.accommodations[-1]
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, **params):
+        return self.client.get('/accommodations/api_search', {'campus_id': 1, **params})
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        return [int(row['id']) for row in response.json()]
+
+    def test_radius_keeps_rows_just_inside_it(self):
+        self.assertAlmostEqual(
+            haversine(self.corner.latitude, self.corner.longitude, self.campus.latitude, self.campus.longitude),
+            self.CORNER_KM, places=3,
+        )
+        self.assertEqual(self.ids(self.search(radius_km=1)), [self.accommodations[0].pk])
+        self.assertEqual(self.ids(self.search(radius_km=1.02)), [a.pk for a in self.accommodations[:2]])
+        self.assertEqual(self.ids(self.search(radius_km=1.31)), [a.pk for a in self.accommodations[:2]] + [self.corner.pk])
+
+    def test_nearest_widens_the_radius_until_it_has_enough_rows(self):
+        with mock.patch.object(geo, 'within_radius', wraps=geo.within_radius) as within_radius:
+            ids = self.ids(self.search(nearest=3))
+        # 0.5 km holds none, 1 km one and 2 km four of them
+        self.assertEqual([call.args[2] for call in within_radius.call_args_list], [0.5, 1, 2])
+        self.assertEqual(ids, [a.pk for a in self.accommodations[:2]] + [self.corner.pk])
+
+    def test_nearest_returns_every_row_when_there_are_fewer(self):
+        ids = self.ids(self.search(nearest=10))
+        self.assertEqual(ids, [a.pk for a in self.accommodations[:2]] + [self.corner.pk] + [a.pk for a in self.accommodations[2:5]])
+
+    def test_invalid_radius_and_nearest_are_rejected(self):
+        for params in [
+            {'radius_km': 0}, {'radius_km': -1}, {'radius_km': 'far'},
+            {'nearest': 0}, {'nearest': -2}, {'nearest': MAX_PAGE_SIZE + 1}, {'nearest': 'some'},
+            {'nearest': 3, 'sort': 'price'},
+        ]:
+            with self.subTest(**params):
+                response = self.search(**params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('errors', response.json())
\ No newline at end of file
@@ -1,9 +1,24 @@
 from django.shortcuts import render
+from django.core.cache import cache
 from django.http import JsonResponse
+from django.db.models import ExpressionWrapper, F, FilteredRelation, FloatField, Q
 from .models import Accommodation, Rating, Campus
 from .serializers import AccommodationSerializer
+from availability import available_between
+from .geo import nearest, within_radius
+from .pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, page_url, paginate
+from .search_cache import SEARCH_CACHE_TIMEOUT, search_cache_key
+from .conditional import etag_for, not_modified, set_validators, validators
 from datetime import datetime
-import math
+
+# sort parameter: (field to order and paginate by, tie-break field, descending).
+# Distance ties are broken on the distance table's own accommodation_id, the last
+# column of idx_campus_distance, so SQLite reads that index in order without sorting
+SORT_ORDERS = {
+    'distance': ('distance', 'campus_distances__accommodation_id', False),
+    'price': ('price_key', 'accommodation_id', False),
+    'rating': ('rating_score', 'accommodation_id', True),
+}
 
 def view_accommodations(request):
     accommodations = Accommodation.objects.all()
@@ -22,8 +37,13 @@ def api_view(request):
         
         try:
             accommodation = Accommodation.objects.get(accommodation_id=accommodation_id)
+            # Clients holding the current version get a 304 without serializing again
+            etag, last_modified = validators(accommodation)
+            response = not_modified(request, etag, last_modified)
+            if response is not None:
+                return response
             serializer = AccommodationSerializer(accommodation)
-            return JsonResponse(serializer.data)
+            return set_validators(JsonResponse(serializer.data), etag, last_modified)
         except Accommodation.DoesNotExist:
             return JsonResponse({'error': 'Accommodation not found'}, status=404)
     else:
@@ -32,20 +52,26 @@ def api_view(request):
 
 def api_search(request):
     """
-    Search accommodations with filters and sort by distance from campus
+    Search accommodations with filters and sort by distance from campus, price or rating
     Query Parameters:
     - type: 1=Room, 2=Flat, 3=Mini hall
     - start_date: YYYY-MM-DD
-    - end_date: YYYY-MM-DD
+    - end_date: YYYY-MM-DD (with start_date, only accommodations free for the whole window)
     - min_beds: integer
     - min_bedrooms: integer
     - max_price: decimal
     - campus_id: 1-5
+    - radius_km: decimal, only accommodations within this distance of the campus
+    - nearest: integer, only the k accommodations closest to the campus (single page)
+    - sort: distance (default), price (cheapest first) or rating (best rated first)
+    - limit: integer, page size (default 20, at most 100)
+    - cursor: opaque position returned in the Link header of the previous page
     """
     params = request.GET
     errors = []
     campus = None
-    queryset = Accommodation.objects.all()
+    filters = {}
+    window = None
 
     # Validate campus ID (1-5)
     if 'campus_id' in params:
@@ -65,7 +91,7 @@ def api_search(request):
     if 'type' in params:
         accommodation_type = type_mapping.get(params['type'])
         if accommodation_type:
-            queryset = queryset.filter(type=accommodation_type)
+            filters['type'] = accommodation_type
         else:
             errors.append("Invalid type: use 1,2,3")
 
@@ -82,41 +108,131 @@ def api_search(request):
         if start_date and end_date and start_date > end_date:
             errors.append("End date must be after start date")
             
-        if start_date:
-            queryset = queryset.filter(availability_end__gte=start_date)
-        if end_date:
-            queryset = queryset.filter(availability_start__lte=end_date)
+        if start_date and end_date:
+            # Free for the whole window, checked against the availability index below
+            window = (start_date, end_date)
+        elif start_date:
+            filters['availability_end__gte'] = start_date
+        elif end_date:
+            filters['availability_start__lte'] = end_date
     except ValueError:
         errors.append("Invalid date format. Use YYYY-MM-DD")
 
     # Numeric filters
     try:
         if 'min_beds' in params:
-            queryset = queryset.filter(beds__gte=int(params['min_beds']))
+            filters['beds__gte'] = int(params['min_beds'])
         if 'min_bedrooms' in params:
-            queryset = queryset.filter(bedrooms__gte=int(params['min_bedrooms']))
+            filters['bedrooms__gte'] = int(params['min_bedrooms'])
         if 'max_price' in params:
-            queryset = queryset.filter(price__lte=float(params['max_price']))
+            filters['price__lte'] = float(params['max_price'])
     except ValueError:
         errors.append("Invalid numeric parameter")
 
+    # Spatial filters
+    radius_km = None
+    k = None
+    try:
+        if 'radius_km' in params:
+            radius_km = float(params['radius_km'])
+            if radius_km <= 0:
+                errors.append("Radius must be positive")
+        if 'nearest' in params:
+            k = int(params['nearest'])
+            if not 1 <= k <= MAX_PAGE_SIZE:
+                errors.append(f"Nearest must be between 1-{MAX_PAGE_SIZE}")
+    except ValueError:
+        errors.append("Invalid radius_km or nearest")
+
+    # Page size and keyset cursor
+    limit = DEFAULT_PAGE_SIZE
+    cursor = None
+    try:
+        if 'limit' in params:
+            limit = int(params['limit'])
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                errors.append(f"Limit must be between 1-{MAX_PAGE_SIZE}")
+        if 'cursor' in params:
+            cursor = decode_cursor(params['cursor'])
+    except ValueError:
+        errors.append("Invalid limit or cursor")
+    if k is not None and cursor is not None:
+        errors.append("Nearest results are returned as a single page")
+
+    # Sort order
+    sort = params.get('sort', 'distance')
+    if sort not in SORT_ORDERS:
+        errors.append("Invalid sort: use distance, price or rating")
+    elif k is not None and sort != 'distance':
+        errors.append("Nearest results are sorted by distance")
+
     # Return errors if any
     if errors:
         return JsonResponse({'errors': errors}, status=400)
 
-    # Serialize with distance calculation
-    serializer = AccommodationSerializer(
-        queryset,
-        many=True,
-        context={'campus': campus}  # Pass campus for distance calculation
+    # Identical searches share one cached response until an accommodation changes
+    key = search_cache_key(
+        request.get_host(), campus_id=campus.campus_id, filters=filters, window=window, radius_km=radius_km,
+        nearest=k, sort=sort, limit=limit, cursor=cursor,
     )
-    data = serializer.data
+    cached = cache.get(key)
+    if cached is None:
+        # Sort in SQL on stored values so each page only reads the rows it returns
+        queryset = Accommodation.objects.filter(**filters)
+        if window:
+            queryset = available_between(queryset, *window)
+        if sort == 'distance':
+            # Driven from this campus's entries in idx_campus_distance. Triggers keep the
+            # distances of every listing with coordinates; the others have no distance
+            # until the geocode backfill has found them
+            queryset = queryset.filter(campus_distances__campus_id=campus.campus_id).annotate(
+                distance=F('campus_distances__distance'),
+            )
+        else:
+            queryset = queryset.annotate(
+                campus_distance=FilteredRelation(
+                    'campus_distances', condition=Q(campus_distances__campus_id=campus.campus_id)
+                ),
+            ).annotate(distance=F('campus_distance__distance'))
+        queryset = queryset.annotate(price_key=ExpressionWrapper(F('price'), output_field=FloatField()))
+        # Price and rating orders walk idx_accommodation_price / idx_accommodation_rating_score
+        sort_field, tie_field, descending = SORT_ORDERS[sort]
+        if descending:
+            queryset = queryset.order_by(F(sort_field).desc(), F(tie_field).desc())
+        else:
+            queryset = queryset.order_by(sort_field, tie_field)
+
+        if radius_km is not None:
+            queryset = within_radius(queryset, campus, radius_km)
+        if k is not None:
+            rows, next_cursor = nearest(queryset, campus, k), None
+        else:
+            rows, next_cursor = paginate(queryset, sort_field, limit, cursor, descending)
+
+        # The page is identified by the versions of its rows, so an unchanged page
+        # is answered with a 304 before it is serialized. Lists get no Last-Modified:
+        # a row dropping out of the results, or a second change within the same
+        # second, would leave it unchanged, so If-Modified-Since cannot be trusted
+        rows = list(rows)
+        etag = etag_for(rows, next_cursor)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
 
-    # Sort by distance if valid campus
-    if campus:
-        data = sorted(
-            data,
-            key=lambda x: x['distance'] if x['distance'] is not None else math.inf
+        serializer = AccommodationSerializer(
+            rows,
+            many=True,
+            context={'campus': campus}
         )
+        cached = (serializer.data, next_cursor, etag)
+        cache.set(key, cached, SEARCH_CACHE_TIMEOUT)
 
-    return JsonResponse(data, safe=False)
\ No newline at end of file
+    data, next_cursor, etag = cached
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+    response = JsonResponse(data, safe=False)
+    if next_cursor:
+        # The cache only holds the cursor; the link is built from this request's own URL
+        response['Link'] = f'<{page_url(request, next_cursor)}>; rel="next"'
+    return set_validators(response, etag)
\ No newline at end of file
@@ -0,0 +1,59 @@
+from django.conf import settings
+from geoclient import UNAVAILABLE, GeocodingClient, django_geocoder
+import json
+import requests
+
+ALS_LOOKUP_URL = getattr(settings, 'ALS_LOOKUP_URL', "https://www.als.gov.hk/lookup")
+
+client = GeocodingClient()
+
+geocoder = django_geocoder(client.max_concurrent)
+memory_cache = geocoder.memory_cache
+
+def fetch_coordinates(location):
+    params = {
+        "q": location.upper(),
+        "n": 1,
+    }
+    try:
+        res = client.get(ALS_LOOKUP_URL, params=params, headers={"Accept": "application/json"})
+        res.raise_for_status()  # Raise an error for bad responses
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching coordinates: {e}")
+        return None
+    return res, res.status_code
+
+# Retrieve geolocation data from the API json response
+def getGeoAddress(jsonData):
+    data = jsonData["SuggestedAddress"][0]["Address"]["PremisesAddress"]
+    geogAddr = data.get("GeoAddress")
+    latitude = data.get("GeospatialInformation").get("Latitude")
+    longitude = data.get("GeospatialInformation").get("Longitude")
+    return geogAddr, latitude, longitude
+
+def lookup(address):
+    """(geo_address, latitude, longitude) from ALS, None if ALS cannot locate it, UNAVAILABLE if the request failed"""
+    query = fetch_coordinates(address)
+    if query is None:
+        return UNAVAILABLE
+    try:
+        geo_address, latitude, longitude = getGeoAddress(json.loads(query[0].text))
+        return geo_address, float(latitude), float(longitude)
+    except (KeyError, IndexError, TypeError, AttributeError, ValueError) as e:
+        print(f"No location found for '{address}': {e}")
+        return None
+
+def geocode_many(addresses):
+    """
+    (geo_address, latitude, longitude) or None for each address, in order.
+    Cached results come from the in-process LRU or the GeocodeCache table;
+    the remaining addresses are looked up in ALS concurrently.
+    """
+    return geocoder.geocode_many(addresses, lookup)
+
+def geocode(address):
+    """
+    (geo_address, latitude, longitude) for an address, or None if ALS cannot locate it.
+    Checks the in-process LRU, then the GeocodeCache table, and only then calls ALS.
+    """
+    return geocode_many([address])[0]
\ No newline at end of file
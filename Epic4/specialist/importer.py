@@ -0,0 +1,146 @@
+from django.db import transaction
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from .geocoding import geocode_many
+from .models import Accommodation
+import codecs
+import csv
+import json
+
+# Rows are validated, geocoded and written this many at a time
+CHUNK_SIZE = 500
+
+FIELDS = ["startDate", "endDate", "type", "beds", "bedrooms", "price", "address"]
+TYPES = ["Room", "Flat", "Mini hall"]
+
+def detect_format(request, upload):
+    """'csv' or 'jsonl' from the format parameter, the file name or the content type, None if unknown"""
+    fmt = request.GET.get("format")
+    if fmt:
+        return fmt.lower() if fmt.lower() in ("csv", "jsonl") else None
+    name = upload.name.lower() if upload else ""
+    content_type = upload.content_type if upload else request.content_type
+    if name.endswith(".csv") or content_type == "text/csv":
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson")) or content_type in ("application/jsonl", "application/x-ndjson"):
+        return "jsonl"
+    return None
+
+def read_rows(source, fmt):
+    """
+    Yield (row number, data or None, parse error) for each listing in a byte stream.
+    The stream is read line by line, so uploads of any size are never held in memory.
+    """
+    lines = codecs.iterdecode(source, "utf-8-sig")
+    if fmt == "csv":
+        for number, data in enumerate(csv.DictReader(lines), start=1):
+            yield number, data, None
+        return
+
+    number = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(data, dict):
+            yield number, None, "Each line must be a JSON object"
+            continue
+        yield number, data, None
+
+def validate(data):
+    """(Accommodation, None) for a valid listing, or (None, {field: error})"""
+    errors = {}
+    values = {}
+    for field in FIELDS:
+        value = data.get(field)
+        value = str(value).strip() if value is not None else ""
+        if not value:
+            errors[field] = "This field is required."
+        values[field] = value
+    if errors:
+        return None, errors
+
+    try:
+        start = datetime.strptime(values["startDate"], "%Y-%m-%d").date()
+    except ValueError:
+        errors["startDate"] = "Invalid date format. Use YYYY-MM-DD."
+    try:
+        end = datetime.strptime(values["endDate"], "%Y-%m-%d").date()
+    except ValueError:
+        errors["endDate"] = "Invalid date format. Use YYYY-MM-DD."
+    if "startDate" not in errors and "endDate" not in errors and start > end:
+        errors["endDate"] = "End date must not be before start date."
+    if values["type"] not in TYPES:
+        errors["type"] = f"Must be one of {', '.join(TYPES)}."
+    for field in ("beds", "bedrooms"):
+        try:
+            values[field] = int(values[field])
+            if values[field] < 1:
+                raise ValueError
+        except ValueError:
+            errors[field] = "Must be a positive integer."
+    try:
+        price = Decimal(values["price"])
+        if not price.is_finite() or price <= 0:
+            raise InvalidOperation
+    except InvalidOperation:
+        errors["price"] = "Must be a positive number."
+    if errors:
+        return None, errors
+
+    return Accommodation(
+        availability_start=start,
+        availability_end=end,
+        type=values["type"],
+        beds=values["beds"],
+        bedrooms=values["bedrooms"],
+        price=price.quantize(Decimal("0.01")),
+        address=values["address"],
+    ), None
+
+def import_chunk(chunk, report):
+    """Geocode and save a chunk of (row number, Accommodation) pairs, adding their status to the report"""
+    locations = geocode_many([accommodation.address for _, accommodation in chunk])
+    for (_, accommodation), location in zip(chunk, locations):
+        if location:
+            accommodation.geo_address, accommodation.latitude, accommodation.longitude = location
+
+    # A failed chunk is rolled back on its own; triggers fill in the campus distances
+    with transaction.atomic():
+        created = Accommodation.objects.bulk_create([accommodation for _, accommodation in chunk])
+
+    for (number, _), accommodation in zip(chunk, created):
+        row = {"row": number, "status": "created", "id": accommodation.accommodation_id}
+        if accommodation.latitude is None:
+            row["warning"] = "Address not found, saved without coordinates."
+        report.append(row)
+
+def import_accommodations(rows):
+    """
+    Validate, geocode and save listings from read_rows in chunks.
+    Returns a per-row report of created listings and errors, ordered by row number.
+    """
+    report = []
+    chunk = []
+    for number, data, error in rows:
+        if error:
+            report.append({"row": number, "status": "error", "errors": {"row": error}})
+            continue
+        accommodation, errors = validate(data)
+        if errors:
+            report.append({"row": number, "status": "error", "errors": errors})
+            continue
+        chunk.append((number, accommodation))
+        if len(chunk) == CHUNK_SIZE:
+            import_chunk(chunk, report)
+            chunk = []
+    if chunk:
+        import_chunk(chunk, report)
+
+    report.sort(key=lambda row: row["row"])
+    return report
\ No newline at end of file
@@ -1,6 +1,7 @@
-from django.db import models
+from django.db import models, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
+from availability import claim_accommodation
 
 # User model
 class User(models.Model):
@@ -66,20 +67,38 @@ class Reservation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     accommodation = models.ForeignKey(Accommodation, on_delete=models.CASCADE)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)  
+    # Stay from check_in up to (not including) check_out; without dates the whole listing is held
+    check_in = models.DateField(null=True, blank=True)
+    check_out = models.DateField(null=True, blank=True)
 
     class Meta:
         db_table = 'Reservation'  # Match the exact table name in your database
         managed = False          # Tell Django this table is managed externally
 
     def save(self, *args, **kwargs):
-        if self.status in [self.CONFIRMED, self.PENDING]:
-            self.accommodation.is_reserved = True
-            self.accommodation.save()
-        elif self.status in [self.CANCELED, self.COMPLETED]:
-            self.accommodation.is_reserved = False
-            self.accommodation.save()
-        
-        super().save(*args, **kwargs)
+        # The accommodation and the reservation are written together or not at all
+        with transaction.atomic():
+            if self._state.adding and self.status not in [self.CANCELED, self.COMPLETED]:
+                self.claim_accommodation()
+            elif self.status in [self.CONFIRMED, self.PENDING]:
+                self.accommodation.is_reserved = True
+                self.accommodation.save(update_fields=['is_reserved'])
+            elif self.status in [self.CANCELED, self.COMPLETED]:
+                # Other reservations of the same accommodation may still hold it
+                self.accommodation.is_reserved = Reservation.objects.filter(
+                    accommodation_id=self.accommodation_id
+                ).exclude(status__in=[self.CANCELED, self.COMPLETED]).exclude(pk=self.pk).exists()
+                self.accommodation.save(update_fields=['is_reserved'])
+
+            super().save(*args, **kwargs)
+
+    def claim_accommodation(self):
+        """
+        Mark the accommodation reserved with one conditional UPDATE that only matches
+        while the stay lies inside the listing and no active reservation overlaps it,
+        so two bookings made at the same time cannot both claim it
+        """
+        claim_accommodation(self)
 
     def __str__(self):
         return f"Reservation {self.reservation_id} - {self.get_status_display()}"
@@ -113,4 +132,33 @@ class Campus(models.Model):
         managed = False     # Tell Django this table is managed externally
 
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return self.name
+
+# Cached ALS address lookup (found=False caches a failed lookup)
+class GeocodeCache(models.Model):
+    address_key = models.CharField(max_length=255, primary_key=True)
+    geo_address = models.TextField(null=True)
+    latitude = models.FloatField(null=True)
+    longitude = models.FloatField(null=True)
+    found = models.BooleanField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'GeocodeCache'  # Match the exact table name in your database
+        managed = False           # Tell Django this table is managed externally
+
+    def __str__(self):
+        return self.address_key
+
+
+# Counter behind the specialist dashboard statistics, maintained by triggers on each table
+class Stats(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.IntegerField()
+
+    class Meta:
+        db_table = 'Stats'  # Match the exact table name in your database
+        managed = False    # Tell Django this table is managed externally
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
\ No newline at end of file
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Accommodation, Reservation, User
+from .models import Accommodation, Reservation
 
 class AccommodationSerializer(serializers.ModelSerializer):
     class Meta:
@@ -15,17 +15,13 @@ class ReservationSerializer(serializers.ModelSerializer):
         model = Reservation
         fields = '__all__'
 
+    # user and accommodation must be loaded with select_related('user', 'accommodation'),
+    # otherwise every reservation costs extra queries
     def get_username(self, obj):
-        # Fetch the related User instance using user_id
-        user = User.objects.get(user_id=obj.user_id)
-        return user.name
+        return obj.user.name
     
     def get_email(self, obj):
-        # Fetch the related User instance using user_id
-        user = User.objects.get(user_id=obj.user_id)
-        return user.email
+        return obj.user.email
     
     def get_address(self, obj):
-        # Fetch the related Accommodation instance using accommodation_id
-        accommodation = Accommodation.objects.get(accommodation_id=obj.accommodation_id)
-        return accommodation.address
\ No newline at end of file
+        return obj.accommodation.address
\ No newline at end of file
@@ -1,3 +1,385 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from decimal import Decimal
+from create_dbV3 import create_schema, drop_schema
+from dbutils import count_stats
+from geoclient import CACHE_TTL, NEGATIVE_CACHE_TTL, GeocodingClient, LRUCache
+from . import geocoding, importer
+from .models import Accommodation, GeocodeCache, Rating, Reservation, User
+import io
+import json
+import requests
+import threading
+import time
 
 # Create your tests here.
+
+class UnihavenSchemaTestCase(TestCase):
+    """
+    The models are unmanaged, so the test database gets the tables, triggers and
+    indexes of unihaven.db from create_dbV3.py and migrate.py
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        connection.ensure_connection()
+        cls.schema_tables = create_schema(connection.connection)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        drop_schema(connection.connection, cls.schema_tables)
+
+class ActiveReservationsTest(UnihavenSchemaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(20):
+            user = User.objects.create(name=f"Student {i}", email=f"student{i}@connect.hku.hk", password="x", role=User.STUDENT)
+            accommodation = Accommodation.objects.create(
+                type="Room", availability_start="2025-01-01", availability_end="2025-06-30",
+                beds=1, bedrooms=1, price=1000, address=f"{i} Pok Fu Lam Road",
+                latitude=22.28, longitude=114.14, geo_address="",
+            )
+            status = [Reservation.PENDING, Reservation.CONFIRMED, Reservation.CANCELED, Reservation.COMPLETED][i % 4]
+            Reservation.objects.create(user=user, accommodation=accommodation, status=status)
+
+    def test_active_reservations_use_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/specialist/api_active')
+        reservations = response.json()['reservations']
+        self.assertEqual(len(reservations), 10)
+        for reservation in reservations:
+            self.assertIn(reservation['status'], [Reservation.PENDING, Reservation.CONFIRMED])
+            user = User.objects.get(user_id=reservation['user'])
+            self.assertEqual(reservation['username'], user.name)
+            self.assertEqual(reservation['email'], user.email)
+            self.assertEqual(reservation['address'], Accommodation.objects.get(pk=reservation['accommodation']).address)
+
+    def test_cancel_updates_only_status_and_is_reserved(self):
+        reservation = Reservation.objects.filter(status=Reservation.CONFIRMED).first()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'/specialist/api_cancel?reservation_id={reservation.pk}')
+        self.assertEqual(response.status_code, 200)
+        # One UPDATE per table, nothing loaded; the test case's savepoints are not counted
+        statements = [query['sql'] for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertEqual([sql.split()[:2] for sql in statements], [['UPDATE', '"Reservation"'], ['UPDATE', '"Accommodation"']])
+        self.assertNotIn('"address"', statements[1])
+
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, Reservation.CANCELED)
+        self.assertFalse(Accommodation.objects.get(pk=reservation.accommodation_id).is_reserved)
+        response = self.client.post('/specialist/api_cancel?reservation_id=999999')
+        self.assertEqual(response.status_code, 404)
+
+class LRUCacheTest(TestCase):
+    def test_expired_entries_are_misses(self):
+        cache = LRUCache(10)
+        cache.set('fresh', 1, timezone.now() + timedelta(minutes=1))
+        cache.set('stale', 2, timezone.now() - timedelta(seconds=1))
+        self.assertEqual(cache.get('fresh'), (True, 1))
+        self.assertEqual(cache.get('stale'), (False, None))
+        self.assertEqual(cache.get('unknown'), (False, None))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRUCache(2)
+        expires_at = timezone.now() + timedelta(minutes=1)
+        cache.set('a', 1, expires_at)
+        cache.set('b', 2, expires_at)
+        cache.get('a')
+        cache.set('c', 3, expires_at)
+        self.assertEqual(cache.get('b'), (False, None))
+        self.assertEqual(cache.get('a'), (True, 1))
+        self.assertEqual(cache.get('c'), (True, 3))
+
+class GeocodeCacheTest(UnihavenSchemaTestCase):
+    FOUND = ("1 POK FU LAM ROAD", 22.28, 114.14)
+
+    def setUp(self):
+        geocoding.memory_cache.clear()
+        self.addCleanup(geocoding.memory_cache.clear)
+
+    def stub_lookup(self, result):
+        patcher = mock.patch.object(geocoding, 'lookup', return_value=result)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_found_address_is_cached_in_memory_and_table(self):
+        lookup = self.stub_lookup(self.FOUND)
+        self.assertEqual(geocoding.geocode("1 Pok Fu Lam Road"), self.FOUND)
+        # Same key after normalising case and spaces
+        self.assertEqual(geocoding.geocode(" 1  pok fu lam road"), self.FOUND)
+        self.assertEqual(lookup.call_count, 1)
+
+        cached = GeocodeCache.objects.get(address_key="1 POK FU LAM ROAD")
+        self.assertTrue(cached.found)
+        self.assertAlmostEqual(cached.expires_at - timezone.now(), CACHE_TTL, delta=timedelta(minutes=1))
+
+        geocoding.memory_cache.clear()
+        self.assertEqual(geocoding.geocode("1 Pok Fu Lam Road"), self.FOUND)
+        self.assertEqual(lookup.call_count, 1)
+
+    def test_miss_is_cached_for_negative_ttl(self):
+        lookup = self.stub_lookup(None)
+        self.assertIsNone(geocoding.geocode("Nowhere"))
+        self.assertIsNone(geocoding.geocode("Nowhere"))
+        self.assertEqual(lookup.call_count, 1)
+
+        cached = GeocodeCache.objects.get(address_key="NOWHERE")
+        self.assertFalse(cached.found)
+        self.assertAlmostEqual(cached.expires_at - timezone.now(), NEGATIVE_CACHE_TTL, delta=timedelta(minutes=1))
+
+    def test_expired_entry_is_looked_up_again(self):
+        lookup = self.stub_lookup(self.FOUND)
+        geocoding.geocode("1 Pok Fu Lam Road")
+        GeocodeCache.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        geocoding.memory_cache.clear()
+        geocoding.geocode("1 Pok Fu Lam Road")
+        self.assertEqual(lookup.call_count, 2)
+        self.assertGreater(GeocodeCache.objects.get().expires_at, timezone.now())
+
+    def test_transport_error_is_not_cached(self):
+        lookup = self.stub_lookup(geocoding.UNAVAILABLE)
+        self.assertEqual(geocoding.geocode_many(["Somewhere", "Somewhere"]), [None, None])
+        self.assertIsNone(geocoding.geocode("Somewhere"))
+        self.assertEqual(lookup.call_count, 2)
+        self.assertFalse(GeocodeCache.objects.exists())
+
+        lookup.return_value = self.FOUND
+        self.assertEqual(geocoding.geocode("Somewhere"), self.FOUND)
+
+class StubALSHandler(BaseHTTPRequestHandler):
+    """Answers GETs with the statuses queued on the server, then with ALS-style JSON"""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.arrivals.append(time.monotonic())
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status = server.statuses.pop(0) if server.statuses else 200
+        time.sleep(server.delay)
+        # Counted as done before replying, so the client cannot start its next request first
+        with server.lock:
+            server.in_flight -= 1
+        body = json.dumps({"SuggestedAddress": [{"Address": {"PremisesAddress": {
+            "GeoAddress": "3228612345T20050430",
+            "GeospatialInformation": {"Latitude": "22.28", "Longitude": "114.14"},
+        }}}]}).encode() if status == 200 else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class GeocodingClientTest(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubALSHandler)
+        self.server.lock = threading.Lock()
+        self.server.arrivals = []
+        self.server.in_flight = self.server.max_in_flight = 0
+        self.server.statuses = []
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/lookup"
+
+    def test_server_errors_are_retried(self):
+        self.server.statuses = [503, 500]
+        client = GeocodingClient(retries=3, backoff=0)
+        self.assertEqual(client.get(self.url).status_code, 200)
+        self.assertEqual(len(self.server.arrivals), 3)
+
+    def test_gives_up_after_max_retries(self):
+        self.server.statuses = [500] * 10
+        client = GeocodingClient(retries=2, backoff=0)
+        with self.assertRaises(requests.exceptions.RetryError):
+            client.get(self.url)
+        self.assertEqual(len(self.server.arrivals), 3)
+
+    def test_concurrent_requests_are_limited_per_host(self):
+        self.server.delay = 0.1
+        client = GeocodingClient(max_concurrent=2, rate=1000)
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            statuses = list(executor.map(lambda _: client.get(self.url).status_code, range(6)))
+        self.assertEqual(statuses, [200] * 6)
+        self.assertEqual(self.server.max_in_flight, 2)
+
+    def test_requests_are_spaced_to_the_rate_limit(self):
+        client = GeocodingClient(max_concurrent=4, rate=20)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: client.get(self.url), range(5)))
+        arrivals = sorted(self.server.arrivals)
+        # Five requests at 20 per second take at least four 50 ms intervals
+        self.assertGreaterEqual(arrivals[-1] - arrivals[0], 0.19)
+
+    def test_lookup_parses_response_and_reports_failures(self):
+        client = GeocodingClient(retries=1, backoff=0)
+        with mock.patch.object(geocoding, 'client', client), mock.patch.object(geocoding, 'ALS_LOOKUP_URL', self.url):
+            self.assertEqual(geocoding.lookup("1 Pok Fu Lam Road"), ("3228612345T20050430", 22.28, 114.14))
+            self.server.statuses = [500, 500]
+            with redirect_stdout(io.StringIO()):
+                self.assertIs(geocoding.lookup("1 Pok Fu Lam Road"), geocoding.UNAVAILABLE)
+
+class ImporterTest(UnihavenSchemaTestCase):
+    CSV = (
+        "startDate,endDate,type,beds,bedrooms,price,address\n"
+        "2025-01-01,2025-06-30,Room,1,1,4500,1 Pok Fu Lam Road\n"
+        "2025-01-01,2024-06-30,Room,1,1,4500,2 Pok Fu Lam Road\n"
+        "2025-01-01,2025-06-30,Flat,2,1,9000.555,3 Pok Fu Lam Road\n"
+    )
+    VALID = {"startDate": "2025-01-01", "endDate": "2025-06-30", "type": "Room",
+             "beds": 1, "bedrooms": 1, "price": "4500", "address": "1 Pok Fu Lam Road"}
+
+    def setUp(self):
+        # Addresses containing "1 " are found, the rest are saved without coordinates
+        patcher = mock.patch.object(importer, 'geocode_many', side_effect=lambda addresses: [
+            ("GEO", 22.28, 114.14) if address.startswith("1 ") else None for address in addresses
+        ])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_detect_format(self):
+        factory = RequestFactory()
+        upload = SimpleUploadedFile("listings.CSV", b"", content_type="application/octet-stream")
+        self.assertEqual(importer.detect_format(factory.post("/"), upload), "csv")
+        upload = SimpleUploadedFile("listings.txt", b"", content_type="text/csv")
+        self.assertEqual(importer.detect_format(factory.post("/"), upload), "csv")
+        upload = SimpleUploadedFile("listings.ndjson", b"")
+        self.assertEqual(importer.detect_format(factory.post("/"), upload), "jsonl")
+        request = factory.post("/", b"{}", content_type="application/x-ndjson")
+        self.assertEqual(importer.detect_format(request, None), "jsonl")
+        # An explicit format wins over the file name
+        self.assertEqual(importer.detect_format(factory.post("/?format=JSONL"), upload), "jsonl")
+        self.assertIsNone(importer.detect_format(factory.post("/?format=xml"), upload))
+        self.assertIsNone(importer.detect_format(factory.post("/", b"", content_type="text/plain"), None))
+
+    def test_validate(self):
+        accommodation, errors = importer.validate(dict(self.VALID, price="4500.555", address=" 1 Pok Fu Lam Road "))
+        self.assertIsNone(errors)
+        self.assertEqual(accommodation.price, Decimal("4500.56"))
+        self.assertEqual(accommodation.address, "1 Pok Fu Lam Road")
+
+        cases = [
+            ({"address": ""}, {"address": "This field is required."}),
+            ({"startDate": "2025-13-01"}, {"startDate": "Invalid date format. Use YYYY-MM-DD."}),
+            ({"endDate": "2024-12-31"}, {"endDate": "End date must not be before start date."}),
+            ({"type": "Castle"}, {"type": "Must be one of Room, Flat, Mini hall."}),
+            ({"beds": 0, "bedrooms": "two"}, {"beds": "Must be a positive integer.", "bedrooms": "Must be a positive integer."}),
+            ({"price": "NaN"}, {"price": "Must be a positive number."}),
+            ({"price": "-1"}, {"price": "Must be a positive number."}),
+        ]
+        for change, expected in cases:
+            with self.subTest(change=change):
+                self.assertEqual(importer.validate(dict(self.VALID, **change)), (None, expected))
+
+    def test_failed_chunk_is_rolled_back(self):
+        rows = [(number, dict(self.VALID, address=f"{number} Pok Fu Lam Road"), None) for number in range(1, 6)]
+        validate = importer.validate
+
+        def break_fourth_row(data):
+            # Passes validation but fails the beds CHECK constraint of the table
+            accommodation, errors = validate(data)
+            if data["address"].startswith("4 "):
+                accommodation.beds = 0
+            return accommodation, errors
+
+        with mock.patch.object(importer, 'CHUNK_SIZE', 2), \
+                mock.patch.object(importer, 'validate', side_effect=break_fourth_row):
+            with self.assertRaises(IntegrityError):
+                importer.import_accommodations(iter(rows))
+        # The first chunk was committed, the second one rolled back and the third never reached
+        self.assertEqual(sorted(Accommodation.objects.values_list('address', flat=True)),
+                         ["1 Pok Fu Lam Road", "2 Pok Fu Lam Road"])
+
+    def test_api_import_csv_upload(self):
+        upload = SimpleUploadedFile("listings.csv", self.CSV.encode(), content_type="text/csv")
+        response = self.client.post('/specialist/api_import/', {"file": upload})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["created"], body["failed"]), (2, 1))
+        self.assertEqual([row["row"] for row in body["rows"]], [1, 2, 3])
+        self.assertEqual(body["rows"][1]["errors"], {"endDate": "End date must not be before start date."})
+        self.assertEqual(body["rows"][2]["warning"], "Address not found, saved without coordinates.")
+
+        found = Accommodation.objects.get(pk=body["rows"][0]["id"])
+        self.assertEqual((found.geo_address, found.latitude, found.longitude), ("GEO", 22.28, 114.14))
+        self.assertIsNone(Accommodation.objects.get(pk=body["rows"][2]["id"]).latitude)
+
+    def test_api_import_jsonl_body(self):
+        lines = [json.dumps(self.VALID), "", "not json", "[1, 2]", json.dumps(dict(self.VALID, beds=-1))]
+        response = self.client.post('/specialist/api_import/?format=jsonl', "\n".join(lines), content_type="text/plain")
+        body = response.json()
+        self.assertEqual((body["created"], body["failed"]), (1, 3))
+        self.assertTrue(body["rows"][1]["errors"]["row"].startswith("Invalid JSON"))
+        self.assertEqual(body["rows"][2]["errors"], {"row": "Each line must be a JSON object"})
+        self.assertEqual(body["rows"][3]["errors"], {"beds": "Must be a positive integer."})
+
+    def test_api_import_rejects_unknown_format_and_method(self):
+        response = self.client.post('/specialist/api_import/', "x", content_type="text/plain")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/specialist/api_import/').status_code, 405)
+        self.assertFalse(Accommodation.objects.exists())
+
+class StatsTest(UnihavenSchemaTestCase):
+    def stats(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/specialist/api_stats')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['stats']
+
+    def counted(self):
+        with connection.cursor() as cursor:
+            return count_stats(cursor)
+
+    def test_counters_follow_every_change(self):
+        self.assertEqual(self.stats(), dict.fromkeys(self.counted(), 0))
+
+        specialist = User.objects.create(name="Specialist", email="specialist@hku.hk", password="x", role=User.SPECIALIST)
+        students = [
+            User.objects.create(name=f"Student {i}", email=f"student{i}@connect.hku.hk", password="x", role=User.STUDENT)
+            for i in range(3)
+        ]
+        accommodations = [
+            Accommodation.objects.create(
+                type="Room", availability_start="2025-01-01", availability_end="2025-06-30",
+                beds=1, bedrooms=1, price=1000, address=f"{i} Pok Fu Lam Road",
+            )
+            for i in range(4)
+        ]
+        reservations = [
+            Reservation.objects.create(user=student, accommodation=accommodation, status=Reservation.CONFIRMED)
+            for student, accommodation in zip(students, accommodations)
+        ]
+        Rating.objects.create(reservation=reservations[0], rating=4)
+        self.assertEqual(self.stats(), {
+            'students': 3, 'specialists': 1, 'accommodations': 4,
+            'reserved_accommodations': 3, 'reservations': 3, 'ratings': 1,
+        })
+
+        self.client.post(f'/specialist/api_cancel?reservation_id={reservations[1].pk}')
+        reservations[2].delete()
+        accommodations[3].delete()
+        User.objects.filter(pk=specialist.pk).update(role=User.STUDENT)
+        stats = self.stats()
+        self.assertEqual(stats, self.counted())
+        self.assertEqual(stats, {
+            'students': 4, 'specialists': 0, 'accommodations': 3,
+            'reserved_accommodations': 1, 'reservations': 2, 'ratings': 1,
+        })
+
+    def test_only_get_is_allowed(self):
+        self.assertEqual(self.client.post('/specialist/api_stats').status_code, 405)
\ No newline at end of file
@@ -0,0 +1,26 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from .models import Accommodation, Reservation
+
+# Reservations in these states no longer hold their accommodation
+INACTIVE = [Reservation.CANCELED, Reservation.COMPLETED]
+
+def change_status(reservation_ids, status):
+    """
+    Move the given reservations to status and bring is_reserved of their accommodations
+    up to date, with one UPDATE of each table in one transaction. Neither the reservations
+    nor the accommodations are loaded, and only accommodations whose flag changes are
+    written. Returns how many of the reservations exist.
+    """
+    reservations = Reservation.objects.filter(reservation_id__in=reservation_ids)
+    held = Exists(
+        Reservation.objects.filter(accommodation_id=OuterRef('pk')).exclude(status__in=INACTIVE)
+    )
+    with transaction.atomic():
+        updated = reservations.update(status=status)
+        if updated:
+            Accommodation.objects.filter(
+                Q(held, is_reserved=False) | Q(~held, is_reserved=True),
+                pk__in=reservations.values('accommodation_id'),
+            ).update(is_reserved=held)
+    return updated
\ No newline at end of file
@@ -4,7 +4,9 @@ from . import views
 urlpatterns = [
     path('add/', views.add_accommodations, name='add_accommodations'),
     path('api_add/', views.api_add, name='api_add'),
+    path('api_import/', views.api_import, name='api_import'),
     path('api_active', views.api_view_active_reservations, name='api_active'),
     path('api_cancel', views.api_cancel_reservation, name='api_cancel'),
     path('api_modify', views.api_modify, name='api_modify'),
+    path('api_stats', views.api_stats, name='api_stats'),
 ]
@@ -1,34 +1,13 @@
 from django.shortcuts import render, HttpResponse
 from django.http import JsonResponse
-from .models import Accommodation, Reservation
+from .models import Accommodation, Reservation, Stats
 from .serializers import AccommodationSerializer, ReservationSerializer
-import json
-import requests
+from accommodations.search_cache import invalidate_search
+from .geocoding import geocode
+from .importer import detect_format, import_accommodations, read_rows
+from .transitions import change_status
 # Create your views here.
 
-def fetch_coordinates(location):
-    url = "https://www.als.gov.hk/lookup?"
-    params = {
-        "q": location.upper(),
-        "n": 1,
-    }
-    try:
-        res = requests.get(url=url, params=params,headers={"Accept": "application/json"})
-        res.raise_for_status()  # Raise an error for bad responses
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching coordinates: {e}")
-        return None
-    return res, res.status_code
-
-# Retrieve geolocation data from the API json response
-def getGeoAddress(jsonData):
-    print(jsonData)
-    data = jsonData["SuggestedAddress"][0]["Address"]["PremisesAddress"]
-    geogAddr = data.get("GeoAddress")
-    latitude = data.get("GeospatialInformation").get("Latitude")
-    longitude = data.get("GeospatialInformation").get("Longitude")
-    return geogAddr, latitude, longitude
-
 def setAccommodation(data):
     accommodation = Accommodation()
     accommodation.availability_start = data.get("startDate")
@@ -38,8 +17,9 @@ def setAccommodation(data):
     accommodation.bedrooms = data.get("bedrooms")
     accommodation.price = data.get("price")
     accommodation.address = data.get("address")
-    query = fetch_coordinates(accommodation.address)[0]
-    accommodation.geo_address, accommodation.latitude, accommodation.longitude = getGeoAddress(json.loads(query.text))
+    location = geocode(accommodation.address)
+    if location:
+        accommodation.geo_address, accommodation.latitude, accommodation.longitude = location
     return accommodation
     
 def add_accommodations(request):
@@ -48,6 +28,7 @@ def add_accommodations(request):
         # For example, save the accommodation details to the database
         accommodation = setAccommodation(request.POST)
         accommodation.save()
+        invalidate_search()
         # Save the accommodation instance to the database
         return render(request, "add.html", {"messages": "Accommodation added successfully!", "accommodation": accommodation})
     return render(request, "add.html")
@@ -56,6 +37,7 @@ def api_add(request):
     if request.method == "POST":
         accommodation = setAccommodation(request.POST)
         accommodation.save()
+        invalidate_search()
         accommodation_details = {
             'id': accommodation.accommodation_id,
             'startDate': accommodation.availability_start,
@@ -73,6 +55,27 @@ def api_add(request):
     else:
         return HttpResponse("Invalid request method.")
 
+def api_import(request):
+    """Bulk import accommodations from an uploaded CSV or JSON lines file."""
+    if request.method != "POST":
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+    # Either a multipart upload in "file" or the raw request body
+    upload = request.FILES.get("file")
+    fmt = detect_format(request, upload)
+    if fmt is None:
+        return JsonResponse({'error': 'Unknown format, use format=csv or format=jsonl'}, status=400)
+
+    report = import_accommodations(read_rows(upload if upload else request, fmt))
+    created = sum(1 for row in report if row["status"] == "created")
+    if created:
+        invalidate_search()
+    return JsonResponse({
+        'created': created,
+        'failed': len(report) - created,
+        'rows': report,
+    })
+
 def api_cancel_reservation(request):
     """Epic 4.1 Cancel reservation via POST with URL parameter."""
     if request.method == 'POST':
@@ -81,13 +84,12 @@ def api_cancel_reservation(request):
             return JsonResponse({'error': 'Reservation ID not provided'}, status=400)
         
         try:
-            reservation = Reservation.objects.get(reservation_id=reservation_id)
-            reservation.status = Reservation.CANCELED
-            reservation.save()  # Triggers save() to update Accommodation.is_reserved
+            # Targeted UPDATEs of the status and Accommodation.is_reserved, without loading either
+            if not change_status([reservation_id], Reservation.CANCELED):
+                return JsonResponse({'error': 'Reservation not found'}, status=404)
+            invalidate_search()
             return JsonResponse({'message': 'Reservation canceled successfully'})
         
-        except Reservation.DoesNotExist:
-            return JsonResponse({'error': 'Reservation not found'}, status=404)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
     else:
@@ -97,7 +99,10 @@ def api_view_active_reservations(request):
     """Epic 4.2 View Active Reservations."""
     if request.method == 'GET':
         # Fetch active reservations
-        active_reservations = Reservation.objects.filter(status__in=['pending', 'confirmed'])
+        active_reservations = (
+            Reservation.objects.filter(status__in=['pending', 'confirmed'])
+            .select_related('user', 'accommodation')
+        )
         serializer = ReservationSerializer(active_reservations, many=True)
         return JsonResponse({'reservations': serializer.data})
     else:
@@ -113,22 +118,29 @@ def api_modify(request):
             return JsonResponse({'error': 'Missing reservation_id or status'}, status=400)
 
         try:
-            reservation = Reservation.objects.get(reservation_id=reservation_id)
             valid_statuses = [status[0] for status in Reservation.STATUS_CHOICES]
             
             if new_status not in valid_statuses:
                 return JsonResponse({'error': 'Invalid status'}, status=400)
             
-            # Update reservation status
-            reservation.status = new_status
-            reservation.save()  # Triggers save() to update Accommodation.is_reserved
+            # Update reservation status and Accommodation.is_reserved with targeted UPDATEs
+            if not change_status([reservation_id], new_status):
+                return JsonResponse({'error': 'Reservation not found'}, status=404)
+            invalidate_search()
             
             return JsonResponse({'message': f'Reservation {reservation_id} status updated to {new_status}'})
         
-        except Reservation.DoesNotExist:
-            return JsonResponse({'error': 'Reservation not found'}, status=404)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
     
     else:
         return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+
+def api_stats(request):
+    """Dashboard statistics, read from the Stats counters instead of counting every table."""
+    if request.method == 'GET':
+        stats = dict(Stats.objects.values_list('name', 'value'))
+        return JsonResponse({'stats': stats})
+    else:
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
\ No newline at end of file
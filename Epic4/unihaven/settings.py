@@ -11,10 +11,14 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import sys
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Shared helpers in ../database (geoclient, ...) are imported as top-level modules
+sys.path.append(str(BASE_DIR.parent / "database"))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -78,6 +82,21 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "unihaven.db",
+        # Transactions take the write lock when they begin, waiting up to "timeout"
+        # seconds for another writer, instead of failing with "database is locked"
+        # when a transaction that has read tries to write
+        "OPTIONS": {"transaction_mode": "IMMEDIATE", "timeout": 5},
+    }
+}
+
+# Cached api_search responses. Local memory is per process: with several worker
+# processes switch to django.core.cache.backends.filebased.FileBasedCache so that
+# invalidate_search() reaches all of them
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "unihaven",
+        "OPTIONS": {"MAX_ENTRIES": 1000},
     }
 }
 
@@ -122,3 +141,6 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# DATA.GOV.HK Address Lookup Service used to geocode accommodation addresses
+ALS_LOOKUP_URL = "https://www.als.gov.hk/lookup"
@@ -0,0 +1,38 @@
+from django.db import IntegrityError, connection
+from django.db.models.expressions import RawSQL
+from dbconnection import LISTED_BETWEEN, RESERVED_BETWEEN
+from dbutils import CLAIM_ACCOMMODATION, claim_error
+
+# The AVAILABLE_BETWEEN subqueries with Django's placeholders. Applied to the outer
+# queryset on their own, each is a range probe of its interval index, so the ids never
+# come from a scan of Accommodation
+LISTED_IDS = LISTED_BETWEEN.replace('?', '%s')
+RESERVED_IDS = RESERVED_BETWEEN.replace('?', '%s')
+
+def available_between(queryset, start_date, end_date):
+    """Accommodations of a Django queryset free for the whole window: listed for it and not reserved on any of its days"""
+    start, end = start_date.isoformat(), end_date.isoformat()
+    return (queryset.filter(accommodation_id__in=RawSQL(LISTED_IDS, (start, end)))
+            .exclude(accommodation_id__in=RawSQL(RESERVED_IDS, (end, start))))
+
+def claim_accommodation(reservation):
+    """
+    Claim the accommodation of a new Django reservation with CLAIM_ACCOMMODATION, on the
+    connection of the surrounding transaction. Raises IntegrityError with the reason if
+    the stay is outside the listing or overlaps an active reservation.
+    """
+    check_in, check_out = (str(day) if day else None for day in (reservation.check_in, reservation.check_out))
+    params = {
+        'accommodation_id': reservation.accommodation_id, 'status': reservation.status,
+        'check_in': check_in, 'check_out': check_out,
+    }
+    # The statements use sqlite3 placeholders, which Django's cursors cannot log, so
+    # they run on the sqlite3 connection itself, still inside Django's transaction
+    connection.ensure_connection()
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(CLAIM_ACCOMMODATION, params)
+        if cursor.fetchone() is None:
+            raise IntegrityError(claim_error(cursor, reservation.accommodation_id, check_in, check_out))
+    finally:
+        cursor.close()
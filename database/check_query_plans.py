@@ -0,0 +1,196 @@
+import itertools
+import os
+import re
+import sqlite3
+import sys
+from urllib.parse import parse_qsl, urlsplit
+
+# searchAndFilterDB.py lives in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from searchAndFilterDB import buildSearchQuery
+
+# Arguments of searchAndFilterDB.search with a sample value for each filter
+SEARCH_FILTERS = {
+    'accommodation_type': {'accommodation_type': 'Flat'},
+    'availability': {'availability_start': '2025-01-01', 'availability_end': '2025-06-30'},
+    'min_beds': {'min_beds': 2},
+    'min_bedrooms': {'min_bedrooms': 1},
+    'max_price': {'max_price': 15000},
+}
+
+# Django search endpoint of each project directory: its URL, the parameters sent with
+# every request and a sample value for each filter. Giving both dates applies the
+# availability window filter, giving one of them filters on that side only
+ENDPOINTS = {
+    'Epic4': {
+        'url': '/accommodations/api_search',
+        'params': {'campus_id': '1', 'limit': '5'},
+        'filters': {
+            'type': '2',
+            'start_date': '2025-01-01',
+            'end_date': '2025-06-30',
+            'min_beds': '2',
+            'min_bedrooms': '1',
+            'max_price': '15000',
+            'radius_km': '5',
+        },
+    },
+    'Epic1_Sprint1_demo': {
+        'url': '/accommodations/api/search/',
+        'params': {'campus': '1', 'limit': '5'},
+        'filters': {
+            'accommodation_type': 'Flat',
+            'availability_start': '2025-01-01',
+            'availability_end': '2025-06-30',
+            'min_beds': '2',
+            'min_bedrooms': '1',
+            'max_price': '15000',
+            'is_reserved': '0',
+        },
+    },
+}
+
+SORTS = ('distance', 'price', 'rating')
+
+SCAN_PATTERN = re.compile(r'^SCAN (TABLE )?(Accommodation|AccommodationCampusDistance|campus_distance)\b')
+
+def combinations(filters):
+    """Every non-empty combination of the given filter names"""
+    for size in range(1, len(filters) + 1):
+        yield from itertools.combinations(filters, size)
+
+def search_queries():
+    """Queries generated by searchAndFilterDB.buildSearchQuery"""
+    for combo in combinations(SEARCH_FILTERS):
+        kwargs = dict.fromkeys(['accommodation_type', 'availability_start', 'availability_end',
+                                'min_beds', 'min_bedrooms', 'max_price'])
+        for name in combo:
+            kwargs.update(SEARCH_FILTERS[name])
+        yield combo, buildSearchQuery(**kwargs)
+
+def setup_django(project_dir, db_path):
+    """Set up the Django project in project_dir on the database at db_path"""
+    import django
+    from django.conf import settings
+
+    sys.path.insert(0, os.path.abspath(project_dir))
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'unihaven.settings'
+    settings.DATABASES['default']['NAME'] = os.path.abspath(db_path)
+    django.setup()
+
+def next_page(response):
+    """Parameters of the page after response, from its Link header or its 'next' URL"""
+    link = response.headers.get('Link')
+    if link:
+        url = link[1:link.index('>')]
+    else:
+        body = response.json()
+        url = body.get('next') if isinstance(body, dict) else None
+    return dict(parse_qsl(urlsplit(url).query)) if url else None
+
+def endpoint_queries(project_dir):
+    """
+    SQL the Django search endpoint of project_dir compiles for every filter combination
+    and sort, captured while it serves the first page and the page after it
+    """
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import Client
+
+    endpoint = ENDPOINTS[os.path.basename(os.path.abspath(project_dir))]
+    client = Client(SERVER_NAME='localhost')
+
+    for sort in SORTS:
+        for combo in itertools.chain([()], combinations(endpoint['filters'])):
+            params = dict(endpoint['params'], sort=sort)
+            params.update((name, endpoint['filters'][name]) for name in combo)
+
+            for page in ('first page', 'next page'):
+                queries = []
+
+                def record(execute, sql, sql_params, many, context):
+                    if sql.lstrip().startswith('SELECT') and 'Accommodation' in sql:
+                        queries.append((sql, sql_params))
+                    return execute(sql, sql_params, many, context)
+
+                # Identical searches are answered from the cache without any SQL
+                cache.clear()
+                with connection.execute_wrapper(record):
+                    response = client.get(endpoint['url'], params)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{endpoint['url']} returned {response.status_code} for {params}")
+
+                for query in queries:
+                    yield (f'sort={sort}',) + combo + (page,), query
+                params = next_page(response)
+                if params is None:
+                    break
+
+def scans(plan):
+    """
+    Steps of an EXPLAIN QUERY PLAN result that read the whole Accommodation or distance
+    table: a scan without an index, a scan inside a subquery, or an index scan whose rows
+    still have to be sorted. A scan of the index the query is ordered by stops at the page
+    """
+    details = {row[0]: (row[1], row[3]) for row in plan}
+    sorted_later = any(row[3].startswith('USE TEMP B-TREE FOR ORDER BY') for row in plan)
+
+    def in_subquery(node):
+        parent = details[node][0]
+        while parent in details:
+            if 'SUBQUERY' in details[parent][1]:
+                return True
+            parent = details[parent][0]
+        return False
+
+    return [
+        detail for node, (_, detail) in details.items()
+        if SCAN_PATTERN.match(detail)
+        and (' INDEX ' not in detail or sorted_later or in_subquery(node))
+    ]
+
+def explain(cursor, queries):
+    """Run EXPLAIN QUERY PLAN for every query and return the ones that scan"""
+    failures = []
+    for combo, (query, params) in queries:
+        cursor.execute('EXPLAIN QUERY PLAN ' + query, params)
+        plan = cursor.fetchall()
+        if scans(plan):
+            failures.append((combo, [row[3] for row in plan]))
+    return failures
+
+def check_query_plans(db_path='unihaven.db', project_dir=None):
+    """
+    Run EXPLAIN QUERY PLAN for every supported filter combination of searchAndFilterDB
+    and, given a project directory, of its Django search endpoint, and return the ones that scan
+    """
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        failures = explain(cursor, search_queries())
+    finally:
+        cursor.close()
+        conn.close()
+
+    if project_dir is not None:
+        setup_django(project_dir, db_path)
+        from django.db import connection
+
+        # Django's cursor takes the %s placeholders of the captured queries
+        with connection.cursor() as django_cursor:
+            failures += explain(django_cursor, list(endpoint_queries(project_dir)))
+    return failures
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'unihaven.db'
+    project_dir = sys.argv[2] if len(sys.argv) > 2 else None
+    failures = check_query_plans(db_path, project_dir)
+
+    for combo, details in failures:
+        print(f"Table scan for filters {', '.join(combo)}: {'; '.join(details)}")
+
+    if failures:
+        print(f"\n{len(failures)} queries fall back to a table scan. Run migrate.py on {db_path}.")
+        sys.exit(1)
+    print("All queries use an index.")
\ No newline at end of file
@@ -1,14 +1,9 @@
 import sqlite3
 import datetime
+from migrate import apply_migrations, migrate
 
-def create_database():
-    # Connect to the database
-    conn = sqlite3.connect('unihaven.db')
-    cursor = conn.cursor()
-
-    # Enable foreign key constraints
-    cursor.execute("PRAGMA foreign_keys = ON;")
-
+def create_tables(cursor):
+    """Create the original tables and triggers; migrate.py brings them up to the current schema"""
     # Create User table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS User (
@@ -124,6 +119,16 @@ def create_database():
     END;
     ''')
 
+def create_database(db_path='unihaven.db'):
+    # Connect to the database
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    # Enable foreign key constraints
+    cursor.execute("PRAGMA foreign_keys = ON;")
+
+    create_tables(cursor)
+
     # Commit changes
     conn.commit()
     
@@ -141,6 +146,38 @@ def create_database():
     cursor.close()
     conn.close()
 
+    # Apply schema migrations (search indexes and later additions)
+    migrate(db_path)
+
+def table_names(conn):
+    """{name: CREATE statement} of the tables in a database, without SQLite's own"""
+    rows = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")
+    return dict(rows.fetchall())
+
+def create_schema(conn):
+    """
+    Build the current schema on an open connection that may already hold other
+    tables, such as a Django test database. Returns the names of the new tables.
+    """
+    before = table_names(conn)
+    cursor = conn.cursor()
+    create_tables(cursor)
+    cursor.close()
+    conn.commit()
+    apply_migrations(conn, log=None)
+    return [name for name in table_names(conn) if name not in before]
+
+def drop_schema(conn, tables):
+    """Drop the tables create_schema returned, with their indexes and triggers"""
+    sql = table_names(conn)
+    conn.execute("PRAGMA foreign_keys = OFF")
+    # Virtual tables first, they drop their own shadow tables
+    for name in sorted(tables, key=lambda name: not sql.get(name, '').startswith('CREATE VIRTUAL')):
+        conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+    conn.execute("PRAGMA user_version = 0")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.commit()
+
 if __name__ == "__main__":
     create_database()
-    print("\nDatabase created with all tables, constraints, and triggers.")
\ No newline at end of file
+    print("\nDatabase created with all tables, constraints, triggers, and indexes.")
\ No newline at end of file
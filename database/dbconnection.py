@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import threading
+
+DB_PATH = 'unihaven.db'
+
+# Applied to every new connection. WAL lets readers run while a write is in
+# progress, and synchronous=NORMAL is safe with WAL while avoiding an fsync per commit.
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -20000",       # 20 MB page cache
+    "PRAGMA mmap_size = 268435456",     # Memory-map up to 256 MB of the file
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",       # Wait up to 5 s for another writer
+]
+
+# Prepared statements kept per connection; the helpers reuse the same SQL text
+# so repeated calls skip parsing and planning
+CACHED_STATEMENTS = 256
+
+# Columns callers may ask for by name; anything else is rejected before it reaches SQL
+ACCOMMODATION_COLUMNS = (
+    'accommodation_id', 'availability_start', 'availability_end', 'type', 'beds',
+    'bedrooms', 'price', 'address', 'latitude', 'longitude', 'geo_address',
+    'is_reserved', 'average_rating', 'rating_count', 'rating_sum', 'rating_score',
+    'version', 'updated_at',
+)
+
+# Reservations in these states hold their accommodation
+ACTIVE_RESERVATION = "status NOT IN ('canceled', 'completed')"
+
+# Range of the AccommodationAvailability and ReservationPeriod day numbers;
+# a reservation without dates holds its accommodation from FIRST_DAY to LAST_DAY
+FIRST_DAY = 0
+LAST_DAY = 2147483647
+
+# Stand-ins for the missing side of an open-ended stay (check-out is exclusive)
+OPEN_START = '0000-01-01'
+OPEN_END = '9999-12-31'
+
+# Accommodations listed for the whole window, a range probe of the AccommodationAvailability
+# interval index; parameters are (start, end)
+LISTED_BETWEEN = '''SELECT accommodation_id FROM AccommodationAvailability
+        WHERE start_day <= CAST(julianday(?) AS INTEGER) AND end_day >= CAST(julianday(?) AS INTEGER)'''
+
+# Accommodations an active reservation holds on some day of the window, a range probe
+# of the ReservationPeriod interval index; parameters are (end, start)
+RESERVED_BETWEEN = '''SELECT accommodation_id FROM ReservationPeriod
+        WHERE start_day <= CAST(julianday(?) AS INTEGER) AND end_day >= CAST(julianday(?) AS INTEGER)'''
+
+# Accommodations listed for the whole window that no active reservation overlaps,
+# answered from the two interval indexes; parameters are (start, end, end, start)
+AVAILABLE_BETWEEN = f'''accommodation_id IN (
+        {LISTED_BETWEEN}
+    )
+    AND accommodation_id NOT IN (
+        {RESERVED_BETWEEN}
+    )'''
+
+_local = threading.local()
+_all_connections = []
+_all_lock = threading.Lock()
+
+def get_connection(db_path=DB_PATH):
+    """
+    Long-lived connection to db_path for the calling thread, opened on first use.
+    The connection is shared by every helper, so callers must commit or roll back
+    before returning rather than close it.
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    key = os.path.abspath(db_path)
+    conn = connections.get(key)
+    if conn is None:
+        conn = sqlite3.connect(db_path, cached_statements=CACHED_STATEMENTS)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        connections[key] = conn
+        with _all_lock:
+            _all_connections.append(conn)
+    return conn
+
+def close_connection(db_path=DB_PATH):
+    """Close the calling thread's connection to db_path, if it has one"""
+    connections = getattr(_local, 'connections', {})
+    conn = connections.pop(os.path.abspath(db_path), None)
+    if conn is not None:
+        with _all_lock:
+            _all_connections.remove(conn)
+        conn.close()
+
+def select_list(columns, allowed):
+    """SQL select list for the named columns, all allowed columns if columns is None"""
+    if columns is None:
+        return ', '.join(allowed)
+    unknown = [column for column in columns if column not in allowed]
+    if unknown or not columns:
+        raise ValueError(f"Unknown columns: {', '.join(unknown) or '(none given)'}")
+    return ', '.join(columns)
+
+def day_number(date_sql):
+    """SQL for the whole Julian day number of a date expression, as stored in the interval indexes"""
+    return f'CAST(julianday({date_sql}) AS INTEGER)'
+
+def overlapping_reservations(accommodation_id, check_in, check_out, exclude=None):
+    """
+    SQL selecting the active reservations of an accommodation that overlap a stay,
+    given SQL expressions for the arguments. A missing date leaves that side of a
+    stay open, so a reservation without dates overlaps every other one. Only the
+    accommodation's own bookings are read, through idx_reservation_accommodation_dates.
+    """
+    query = f'''
+    SELECT reservation_id FROM Reservation
+    WHERE accommodation_id = {accommodation_id} AND {ACTIVE_RESERVATION}
+      AND COALESCE(check_in, '{OPEN_START}') < COALESCE({check_out}, '{OPEN_END}')
+      AND COALESCE(check_out, '{OPEN_END}') > COALESCE({check_in}, '{OPEN_START}')
+    '''
+    if exclude is not None:
+        query += f'  AND reservation_id IS NOT {exclude}\n    '
+    return query
+
+def is_busy(error):
+    """Whether an OperationalError means another connection held the write lock past busy_timeout"""
+    return isinstance(error, sqlite3.OperationalError) and 'locked' in str(error)
+
+def close_all():
+    """Close every connection still open, committing nothing that was left pending"""
+    with _all_lock:
+        connections, _all_connections[:] = list(_all_connections), []
+    for conn in connections:
+        try:
+            conn.rollback()
+            conn.close()
+        except sqlite3.ProgrammingError:
+            # Connections belong to their thread; the interpreter frees the others
+            pass
+    _local.__dict__.clear()
\ No newline at end of file
@@ -1,9 +1,144 @@
 import sqlite3
 import datetime
+import math
+import time
+from dbconnection import ACCOMMODATION_COLUMNS, get_connection, is_busy, overlapping_reservations, select_list
+
+EARTH_RADIUS_KM = 6371
+
+# Bayesian rating score: every accommodation starts with RATING_PRIOR_WEIGHT
+# imaginary ratings of RATING_PRIOR_MEAN, so a single 5-star rating cannot
+# outrank a listing with dozens of good ones
+RATING_PRIOR_MEAN = 3.0
+RATING_PRIOR_WEIGHT = 5
+RATING_SCORE = f'(rating_sum + {RATING_PRIOR_WEIGHT} * {RATING_PRIOR_MEAN}) / (rating_count + {RATING_PRIOR_WEIGHT})'
+
+# Claims an accommodation for a new reservation in one statement. The row is only
+# updated, and returned, if the stay lies inside its listing and no active reservation
+# overlaps it, so checking and claiming cannot be interleaved with another booking
+CLAIM_ACCOMMODATION = f'''
+UPDATE Accommodation
+SET is_reserved = is_reserved OR :status NOT IN ('canceled', 'completed')
+WHERE accommodation_id = :accommodation_id
+  AND (:check_in IS NULL OR :check_out IS NULL
+       OR (availability_start <= :check_in AND :check_in < :check_out AND :check_out <= availability_end))
+  AND NOT EXISTS ({overlapping_reservations(':accommodation_id', ':check_in', ':check_out')})
+RETURNING accommodation_id
+'''
+
+# make_reservation tries this many times to take the write lock, each attempt
+# already waiting up to busy_timeout, with RESERVATION_RETRY_DELAY doubled in between
+RESERVATION_ATTEMPTS = 5
+RESERVATION_RETRY_DELAY = 0.05  # Seconds
+
+# Every statistic in one row, reading each table once
+STATS_QUERY = '''
+SELECT u.students, u.specialists, a.accommodations, a.reserved_accommodations, r.reservations, g.ratings
+FROM (SELECT COUNT(*) FILTER (WHERE role = 'Student') AS students,
+             COUNT(*) FILTER (WHERE role = 'Specialist') AS specialists FROM User) u,
+     (SELECT COUNT(*) AS accommodations,
+             COUNT(*) FILTER (WHERE is_reserved = 1) AS reserved_accommodations FROM Accommodation) a,
+     (SELECT COUNT(*) AS reservations FROM Reservation) r,
+     (SELECT COUNT(*) AS ratings FROM Rating) g
+'''
+
+# Set rating_sum, rating_count and average_rating of every rated accommodation from
+# Rating with one GROUP BY, touching only rows whose stored values are wrong
+REBUILD_RATING_AGGREGATES = '''
+UPDATE Accommodation
+SET rating_sum = totals.rating_sum,
+    rating_count = totals.rating_count,
+    average_rating = totals.rating_sum * 1.0 / totals.rating_count
+FROM (
+    SELECT r.accommodation_id, SUM(g.rating) AS rating_sum, COUNT(*) AS rating_count
+    FROM Rating g JOIN Reservation r ON r.reservation_id = g.reservation_id
+    GROUP BY r.accommodation_id
+) AS totals
+WHERE Accommodation.accommodation_id = totals.accommodation_id
+  AND (Accommodation.rating_sum IS NOT totals.rating_sum
+       OR Accommodation.rating_count IS NOT totals.rating_count
+       OR Accommodation.average_rating IS NOT totals.rating_sum * 1.0 / totals.rating_count)
+'''
+
+# Clear the aggregates of accommodations that have no ratings left
+REBUILD_RATING_AGGREGATES_RESET = '''
+UPDATE Accommodation
+SET rating_sum = 0, rating_count = 0, average_rating = 0
+WHERE (rating_sum IS NOT 0 OR rating_count IS NOT 0 OR average_rating IS NOT 0)
+  AND accommodation_id NOT IN (
+    SELECT r.accommodation_id FROM Rating g JOIN Reservation r ON r.reservation_id = g.reservation_id
+  )
+'''
+
+def count_stats(cursor):
+    """{name: count} for every statistic, counted from the tables with STATS_QUERY"""
+    cursor.execute(STATS_QUERY)
+    names = [desc[0] for desc in cursor.description]
+    return dict(zip(names, cursor.fetchone()))
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between two points"""
+    lon1, lat1, lon2, lat2 = map(math.radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    return EARTH_RADIUS_KM * 2 * math.asin(math.sqrt(a))
+
+def haversine_sql(lat1, lon1, lat2, lon2):
+    """
+    SQL for haversine() given SQL expressions for the coordinates, built on SQLite's
+    math functions so triggers can compute distances on any connection
+    """
+    a = (f'power(sin(radians({lat2} - {lat1}) / 2), 2) + '
+         f'cos(radians({lat1})) * cos(radians({lat2})) * power(sin(radians({lon2} - {lon1}) / 2), 2)')
+    # Rounding can push a just past 1 for antipodal points, where asin() returns NULL
+    return f'{EARTH_RADIUS_KM} * 2 * asin(sqrt(min(1.0, {a})))'
+
+def update_campus_distances(cursor, accommodation_id=None, campus_id=None, accommodation_ids=None):
+    """Recompute AccommodationCampusDistance rows for some accommodations, one campus, or everything"""
+    if accommodation_id is not None:
+        accommodation_ids = [accommodation_id]
+    accommodation_filter = ''
+    campus_filter = ''
+    params = []
+    if accommodation_ids is not None:
+        accommodation_filter = f' AND a.accommodation_id IN ({", ".join("?" * len(accommodation_ids))})'
+        params.extend(accommodation_ids)
+    if campus_id is not None:
+        campus_filter = ' AND c.campus_id = ?'
+        params.append(campus_id)
+
+    cursor.execute(f'''
+    SELECT a.accommodation_id, c.campus_id, a.latitude, a.longitude, c.latitude, c.longitude
+    FROM Accommodation a CROSS JOIN Campus c
+    WHERE a.latitude IS NOT NULL AND a.longitude IS NOT NULL{accommodation_filter}{campus_filter}
+    ''', params)
+    rows = [(acc_id, c_id, haversine(lat, lon, c_lat, c_lon))
+            for acc_id, c_id, lat, lon, c_lat, c_lon in cursor.fetchall()]
+
+    if accommodation_ids is not None:
+        cursor.executemany('DELETE FROM AccommodationCampusDistance WHERE accommodation_id = ?',
+                           [(acc_id,) for acc_id in accommodation_ids])
+    if campus_id is not None:
+        cursor.execute('DELETE FROM AccommodationCampusDistance WHERE campus_id = ?', (campus_id,))
+    cursor.executemany('''
+    INSERT OR REPLACE INTO AccommodationCampusDistance (accommodation_id, campus_id, distance)
+    VALUES (?, ?, ?)
+    ''', rows)
+
+def inserted_ids(cursor, table, id_column, last_id):
+    """IDs of the rows added to table after last_id, in insertion order"""
+    cursor.execute(f'SELECT {id_column} FROM {table} WHERE {id_column} > ? ORDER BY {id_column}', (last_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+def last_id(cursor, table, id_column):
+    """Largest ID in table, 0 if it is empty"""
+    cursor.execute(f'SELECT COALESCE(MAX({id_column}), 0) FROM {table}')
+    return cursor.fetchone()[0]
 
 def register_user(name, email, password, role):
     """Register a new user in the system"""
-    conn = sqlite3.connect('unihaven.db')
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -19,12 +154,41 @@ def register_user(name, email, password, role):
         return None
     finally:
         cursor.close()
-        conn.close()
+        if conn.in_transaction:
+            conn.rollback()
+
+def register_users_bulk(users):
+    """
+    Register many users in one transaction.
+    users is a list of (name, email, password, role) tuples; returns their user_ids
+    in the same order, or None if any of them fails (nothing is saved then).
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        # BEGIN IMMEDIATE takes the write lock, so the new IDs follow the current maximum
+        cursor.execute('BEGIN IMMEDIATE')
+        previous = last_id(cursor, 'User', 'user_id')
+        cursor.executemany('''
+        INSERT INTO User (name, email, password, role) 
+        VALUES (?, ?, ?, ?)
+        ''', users)
+        user_ids = inserted_ids(cursor, 'User', 'user_id', previous)
+        conn.commit()
+        return user_ids
+    except sqlite3.IntegrityError as e:
+        print(f"Error registering users: {e}")
+        return None
+    finally:
+        cursor.close()
+        if conn.in_transaction:
+            conn.rollback()
 
 def add_accommodation(availability_start, availability_end, type, beds, bedrooms, 
                      price, address, latitude=None, longitude=None, geo_address=None):
     """Add a new accommodation listing"""
-    conn = sqlite3.connect('unihaven.db')
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -43,11 +207,43 @@ def add_accommodation(availability_start, availability_end, type, beds, bedrooms
         return None
     finally:
         cursor.close()
-        conn.close()
+        if conn.in_transaction:
+            conn.rollback()
+
+def add_accommodations_bulk(accommodations):
+    """
+    Add many accommodation listings in one transaction.
+    accommodations is a list of tuples with the arguments of add_accommodation
+    (latitude, longitude and geo_address may be left out); returns their
+    accommodation_ids in the same order, or None if any of them fails.
+    """
+    rows = [tuple(acc) + (None,) * (10 - len(acc)) for acc in accommodations]
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        previous = last_id(cursor, 'Accommodation', 'accommodation_id')
+        cursor.executemany('''
+        INSERT INTO Accommodation (availability_start, availability_end, type, beds, 
+                                  bedrooms, price, address, latitude, longitude, geo_address, 
+                                  is_reserved, average_rating, rating_count) 
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, 0, 0)
+        ''', rows)
+        accommodation_ids = inserted_ids(cursor, 'Accommodation', 'accommodation_id', previous)
+        conn.commit()
+        return accommodation_ids
+    except sqlite3.IntegrityError as e:
+        print(f"Error adding accommodations: {e}")
+        return None
+    finally:
+        cursor.close()
+        if conn.in_transaction:
+            conn.rollback()
 
 def add_campus(name, latitude, longitude):
     """Add a new campus location"""
-    conn = sqlite3.connect('unihaven.db')
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -63,44 +259,114 @@ def add_campus(name, latitude, longitude):
         return None
     finally:
         cursor.close()
-        conn.close()
+        if conn.in_transaction:
+            conn.rollback()
 
-def make_reservation(user_id, accommodation_id, status='pending'):
-    """Create a new reservation"""
-    conn = sqlite3.connect('unihaven.db')
+def make_reservation(user_id, accommodation_id, status='pending', check_in=None, check_out=None):
+    """
+    Create a new reservation, from check_in up to (not including) check_out.
+    Without dates the reservation holds the accommodation for its whole listing.
+    The accommodation is claimed and the reservation inserted in one BEGIN IMMEDIATE
+    transaction, retried while another writer holds the database.
+    """
+    conn = get_connection()
     cursor = conn.cursor()
+    params = {
+        'user_id': user_id, 'accommodation_id': accommodation_id, 'status': status,
+        'check_in': check_in, 'check_out': check_out,
+    }
     
     try:
-        # Check if the accommodation is already reserved
-        cursor.execute('SELECT is_reserved FROM Accommodation WHERE accommodation_id = ?', (accommodation_id,))
-        result = cursor.fetchone()
+        for attempt in range(RESERVATION_ATTEMPTS):
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute(CLAIM_ACCOMMODATION, params)
+                if cursor.fetchone() is None:
+                    conn.rollback()
+                    print(f"Error: {claim_error(cursor, accommodation_id, check_in, check_out)}")
+                    return None
+                
+                cursor.execute('''
+                INSERT INTO Reservation (user_id, accommodation_id, status, check_in, check_out) 
+                VALUES (:user_id, :accommodation_id, :status, :check_in, :check_out)
+                ''', params)
+                reservation_id = cursor.lastrowid
+                conn.commit()
+                return reservation_id
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                if not is_busy(e) or attempt == RESERVATION_ATTEMPTS - 1:
+                    print(f"Error creating reservation: {e}")
+                    return None
+                time.sleep(RESERVATION_RETRY_DELAY * 2 ** attempt)
+    except sqlite3.IntegrityError as e:
+        print(f"Error creating reservation: {e}")
+        return None
+    finally:
+        cursor.close()
+        if conn.in_transaction:
+            conn.rollback()
+
+def claim_error(cursor, accommodation_id, check_in, check_out):
+    """Why CLAIM_ACCOMMODATION did not claim an accommodation"""
+    cursor.execute(
+        'SELECT availability_start, availability_end FROM Accommodation WHERE accommodation_id = ?',
+        (accommodation_id,)
+    )
+    result = cursor.fetchone()
+    if result is None:
+        return f"Accommodation {accommodation_id} not found"
+    if check_in and check_out and not (result[0] <= check_in < check_out <= result[1]):
+        return f"Accommodation {accommodation_id} is not listed from {check_in} to {check_out}"
+    return f"Accommodation {accommodation_id} is already reserved for these dates"
+
+def make_reservations_bulk(reservations):
+    """
+    Create many reservations in one transaction.
+    reservations is a list of (user_id, accommodation_id, status) tuples, optionally
+    followed by check_in and check_out, so the final status is set when the row is
+    inserted; returns their reservation_ids in the same order, or None if any
+    accommodation is missing or any reservation overlaps another one.
+    """
+    rows = [tuple(reservation) + (None,) * (5 - len(reservation)) for reservation in reservations]
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
         
-        if result is None:
-            print(f"Error: Accommodation {accommodation_id} not found")
-            return None
+        # Check every accommodation exists; overlapping reservations, including two
+        # in this batch, are refused by the prevent_reservation_overlap_insert trigger
+        accommodation_ids = sorted({row[1] for row in rows})
+        cursor.execute(f'''
+        SELECT accommodation_id FROM Accommodation
+        WHERE accommodation_id IN ({", ".join("?" * len(accommodation_ids))})
+        ''', accommodation_ids)
+        found = {row[0] for row in cursor.fetchall()}
+        for accommodation_id in accommodation_ids:
+            if accommodation_id not in found:
+                print(f"Error: Accommodation {accommodation_id} not found")
+                return None
         
-        if result[0] == 1:
-            print(f"Error: Accommodation {accommodation_id} is already reserved")
-            return None
-            
-        # Create the reservation
-        cursor.execute('''
-        INSERT INTO Reservation (user_id, accommodation_id, status) 
-        VALUES (?, ?, ?)
-        ''', (user_id, accommodation_id, status))
-        reservation_id = cursor.lastrowid
+        previous = last_id(cursor, 'Reservation', 'reservation_id')
+        cursor.executemany('''
+        INSERT INTO Reservation (user_id, accommodation_id, status, check_in, check_out) 
+        VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        reservation_ids = inserted_ids(cursor, 'Reservation', 'reservation_id', previous)
         conn.commit()
-        return reservation_id
+        return reservation_ids
     except sqlite3.IntegrityError as e:
-        print(f"Error creating reservation: {e}")
+        print(f"Error creating reservations: {e}")
         return None
     finally:
         cursor.close()
-        conn.close()
+        if conn.in_transaction:
+            conn.rollback()
 
 def update_reservation_status(reservation_id, status):
     """Update reservation status"""
-    conn = sqlite3.connect('unihaven.db')
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
@@ -114,11 +380,12 @@ def update_reservation_status(reservation_id, status):
         return False
     finally:
         cursor.close()
-        conn.close()
+        if conn.in_transaction:
+            conn.rollback()
 
 def add_rating(reservation_id, rating):
     """Add a rating for a completed reservation"""
-    conn = sqlite3.connect('unihaven.db')
+    conn = get_connection()
     cursor = conn.cursor()
     
     today = datetime.datetime.now().strftime("%Y-%m-%d")
@@ -149,62 +416,101 @@ def add_rating(reservation_id, rating):
         return None
     finally:
         cursor.close()
-        conn.close()
+        if conn.in_transaction:
+            conn.rollback()
 
-def get_accommodation_with_rating(accommodation_id):
-    """Get accommodation details with its rating information"""
-    conn = sqlite3.connect('unihaven.db')
+def add_ratings_bulk(ratings):
+    """
+    Add many ratings in one transaction.
+    ratings is a list of (reservation_id, rating) tuples for completed reservations;
+    returns their rating_ids in the same order, or None if any of them fails.
+    """
+    today = datetime.datetime.now().strftime("%Y-%m-%d")
+    conn = get_connection()
     cursor = conn.cursor()
     
     try:
-        cursor.execute('''
-        SELECT * FROM Accommodation WHERE accommodation_id = ?
-        ''', (accommodation_id,))
+        cursor.execute('BEGIN IMMEDIATE')
         
-        result = cursor.fetchone()
-        if result:
-            # Convert to dictionary for easier access
-            columns = [desc[0] for desc in cursor.description]
-            accommodation = dict(zip(columns, result))
-            return accommodation
+        reservation_ids = [reservation_id for reservation_id, _ in ratings]
+        cursor.execute(f'''
+        SELECT reservation_id, status FROM Reservation
+        WHERE reservation_id IN ({", ".join("?" * len(reservation_ids))})
+        ''', reservation_ids)
+        statuses = dict(cursor.fetchall())
+        for reservation_id in reservation_ids:
+            if reservation_id not in statuses:
+                print(f"Error: Reservation {reservation_id} not found")
+                return None
+            if statuses[reservation_id] != 'completed':
+                print(f"Error: Reservation {reservation_id} is not completed")
+                return None
+        
+        previous = last_id(cursor, 'Rating', 'rating_id')
+        cursor.executemany('''
+        INSERT INTO Rating (reservation_id, rating, date) 
+        VALUES (?, ?, ?)
+        ''', [(reservation_id, rating, today) for reservation_id, rating in ratings])
+        rating_ids = inserted_ids(cursor, 'Rating', 'rating_id', previous)
+        conn.commit()
+        return rating_ids
+    except sqlite3.IntegrityError as e:
+        print(f"Error adding ratings: {e}")
         return None
+    finally:
+        cursor.close()
+        if conn.in_transaction:
+            conn.rollback()
+
+def get_accommodation_with_rating(accommodation_id, columns=None):
+    """
+    Get accommodation details with its rating information as a sqlite3.Row
+    (indexable by column name), selecting only the named columns if given
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    
+    try:
+        cursor.execute(f'''
+        SELECT {select_list(columns, ACCOMMODATION_COLUMNS)} FROM Accommodation WHERE accommodation_id = ?
+        ''', (accommodation_id,))
+        return cursor.fetchone()
     except sqlite3.Error as e:
         print(f"Error retrieving accommodation: {e}")
         return None
     finally:
         cursor.close()
-        conn.close()
+        if conn.in_transaction:
+            conn.rollback()
 
 def get_stats():
-    """Get database statistics"""
-    conn = sqlite3.connect('unihaven.db')
+    """Get database statistics from the trigger-maintained Stats table"""
+    conn = get_connection()
     cursor = conn.cursor()
     
-    stats = {}
-    
     try:
-        cursor.execute("SELECT COUNT(*) FROM User WHERE role='Student'")
-        stats['students'] = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM User WHERE role='Specialist'")
-        stats['specialists'] = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM Accommodation")
-        stats['accommodations'] = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM Accommodation WHERE is_reserved=1")
-        stats['reserved_accommodations'] = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM Reservation")
-        stats['reservations'] = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM Rating")
-        stats['ratings'] = cursor.fetchone()[0]
-        
-        return stats
+        cursor.execute("SELECT name, value FROM Stats")
+        return dict(cursor.fetchall())
     except sqlite3.Error as e:
         print(f"Error getting stats: {e}")
         return None
     finally:
         cursor.close()
-        conn.close()
\ No newline at end of file
+        if conn.in_transaction:
+            conn.rollback()
+
+def compute_stats():
+    """Count the statistics from the tables themselves in one query, e.g. to check the Stats table"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        return count_stats(cursor)
+    except sqlite3.Error as e:
+        print(f"Error computing stats: {e}")
+        return None
+    finally:
+        cursor.close()
+        if conn.in_transaction:
+            conn.rollback()
\ No newline at end of file
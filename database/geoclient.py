@@ -0,0 +1,214 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Limits for requests to a single host, shared by every thread in the process
+MAX_CONCURRENT_REQUESTS = 8
+MAX_REQUESTS_PER_SECOND = 20
+REQUEST_TIMEOUT = 10
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+# How long GeocodeCache keeps a lookup; addresses ALS cannot locate are retried sooner
+CACHE_TTL = timedelta(days=30)
+NEGATIVE_CACHE_TTL = timedelta(hours=1)
+MEMORY_CACHE_SIZE = 1024
+
+# Lookup result when ALS could not be reached or answered with an error. Unlike an
+# address ALS does not know, it is not cached, so the next call asks ALS again
+UNAVAILABLE = object()
+
+def normalise_address(address):
+    """Cache key for an address: upper case with runs of whitespace collapsed"""
+    return ' '.join(address.upper().split())
+
+def format_timestamp(moment):
+    """UTC timestamp in the format stored in GeocodeCache.expires_at"""
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def parse_timestamp(value):
+    """UTC-aware datetime of a GeocodeCache.expires_at value; Django's connections already convert DATETIME columns"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.replace(tzinfo=timezone.utc)
+
+class LRUCache:
+    """Thread-safe in-process LRU cache whose entries expire at a given (UTC-aware) time"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(hit, value) for a key that is cached and not expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, expires_at = entry
+            if expires_at <= datetime.now(timezone.utc):
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class GeocodingClient:
+    """
+    HTTP client shared by all geocoding lookups.
+    Reuses pooled connections, retries failed requests with backoff and
+    limits the number of concurrent requests and the request rate per host.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_REQUESTS, rate=MAX_REQUESTS_PER_SECOND,
+                 retries=MAX_RETRIES, backoff=RETRY_BACKOFF):
+        self.max_concurrent = max_concurrent
+        self.interval = 1 / rate
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",),
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_concurrent, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        """(semaphore, state) limiting the requests sent to the host of a url"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = (threading.BoundedSemaphore(self.max_concurrent), {'next_at': 0.0, 'lock': threading.Lock()})
+            return self._hosts[host]
+
+    def _wait_turn(self, state):
+        # Space requests to a host at least interval seconds apart
+        with state['lock']:
+            now = time.monotonic()
+            start = max(now, state['next_at'])
+            state['next_at'] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        semaphore, state = self._host(url)
+        with semaphore:
+            self._wait_turn(state)
+            return self.session.get(url, **kwargs)
+
+
+class CachedGeocoder:
+    """
+    Geocoding results kept in an in-process LRU in front of the GeocodeCache table.
+    A result is (geo_address, latitude, longitude), or None for an address ALS cannot
+    locate. The table is read and written on the sqlite3 connection connect() returns,
+    and written inside atomic(), so Django apps write in the transaction of the request
+    """
+
+    def __init__(self, connect, atomic, max_workers=MAX_CONCURRENT_REQUESTS, maxsize=MEMORY_CACHE_SIZE):
+        self.connect = connect
+        self.atomic = atomic
+        self.max_workers = max_workers
+        self.memory_cache = LRUCache(maxsize)
+
+    def read(self, keys, now):
+        """{key: (result, expires_at)} of the unexpired GeocodeCache rows for the keys"""
+        keys = list(keys)
+        if not keys:
+            return {}
+        cursor = self.connect().cursor()
+        try:
+            cursor.execute(
+                f'''SELECT address_key, geo_address, latitude, longitude, found, expires_at FROM GeocodeCache
+                WHERE address_key IN ({', '.join('?' * len(keys))}) AND expires_at > ?''',
+                keys + [format_timestamp(now)]
+            )
+            return {
+                key: ((geo_address, latitude, longitude) if found else None,
+                      parse_timestamp(expires_at))
+                for key, geo_address, latitude, longitude, found, expires_at in cursor
+            }
+        finally:
+            cursor.close()
+
+    def store(self, results, now):
+        """Save {key: (result, expires_at)} lookups in the GeocodeCache table and purge expired rows"""
+        with self.atomic():
+            cursor = self.connect().cursor()
+            try:
+                cursor.executemany(
+                    '''INSERT OR REPLACE INTO GeocodeCache (address_key, geo_address, latitude, longitude, found, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?)''',
+                    [(key,) + (result or (None, None, None)) + (result is not None, format_timestamp(expires_at))
+                     for key, (result, expires_at) in results.items()]
+                )
+                cursor.execute('DELETE FROM GeocodeCache WHERE expires_at <= ?', (format_timestamp(now),))
+            finally:
+                cursor.close()
+
+    def geocode_many(self, addresses, lookup):
+        """
+        Result for each address, in order. Cached results come from the in-process LRU or
+        the GeocodeCache table; the remaining addresses are passed to lookup concurrently
+        """
+        keys = [normalise_address(address) for address in addresses]
+        results = {}
+        for key in set(keys):
+            hit, result = self.memory_cache.get(key)
+            if hit:
+                results[key] = result
+
+        now = datetime.now(timezone.utc)
+        for key, (result, expires_at) in self.read(set(keys) - results.keys(), now).items():
+            self.memory_cache.set(key, result, expires_at)
+            results[key] = result
+
+        missing = sorted(set(keys) - results.keys())
+        if missing:
+            # Threads only make the HTTP requests; the cache is written from this thread
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                looked_up = dict(zip(missing, executor.map(lookup, missing)))
+            fetched = {}
+            for key, result in looked_up.items():
+                if result is UNAVAILABLE:
+                    results[key] = None
+                    continue
+                expires_at = now + (CACHE_TTL if result else NEGATIVE_CACHE_TTL)
+                fetched[key] = (result, expires_at)
+                self.memory_cache.set(key, result, expires_at)
+                results[key] = result
+            self.store(fetched, now)
+
+        return [results[key] for key in keys]
+
+def django_geocoder(max_workers=MAX_CONCURRENT_REQUESTS):
+    """CachedGeocoder on the sqlite3 connection of a Django app, writing inside its transaction"""
+    from django.db import connection, transaction
+
+    def connect():
+        connection.ensure_connection()
+        return connection.connection
+
+    return CachedGeocoder(connect, transaction.atomic, max_workers)
\ No newline at end of file
@@ -2,7 +2,8 @@ import random
 import sqlite3
 import datetime
 from faker import Faker
-from dbutils import register_user, add_accommodation, add_campus, make_reservation, update_reservation_status, add_rating
+from dbconnection import get_connection
+from dbutils import add_accommodations_bulk, add_campus, add_ratings_bulk, make_reservations_bulk, register_users_bulk
 
 # Initialize Faker
 fake = Faker()
@@ -48,34 +49,29 @@ def populate_database():
     
     print("Added 5 campuses")
     
-    # Add 100 users (95 students and 5 specialists)
-    student_ids = []
-    specialist_ids = []
-    
-    # Add specialists
+    # Add 100 users (95 students and 5 specialists), each group in one transaction
+    specialists = []
     for i in range(5):
         name = fake.name()
         email = f"specialist{i+1}@cedars.hku.hk"
         password = fake.password(length=12)
-        specialist_id = register_user(name, email, password, "Specialist")
-        if specialist_id:
-            specialist_ids.append(specialist_id)
+        specialists.append((name, email, password, "Specialist"))
+    specialist_ids = register_users_bulk(specialists) or []
     
     print(f"Added {len(specialist_ids)} specialists")
     
-    # Add students
+    students = []
     for i in range(95):
         name = fake.name()
         email = f"student{i+1}@connect.hku.hk"
         password = fake.password(length=12)
-        student_id = register_user(name, email, password, "Student")
-        if student_id:
-            student_ids.append(student_id)
+        students.append((name, email, password, "Student"))
+    student_ids = register_users_bulk(students) or []
     
     print(f"Added {len(student_ids)} students")
     
     # Add 80 accommodations
-    accommodation_ids = []
+    accommodations = []
     
     for i in range(80):
         start_date = generate_random_date()
@@ -101,59 +97,42 @@ def populate_database():
         latitude = 22.28 + random.uniform(-0.05, 0.05)
         longitude = 114.13 + random.uniform(-0.05, 0.05)
         
-        accommodation_id = add_accommodation(
+        accommodations.append((
             start_date, end_date, room_type, beds, bedrooms, price, address, 
             latitude, longitude, address
-        )
-        
-        if accommodation_id:
-            accommodation_ids.append(accommodation_id)
+        ))
+    
+    accommodation_ids = add_accommodations_bulk(accommodations) or []
     
     print(f"Added {len(accommodation_ids)} accommodations")
     
     # Make 60 reservations
-    reservation_ids = []
     
     # Shuffle accommodation IDs to randomize which ones are reserved
     random.shuffle(accommodation_ids)
     accommodations_to_reserve = accommodation_ids[:60]
     
+    reservations = []
     for accommodation_id in accommodations_to_reserve:
         # Random student makes the reservation
         student_id = random.choice(student_ids)
         
-        # Make reservation
-        reservation_id = make_reservation(student_id, accommodation_id)
-        
-        if reservation_id:
-            reservation_ids.append(reservation_id)
-            
-            # Randomize reservation status
-            status = random.choice(['pending', 'confirmed', 'completed', 'completed', 'completed'])  # Higher chance of completed
-            update_reservation_status(reservation_id, status)
+        # Randomize reservation status, set when the reservation is inserted
+        status = random.choice(['pending', 'confirmed', 'completed', 'completed', 'completed'])  # Higher chance of completed
+        reservations.append((student_id, accommodation_id, status))
     
-    print(f"Added {len(reservation_ids)} reservations")
-    
-    # Add ratings for completed reservations
-    rating_count = 0
+    reservation_ids = make_reservations_bulk(reservations) or []
     
-    # Connect to check completed reservations
-    conn = sqlite3.connect('unihaven.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT reservation_id FROM Reservation WHERE status='completed'")
-    completed_reservations = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    print(f"Added {len(reservation_ids)} reservations")
     
     # Add ratings for 80% of completed reservations
-    for reservation in completed_reservations:
-        if random.random() < 0.8:  # 80% chance of rating
-            reservation_id = reservation[0]
+    ratings = []
+    for reservation_id, (_, _, status) in zip(reservation_ids, reservations):
+        if status == 'completed' and random.random() < 0.8:  # 80% chance of rating
             rating_value = random.randint(1, 5)
-            
-            rating_id = add_rating(reservation_id, rating_value)
-            if rating_id:
-                rating_count += 1
+            ratings.append((reservation_id, rating_value))
+    
+    rating_count = len(add_ratings_bulk(ratings) or [])
     
     print(f"Added {rating_count} ratings")
     
@@ -168,12 +147,11 @@ def populate_database():
 if __name__ == "__main__":
     # Check if database exists and has tables
     try:
-        conn = sqlite3.connect('unihaven.db')
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
         tables = cursor.fetchall()
         cursor.close()
-        conn.close()
         
         if len(tables) < 5:
             print("Please run create_db.py first to create the database structure.")
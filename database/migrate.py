@@ -0,0 +1,770 @@
+import re
+import sqlite3
+import sys
+from dbconnection import ACTIVE_RESERVATION, FIRST_DAY, LAST_DAY, day_number, overlapping_reservations
+from dbutils import (
+    RATING_PRIOR_MEAN, RATING_SCORE, REBUILD_RATING_AGGREGATES, REBUILD_RATING_AGGREGATES_RESET,
+    count_stats, haversine_sql, update_campus_distances,
+)
+
+def add_search_indexes(cursor):
+    """Create indexes matching the accommodation search filters"""
+    # Equality filters (type, is_reserved) lead so the range filters can follow them;
+    # every search filter leads at least one index so no combination needs a table scan
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_accommodation_type_price
+    ON Accommodation (type, price, beds, bedrooms)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_accommodation_reserved_type
+    ON Accommodation (is_reserved, type, price)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_accommodation_availability
+    ON Accommodation (availability_start, availability_end)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_accommodation_availability_end
+    ON Accommodation (availability_end, availability_start)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_accommodation_price
+    ON Accommodation (price, beds, bedrooms)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_accommodation_beds
+    ON Accommodation (beds, bedrooms, price)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_accommodation_bedrooms
+    ON Accommodation (bedrooms, price)
+    ''')
+
+def add_campus_distances(cursor):
+    """Precomputed distance from every accommodation to every campus"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS AccommodationCampusDistance (
+        accommodation_id INTEGER NOT NULL,
+        campus_id INTEGER NOT NULL,
+        distance REAL NOT NULL,
+        PRIMARY KEY (accommodation_id, campus_id),
+        FOREIGN KEY (accommodation_id) REFERENCES Accommodation(accommodation_id) ON DELETE CASCADE,
+        FOREIGN KEY (campus_id) REFERENCES Campus(campus_id) ON DELETE CASCADE
+    )
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_campus_distance
+    ON AccommodationCampusDistance (campus_id, distance)
+    ''')
+    update_campus_distances(cursor)
+
+def add_spatial_index(cursor):
+    """R*Tree over accommodation coordinates for radius and nearest-neighbour queries"""
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS AccommodationLocation USING rtree(
+        accommodation_id,
+        min_lat, max_lat,
+        min_lon, max_lon
+    )
+    ''')
+    cursor.execute('''
+    INSERT OR REPLACE INTO AccommodationLocation (accommodation_id, min_lat, max_lat, min_lon, max_lon)
+    SELECT accommodation_id, latitude, latitude, longitude, longitude
+    FROM Accommodation
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+
+    # Triggers keep the R*Tree in step with Accommodation whoever writes the row
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_accommodation_location_insert
+    AFTER INSERT ON Accommodation
+    WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+    BEGIN
+        INSERT INTO AccommodationLocation (accommodation_id, min_lat, max_lat, min_lon, max_lon)
+        VALUES (NEW.accommodation_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_accommodation_location_update
+    AFTER UPDATE OF latitude, longitude ON Accommodation
+    WHEN OLD.latitude IS NOT NEW.latitude OR OLD.longitude IS NOT NEW.longitude
+    BEGIN
+        DELETE FROM AccommodationLocation WHERE accommodation_id = OLD.accommodation_id;
+        INSERT INTO AccommodationLocation (accommodation_id, min_lat, max_lat, min_lon, max_lon)
+        SELECT NEW.accommodation_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+        WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_accommodation_location_delete
+    AFTER DELETE ON Accommodation
+    BEGIN
+        DELETE FROM AccommodationLocation WHERE accommodation_id = OLD.accommodation_id;
+    END;
+    ''')
+
+def add_geocode_cache(cursor):
+    """Cache of ALS address lookups, including addresses that could not be found"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS GeocodeCache (
+        address_key TEXT PRIMARY KEY,  -- Normalised address
+        geo_address TEXT,
+        latitude REAL,
+        longitude REAL,
+        found INTEGER NOT NULL CHECK(found IN (0, 1)),
+        expires_at DATETIME NOT NULL
+    )
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_geocode_cache_expires
+    ON GeocodeCache (expires_at)
+    ''')
+
+def add_geocode_queue(cursor):
+    """Queue of accommodations waiting for the geocode backfill worker"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS GeocodeQueue (
+        accommodation_id INTEGER PRIMARY KEY,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        last_error TEXT,
+        FOREIGN KEY (accommodation_id) REFERENCES Accommodation(accommodation_id) ON DELETE CASCADE
+    )
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_geocode_queue_next_attempt
+    ON GeocodeQueue (next_attempt_at)
+    ''')
+    cursor.execute('''
+    INSERT OR IGNORE INTO GeocodeQueue (accommodation_id)
+    SELECT accommodation_id FROM Accommodation
+    WHERE latitude IS NULL OR longitude IS NULL
+    ''')
+
+    # Rows saved without coordinates are queued whoever writes them
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS enqueue_geocode_insert
+    AFTER INSERT ON Accommodation
+    WHEN NEW.latitude IS NULL OR NEW.longitude IS NULL
+    BEGIN
+        INSERT OR IGNORE INTO GeocodeQueue (accommodation_id) VALUES (NEW.accommodation_id);
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS enqueue_geocode_update
+    AFTER UPDATE OF address, latitude, longitude ON Accommodation
+    WHEN NEW.latitude IS NULL OR NEW.longitude IS NULL
+    BEGIN
+        INSERT OR IGNORE INTO GeocodeQueue (accommodation_id) VALUES (NEW.accommodation_id);
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS dequeue_geocode_delete
+    AFTER DELETE ON Accommodation
+    BEGIN
+        DELETE FROM GeocodeQueue WHERE accommodation_id = OLD.accommodation_id;
+    END;
+    ''')
+
+def add_stats(cursor):
+    """Counters behind get_stats, kept current by triggers instead of counting on every call"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Stats (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.executemany('INSERT OR REPLACE INTO Stats (name, value) VALUES (?, ?)', count_stats(cursor).items())
+
+    # Student and specialist counts follow inserts, deletes and role changes of users
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_stats_user_insert
+    AFTER INSERT ON User
+    BEGIN
+        UPDATE Stats SET value = value + 1
+        WHERE name = CASE NEW.role WHEN 'Student' THEN 'students' ELSE 'specialists' END;
+    END;
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_stats_user_delete
+    AFTER DELETE ON User
+    BEGIN
+        UPDATE Stats SET value = value - 1
+        WHERE name = CASE OLD.role WHEN 'Student' THEN 'students' ELSE 'specialists' END;
+    END;
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_stats_user_role
+    AFTER UPDATE OF role ON User
+    WHEN OLD.role IS NOT NEW.role
+    BEGIN
+        UPDATE Stats SET value = value - 1
+        WHERE name = CASE OLD.role WHEN 'Student' THEN 'students' ELSE 'specialists' END;
+        UPDATE Stats SET value = value + 1
+        WHERE name = CASE NEW.role WHEN 'Student' THEN 'students' ELSE 'specialists' END;
+    END;
+    ''')
+
+    # Accommodation counts, including how many are reserved
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_stats_accommodation_insert
+    AFTER INSERT ON Accommodation
+    BEGIN
+        UPDATE Stats SET value = value + 1 WHERE name = 'accommodations';
+        UPDATE Stats SET value = value + 1 WHERE name = 'reserved_accommodations' AND NEW.is_reserved = 1;
+    END;
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_stats_accommodation_delete
+    AFTER DELETE ON Accommodation
+    BEGIN
+        UPDATE Stats SET value = value - 1 WHERE name = 'accommodations';
+        UPDATE Stats SET value = value - 1 WHERE name = 'reserved_accommodations' AND OLD.is_reserved = 1;
+    END;
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_stats_accommodation_reserved
+    AFTER UPDATE OF is_reserved ON Accommodation
+    WHEN OLD.is_reserved IS NOT NEW.is_reserved
+    BEGIN
+        UPDATE Stats SET value = value + (CASE WHEN NEW.is_reserved = 1 THEN 1 ELSE -1 END)
+        WHERE name = 'reserved_accommodations';
+    END;
+    ''')
+
+    # Reservation and rating counts
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_stats_reservation_insert
+    AFTER INSERT ON Reservation
+    BEGIN
+        UPDATE Stats SET value = value + 1 WHERE name = 'reservations';
+    END;
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_stats_reservation_delete
+    AFTER DELETE ON Reservation
+    BEGIN
+        UPDATE Stats SET value = value - 1 WHERE name = 'reservations';
+    END;
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_stats_rating_insert
+    AFTER INSERT ON Rating
+    BEGIN
+        UPDATE Stats SET value = value + 1 WHERE name = 'ratings';
+    END;
+    ''')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_stats_rating_delete
+    AFTER DELETE ON Rating
+    BEGIN
+        UPDATE Stats SET value = value - 1 WHERE name = 'ratings';
+    END;
+    ''')
+
+def add_rating_sum(cursor):
+    """Keep the exact sum of ratings so average_rating is derived as rating_sum / rating_count"""
+    cursor.execute("SELECT name FROM pragma_table_info('Accommodation')")
+    if 'rating_sum' not in {row[0] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE Accommodation ADD COLUMN rating_sum INTEGER NOT NULL DEFAULT 0')
+    cursor.execute(REBUILD_RATING_AGGREGATES_RESET)
+    cursor.execute(REBUILD_RATING_AGGREGATES)
+
+    # Replace the running-mean triggers from create_dbV3.py; the average is now
+    # recomputed from the integer sum and count, so rounding errors cannot build up
+    cursor.execute('DROP TRIGGER IF EXISTS update_accommodation_rating_insert')
+    cursor.execute('DROP TRIGGER IF EXISTS update_accommodation_rating_delete')
+    cursor.execute('''
+    CREATE TRIGGER update_accommodation_rating_insert
+    AFTER INSERT ON Rating
+    BEGIN
+        UPDATE Accommodation 
+        SET 
+            rating_sum = rating_sum + NEW.rating,
+            rating_count = rating_count + 1,
+            average_rating = (rating_sum + NEW.rating) * 1.0 / (rating_count + 1)
+        WHERE 
+            accommodation_id = (SELECT accommodation_id FROM Reservation WHERE reservation_id = NEW.reservation_id);
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER update_accommodation_rating_delete
+    AFTER DELETE ON Rating
+    BEGIN
+        UPDATE Accommodation 
+        SET 
+            rating_sum = rating_sum - OLD.rating,
+            rating_count = rating_count - 1,
+            average_rating = CASE
+                WHEN rating_count <= 1 THEN 0
+                ELSE (rating_sum - OLD.rating) * 1.0 / (rating_count - 1)
+            END
+        WHERE 
+            accommodation_id = (SELECT accommodation_id FROM Reservation WHERE reservation_id = OLD.reservation_id);
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_accommodation_rating_update
+    AFTER UPDATE OF rating ON Rating
+    WHEN OLD.rating IS NOT NEW.rating
+    BEGIN
+        UPDATE Accommodation 
+        SET 
+            rating_sum = rating_sum - OLD.rating + NEW.rating,
+            average_rating = (rating_sum - OLD.rating + NEW.rating) * 1.0 / rating_count
+        WHERE 
+            accommodation_id = (SELECT accommodation_id FROM Reservation WHERE reservation_id = NEW.reservation_id);
+    END;
+    ''')
+
+def add_rating_score(cursor):
+    """Bayesian rating score kept up to date on rating writes, and indexes for sorting by rating"""
+    cursor.execute("SELECT name FROM pragma_table_info('Accommodation')")
+    if 'rating_score' not in {row[0] for row in cursor.fetchall()}:
+        cursor.execute(f'ALTER TABLE Accommodation ADD COLUMN rating_score REAL NOT NULL DEFAULT {RATING_PRIOR_MEAN}')
+    cursor.execute(f'UPDATE Accommodation SET rating_score = {RATING_SCORE}')
+
+    # The rating triggers, the rebuild queries and the Django views all write
+    # rating_sum and rating_count, so the score follows those two columns
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS update_accommodation_rating_score
+    AFTER UPDATE OF rating_sum, rating_count ON Accommodation
+    BEGIN
+        UPDATE Accommodation SET rating_score = {RATING_SCORE}
+        WHERE accommodation_id = NEW.accommodation_id;
+    END;
+    ''')
+
+    # Top-rated searches walk these backwards and stop at the page size; the
+    # accommodation_id tie-break comes from the rowid at the end of each entry
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_accommodation_rating_score
+    ON Accommodation (rating_score)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_accommodation_type_rating_score
+    ON Accommodation (type, rating_score)
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_accommodation_rating
+    ON Accommodation (average_rating, rating_count)
+    ''')
+    # Without statistics the planner assumes a price range is selective and
+    # sorts the whole range instead of walking the score index with a LIMIT
+    cursor.execute('ANALYZE Accommodation')
+
+def add_accommodation_version(cursor):
+    """Per-accommodation version number and last change time, used as HTTP validators"""
+    cursor.execute("SELECT name FROM pragma_table_info('Accommodation')")
+    columns = {row[0] for row in cursor.fetchall()}
+    if 'version' not in columns:
+        cursor.execute('ALTER TABLE Accommodation ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+    if 'updated_at' not in columns:
+        # ALTER TABLE only accepts constant defaults, so existing rows are stamped here
+        cursor.execute('ALTER TABLE Accommodation ADD COLUMN updated_at DATETIME')
+    cursor.execute('UPDATE Accommodation SET updated_at = CURRENT_TIMESTAMP WHERE updated_at IS NULL')
+
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS set_accommodation_updated_at_insert
+    AFTER INSERT ON Accommodation
+    WHEN NEW.updated_at IS NULL
+    BEGIN
+        UPDATE Accommodation SET updated_at = CURRENT_TIMESTAMP
+        WHERE accommodation_id = NEW.accommodation_id;
+    END;
+    ''')
+    # Any change made without touching version itself, including the ones made by
+    # the reservation and rating triggers, moves the accommodation to a new version
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS bump_accommodation_version
+    AFTER UPDATE ON Accommodation
+    WHEN NEW.version = OLD.version AND NEW.updated_at IS OLD.updated_at
+    BEGIN
+        UPDATE Accommodation SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE accommodation_id = NEW.accommodation_id;
+    END;
+    ''')
+
+def add_availability_index(cursor):
+    """Interval indexes over listing windows and active reservations for date-range searches"""
+    # Dates are stored as whole Julian day numbers so the integer R*Trees compare
+    # them exactly; a reservation without dates blocks the listing on every day
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS AccommodationAvailability USING rtree_i32(
+        accommodation_id,
+        start_day, end_day
+    )
+    ''')
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS ReservationPeriod USING rtree_i32(
+        reservation_id,
+        start_day, end_day,
+        +accommodation_id
+    )
+    ''')
+    cursor.execute(f'''
+    INSERT OR REPLACE INTO AccommodationAvailability (accommodation_id, start_day, end_day)
+    SELECT accommodation_id, {day_number('availability_start')}, {day_number('availability_end')}
+    FROM Accommodation
+    ''')
+    cursor.execute(f'''
+    INSERT OR REPLACE INTO ReservationPeriod (reservation_id, start_day, end_day, accommodation_id)
+    SELECT reservation_id, {FIRST_DAY}, {LAST_DAY}, accommodation_id
+    FROM Reservation
+    WHERE {ACTIVE_RESERVATION}
+    ''')
+
+    # Triggers keep both indexes in step whoever writes the rows
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS update_accommodation_availability_insert
+    AFTER INSERT ON Accommodation
+    BEGIN
+        INSERT INTO AccommodationAvailability (accommodation_id, start_day, end_day)
+        VALUES (NEW.accommodation_id, {day_number('NEW.availability_start')}, {day_number('NEW.availability_end')});
+    END;
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS update_accommodation_availability_update
+    AFTER UPDATE OF availability_start, availability_end ON Accommodation
+    WHEN OLD.availability_start IS NOT NEW.availability_start OR OLD.availability_end IS NOT NEW.availability_end
+    BEGIN
+        DELETE FROM AccommodationAvailability WHERE accommodation_id = OLD.accommodation_id;
+        INSERT INTO AccommodationAvailability (accommodation_id, start_day, end_day)
+        VALUES (NEW.accommodation_id, {day_number('NEW.availability_start')}, {day_number('NEW.availability_end')});
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_accommodation_availability_delete
+    AFTER DELETE ON Accommodation
+    BEGIN
+        DELETE FROM AccommodationAvailability WHERE accommodation_id = OLD.accommodation_id;
+    END;
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS update_reservation_period_insert
+    AFTER INSERT ON Reservation
+    WHEN NEW.{ACTIVE_RESERVATION}
+    BEGIN
+        INSERT INTO ReservationPeriod (reservation_id, start_day, end_day, accommodation_id)
+        VALUES (NEW.reservation_id, {FIRST_DAY}, {LAST_DAY}, NEW.accommodation_id);
+    END;
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS update_reservation_period_update
+    AFTER UPDATE OF status, accommodation_id ON Reservation
+    BEGIN
+        DELETE FROM ReservationPeriod WHERE reservation_id = OLD.reservation_id;
+        INSERT INTO ReservationPeriod (reservation_id, start_day, end_day, accommodation_id)
+        SELECT NEW.reservation_id, {FIRST_DAY}, {LAST_DAY}, NEW.accommodation_id
+        WHERE NEW.{ACTIVE_RESERVATION};
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_reservation_period_delete
+    AFTER DELETE ON Reservation
+    BEGIN
+        DELETE FROM ReservationPeriod WHERE reservation_id = OLD.reservation_id;
+    END;
+    ''')
+
+def reservation_days(row):
+    """SQL for the (start_day, end_day) a reservation row holds; check-out day itself is free"""
+    return (
+        f'COALESCE({day_number(row + "check_in")}, {FIRST_DAY})',
+        f'COALESCE({day_number(row + "check_out")} - 1, {LAST_DAY})',
+    )
+
+def rebuild_reservation(cursor, table_sql):
+    """
+    Recreate Reservation from a new CREATE TABLE statement with the same columns,
+    keeping its rows, indexes and triggers. SQLite cannot change constraints in place.
+    """
+    cursor.execute('''
+    SELECT sql FROM sqlite_master
+    WHERE type IN ('index', 'trigger') AND tbl_name = 'Reservation' AND sql IS NOT NULL
+    ''')
+    dependents = [row[0] for row in cursor.fetchall()]
+    table_sql = re.sub(r'CREATE TABLE\s+(IF NOT EXISTS\s+)?"?Reservation"?', 'CREATE TABLE Reservation_new', table_sql, count=1)
+    cursor.execute(table_sql)
+    cursor.execute('INSERT INTO Reservation_new SELECT * FROM Reservation')
+    # Triggers on Rating mention Reservation, which does not exist until the rename
+    cursor.execute('PRAGMA legacy_alter_table = ON')
+    cursor.execute('DROP TABLE Reservation')
+    cursor.execute('ALTER TABLE Reservation_new RENAME TO Reservation')
+    cursor.execute('PRAGMA legacy_alter_table = OFF')
+    for sql in dependents:
+        cursor.execute(sql)
+
+def add_reservation_dates(cursor):
+    """Check-in and check-out dates, so an accommodation can carry many non-overlapping reservations"""
+    # The UNIQUE(accommodation_id) constraint cannot be dropped in place
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'Reservation'")
+    table_sql = cursor.fetchone()[0]
+    unique = re.compile(r'(accommodation_id\s+INTEGER\s+NOT\s+NULL)\s+UNIQUE\s*,[^\n]*', re.IGNORECASE)
+    if unique.search(table_sql):
+        rebuild_reservation(cursor, unique.sub(r'\1,', table_sql))
+
+    cursor.execute("SELECT name FROM pragma_table_info('Reservation')")
+    columns = {row[0] for row in cursor.fetchall()}
+    if 'check_in' not in columns:
+        cursor.execute('ALTER TABLE Reservation ADD COLUMN check_in DATE')
+    if 'check_out' not in columns:
+        cursor.execute('ALTER TABLE Reservation ADD COLUMN check_out DATE CHECK(check_out > check_in)')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_reservation_accommodation_dates
+    ON Reservation (accommodation_id, check_in, check_out)
+    ''')
+
+    # Overlapping active reservations are refused whoever writes them
+    overlap = overlapping_reservations('NEW.accommodation_id', 'NEW.check_in', 'NEW.check_out', exclude='NEW.reservation_id')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS prevent_reservation_overlap_insert
+    BEFORE INSERT ON Reservation
+    WHEN NEW.{ACTIVE_RESERVATION}
+    BEGIN
+        SELECT RAISE(ABORT, 'Reservation overlaps an existing reservation')
+        WHERE EXISTS ({overlap});
+    END;
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS prevent_reservation_overlap_update
+    BEFORE UPDATE OF status, accommodation_id, check_in, check_out ON Reservation
+    WHEN NEW.{ACTIVE_RESERVATION}
+    BEGIN
+        SELECT RAISE(ABORT, 'Reservation overlaps an existing reservation')
+        WHERE EXISTS ({overlap});
+    END;
+    ''')
+
+    # is_reserved now means "has an active reservation", which a single insert or
+    # delete no longer decides on its own
+    cursor.execute('DROP TRIGGER IF EXISTS update_accommodation_reserved_insert')
+    cursor.execute('DROP TRIGGER IF EXISTS update_accommodation_reserved_delete')
+    cursor.execute(f'''
+    CREATE TRIGGER update_accommodation_reserved_insert
+    AFTER INSERT ON Reservation
+    WHEN NEW.{ACTIVE_RESERVATION}
+    BEGIN
+        UPDATE Accommodation SET is_reserved = 1 WHERE accommodation_id = NEW.accommodation_id;
+    END;
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER update_accommodation_reserved_delete
+    AFTER DELETE ON Reservation
+    BEGIN
+        UPDATE Accommodation
+        SET is_reserved = EXISTS (
+            SELECT 1 FROM Reservation WHERE accommodation_id = OLD.accommodation_id AND {ACTIVE_RESERVATION}
+        )
+        WHERE accommodation_id = OLD.accommodation_id;
+    END;
+    ''')
+    cursor.execute(f'''
+    UPDATE Accommodation
+    SET is_reserved = EXISTS (
+        SELECT 1 FROM Reservation r WHERE r.accommodation_id = Accommodation.accommodation_id AND r.{ACTIVE_RESERVATION}
+    )
+    WHERE is_reserved IS NOT EXISTS (
+        SELECT 1 FROM Reservation r WHERE r.accommodation_id = Accommodation.accommodation_id AND r.{ACTIVE_RESERVATION}
+    )
+    ''')
+
+    # ReservationPeriod now holds the reserved days instead of the whole timeline
+    start_day, end_day = reservation_days('')
+    cursor.execute('DELETE FROM ReservationPeriod')
+    cursor.execute(f'''
+    INSERT INTO ReservationPeriod (reservation_id, start_day, end_day, accommodation_id)
+    SELECT reservation_id, {start_day}, {end_day}, accommodation_id
+    FROM Reservation
+    WHERE {ACTIVE_RESERVATION}
+    ''')
+    start_day, end_day = reservation_days('NEW.')
+    cursor.execute('DROP TRIGGER IF EXISTS update_reservation_period_insert')
+    cursor.execute('DROP TRIGGER IF EXISTS update_reservation_period_update')
+    cursor.execute(f'''
+    CREATE TRIGGER update_reservation_period_insert
+    AFTER INSERT ON Reservation
+    WHEN NEW.{ACTIVE_RESERVATION}
+    BEGIN
+        INSERT INTO ReservationPeriod (reservation_id, start_day, end_day, accommodation_id)
+        VALUES (NEW.reservation_id, {start_day}, {end_day}, NEW.accommodation_id);
+    END;
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER update_reservation_period_update
+    AFTER UPDATE OF status, accommodation_id, check_in, check_out ON Reservation
+    BEGIN
+        DELETE FROM ReservationPeriod WHERE reservation_id = OLD.reservation_id;
+        INSERT INTO ReservationPeriod (reservation_id, start_day, end_day, accommodation_id)
+        SELECT NEW.reservation_id, {start_day}, {end_day}, NEW.accommodation_id
+        WHERE NEW.{ACTIVE_RESERVATION};
+    END;
+    ''')
+
+def add_reservation_expiry(cursor):
+    """Temporary holds that expire, released by the Epic 5 release_expired_holds command"""
+    # The status CHECK written by create_dbV3.py does not allow 'temp' holds
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'Reservation'")
+    table_sql = cursor.fetchone()[0]
+    statuses = re.compile(r"(CHECK\s*\(\s*status\s+IN\s*\()([^)]*)\)", re.IGNORECASE)
+    match = statuses.search(table_sql)
+    if match and "'temp'" not in match.group(2):
+        rebuild_reservation(cursor, statuses.sub(r"\1\2, 'temp')", table_sql, count=1))
+
+    # Epic3 and Epic4 databases already have both columns
+    cursor.execute("SELECT name FROM pragma_table_info('Reservation')")
+    columns = {row[0] for row in cursor.fetchall()}
+    if 'created_at' not in columns:
+        cursor.execute('ALTER TABLE Reservation ADD COLUMN created_at DATETIME')
+    if 'expires_at' not in columns:
+        cursor.execute('ALTER TABLE Reservation ADD COLUMN expires_at DATETIME')
+    # A sweep reads only the holds of one status that are already past expires_at
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_reservation_status_expires
+    ON Reservation (status, expires_at)
+    ''')
+
+def add_campus_distance_triggers(cursor):
+    """Keep AccommodationCampusDistance complete from triggers and index it in search order"""
+    accommodation_distance = haversine_sql('NEW.latitude', 'NEW.longitude', 'c.latitude', 'c.longitude')
+    campus_distance = haversine_sql('a.latitude', 'a.longitude', 'NEW.latitude', 'NEW.longitude')
+
+    # Like the R*Tree, the distances follow Accommodation and Campus whoever writes them
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS update_campus_distance_insert
+    AFTER INSERT ON Accommodation
+    WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+    BEGIN
+        INSERT OR REPLACE INTO AccommodationCampusDistance (accommodation_id, campus_id, distance)
+        SELECT NEW.accommodation_id, c.campus_id, {accommodation_distance} FROM Campus c;
+    END;
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS update_campus_distance_update
+    AFTER UPDATE OF latitude, longitude ON Accommodation
+    WHEN OLD.latitude IS NOT NEW.latitude OR OLD.longitude IS NOT NEW.longitude
+    BEGIN
+        DELETE FROM AccommodationCampusDistance WHERE accommodation_id = OLD.accommodation_id;
+        INSERT INTO AccommodationCampusDistance (accommodation_id, campus_id, distance)
+        SELECT NEW.accommodation_id, c.campus_id, {accommodation_distance} FROM Campus c
+        WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_campus_distance_delete
+    AFTER DELETE ON Accommodation
+    BEGIN
+        DELETE FROM AccommodationCampusDistance WHERE accommodation_id = OLD.accommodation_id;
+    END;
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS update_campus_distance_campus_insert
+    AFTER INSERT ON Campus
+    BEGIN
+        INSERT OR REPLACE INTO AccommodationCampusDistance (accommodation_id, campus_id, distance)
+        SELECT a.accommodation_id, NEW.campus_id, {campus_distance} FROM Accommodation a
+        WHERE a.latitude IS NOT NULL AND a.longitude IS NOT NULL;
+    END;
+    ''')
+    cursor.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS update_campus_distance_campus_update
+    AFTER UPDATE OF latitude, longitude ON Campus
+    BEGIN
+        DELETE FROM AccommodationCampusDistance WHERE campus_id = OLD.campus_id;
+        INSERT INTO AccommodationCampusDistance (accommodation_id, campus_id, distance)
+        SELECT a.accommodation_id, NEW.campus_id, {campus_distance} FROM Accommodation a
+        WHERE a.latitude IS NOT NULL AND a.longitude IS NOT NULL;
+    END;
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS update_campus_distance_campus_delete
+    AFTER DELETE ON Campus
+    BEGIN
+        DELETE FROM AccommodationCampusDistance WHERE campus_id = OLD.campus_id;
+    END;
+    ''')
+
+    # Rows written before the triggers existed, such as listings geocoded by the
+    # Django apps, may be missing or stale
+    cursor.execute('DELETE FROM AccommodationCampusDistance')
+    cursor.execute(f'''
+    INSERT INTO AccommodationCampusDistance (accommodation_id, campus_id, distance)
+    SELECT a.accommodation_id, c.campus_id, {haversine_sql('a.latitude', 'a.longitude', 'c.latitude', 'c.longitude')}
+    FROM Accommodation a CROSS JOIN Campus c
+    WHERE a.latitude IS NOT NULL AND a.longitude IS NOT NULL
+    ''')
+
+    # Distance searches walk one campus's entries in (distance, accommodation_id)
+    # order and stop after a page, without reading the distance table itself
+    cursor.execute('DROP INDEX IF EXISTS idx_campus_distance')
+    cursor.execute('''
+    CREATE INDEX idx_campus_distance
+    ON AccommodationCampusDistance (campus_id, distance, accommodation_id)
+    ''')
+
+# Schema migrations in the order they are applied.
+# PRAGMA user_version records how many of them a database has already run.
+MIGRATIONS = [
+    add_search_indexes,
+    add_campus_distances,
+    add_spatial_index,
+    add_geocode_cache,
+    add_geocode_queue,
+    add_stats,
+    add_rating_sum,
+    add_rating_score,
+    add_accommodation_version,
+    add_availability_index,
+    add_reservation_dates,
+    add_reservation_expiry,
+    add_campus_distance_triggers,
+]
+
+def apply_migrations(conn, log=print):
+    """
+    Apply the pending schema migrations on an open connection, each in its own
+    transaction, and return the schema version. Errors are raised to the caller.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+
+        for step in MIGRATIONS[version:]:
+            cursor.execute("BEGIN")
+            step(cursor)
+            version += 1
+            cursor.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+            if log:
+                log(f"Applied migration {version}: {step.__name__}")
+
+        return version
+    finally:
+        cursor.close()
+
+def migrate(db_path='unihaven.db'):
+    """Apply any pending schema migrations and return the schema version"""
+    conn = sqlite3.connect(db_path)
+
+    try:
+        return apply_migrations(conn)
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error migrating database: {e}")
+        return None
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'unihaven.db'
+    version = migrate(db_path)
+    if version is not None:
+        print(f"\n{db_path} is at schema version {version}.")
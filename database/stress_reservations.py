@@ -0,0 +1,89 @@
+import datetime
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from dbconnection import ACTIVE_RESERVATION, close_all
+import dbutils
+
+THREADS = 16
+ATTEMPTS_PER_THREAD = 200
+ACCOMMODATIONS = 5       # Few enough that most attempts collide
+MAX_NIGHTS = 14
+
+# Pairs of active reservations of one accommodation whose stays overlap
+DOUBLE_BOOKINGS = f'''
+SELECT a.reservation_id, b.reservation_id, a.accommodation_id
+FROM Reservation a JOIN Reservation b
+  ON a.accommodation_id = b.accommodation_id AND a.reservation_id < b.reservation_id
+WHERE a.{ACTIVE_RESERVATION} AND b.{ACTIVE_RESERVATION}
+  AND COALESCE(a.check_in, '0000-01-01') < COALESCE(b.check_out, '9999-12-31')
+  AND COALESCE(a.check_out, '9999-12-31') > COALESCE(b.check_in, '0000-01-01')
+'''
+
+def random_stay(start, end):
+    """A random (check_in, check_out) of up to MAX_NIGHTS inside the listing"""
+    first = datetime.date.fromisoformat(start)
+    days = (datetime.date.fromisoformat(end) - first).days
+    check_in = first + datetime.timedelta(days=random.randrange(days))
+    check_out = check_in + datetime.timedelta(days=random.randint(1, min(MAX_NIGHTS, days - (check_in - first).days)))
+    return check_in.isoformat(), check_out.isoformat()
+
+def stress(threads, attempts):
+    """
+    Book ACCOMMODATIONS free accommodations from many threads at once through
+    make_reservation, and return (created, refused, seconds, double bookings)
+    """
+    conn = sqlite3.connect('unihaven.db')
+    user_id = conn.execute('SELECT user_id FROM User LIMIT 1').fetchone()[0]
+    listings = conn.execute(f'''
+    SELECT accommodation_id, availability_start, availability_end FROM Accommodation
+    WHERE availability_end > availability_start
+      AND accommodation_id NOT IN (SELECT accommodation_id FROM Reservation WHERE {ACTIVE_RESERVATION})
+    LIMIT {ACCOMMODATIONS}
+    ''').fetchall()
+    conn.close()
+
+    def book(_):
+        created = 0
+        for _ in range(attempts):
+            accommodation_id, start, end = random.choice(listings)
+            if dbutils.make_reservation(user_id, accommodation_id, 'pending', *random_stay(start, end)):
+                created += 1
+        return created
+
+    started = time.perf_counter()
+    # Refused attempts print their reason; only the totals are of interest here
+    with redirect_stdout(open(os.devnull, 'w')), ThreadPoolExecutor(max_workers=threads) as executor:
+        created = sum(executor.map(book, range(threads)))
+    seconds = time.perf_counter() - started
+    close_all()
+
+    conn = sqlite3.connect('unihaven.db')
+    double_bookings = conn.execute(DOUBLE_BOOKINGS).fetchall()
+    conn.close()
+    return created, threads * attempts - created, seconds, double_bookings
+
+if __name__ == "__main__":
+    db_path = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else 'unihaven.db')
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else THREADS
+
+    # Work on a copy so the benchmark leaves the given database untouched
+    with tempfile.TemporaryDirectory() as directory:
+        shutil.copy(db_path, os.path.join(directory, 'unihaven.db'))
+        os.chdir(directory)
+        created, refused, seconds, double_bookings = stress(threads, ATTEMPTS_PER_THREAD)
+        os.chdir(os.path.dirname(db_path))
+
+    print(f"{threads} threads made {created + refused} attempts in {seconds:.2f} s "
+          f"({(created + refused) / seconds:.0f}/s): {created} created, {refused} refused")
+    for first, second, accommodation_id in double_bookings:
+        print(f"Reservations {first} and {second} of accommodation {accommodation_id} overlap")
+    if double_bookings:
+        sys.exit(1)
+    print("No accommodation was booked twice for the same dates.")
\ No newline at end of file
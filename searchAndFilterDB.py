@@ -2,22 +2,35 @@ import sqlite3
 import requests
 import xml.etree.ElementTree as ET
 import math
+import os
+import sys
 
-def search(
+# Import the helpers in database/ as top-level modules, the same way dbutils and the
+# scripts there do, so everything shares one dbconnection module and its connections
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database'))
+from dbconnection import ACCOMMODATION_COLUMNS, AVAILABLE_BETWEEN, get_connection, select_list
+from geoclient import UNAVAILABLE, CachedGeocoder, GeocodingClient
+
+ALS_LOOKUP_URL = 'https://www.als.gov.hk/lookup'
+
+geocodingClient = GeocodingClient()
+
+# In-process LRU in front of the GeocodeCache table, which is written on the shared connection
+geocoder = CachedGeocoder(get_connection, get_connection, geocodingClient.max_concurrent)
+
+def buildSearchQuery(
     accommodation_type,
     availability_start,
     availability_end,
     min_beds,
     min_bedrooms,
-    max_price
+    max_price,
+    columns=None
 ):
-    """Search accommodations with specified filters."""
-    conn = sqlite3.connect('unihaven.db')
-    cursor = conn.cursor()
-
+    """Build the SQL and parameters for an accommodation search, selecting only the named columns."""
     # Base query with WHERE 1=1 to dynamically add conditions
-    query = '''
-    SELECT * 
+    query = f'''
+    SELECT {select_list(columns, ACCOMMODATION_COLUMNS)}
     FROM Accommodation
     WHERE 1=1
     '''
@@ -28,8 +41,9 @@ def search(
         query += ' AND type = ?'
         params.append(accommodation_type)
     if availability_start and availability_end:
-        query += ' AND availability_start <= ? AND availability_end >= ?'
-        params.extend([availability_end, availability_start])
+        # Free for the whole window: listed for it and not reserved on any of its days
+        query += ' AND ' + AVAILABLE_BETWEEN
+        params.extend([availability_start, availability_end, availability_end, availability_start])
     if min_beds is not None and min_beds > 0:
         query += ' AND beds >= ?'
         params.append(min_beds)
@@ -40,18 +54,61 @@ def search(
         query += ' AND price <= ?'
         params.append(max_price)
 
-    # Execute query
-    cursor.execute(query, params)
-    columns = [desc[0] for desc in cursor.description]
-    results = [dict(zip(columns, row)) for row in cursor.fetchall()]
-    
-    cursor.close()
-    conn.close()
-    return results
+    return query, params
+
+def iterSearch(
+    accommodation_type,
+    availability_start,
+    availability_end,
+    min_beds,
+    min_bedrooms,
+    max_price,
+    columns=None
+):
+    """Stream matching accommodations from the cursor as sqlite3.Row objects with the named columns."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+
+    query, params = buildSearchQuery(
+        accommodation_type,
+        availability_start,
+        availability_end,
+        min_beds,
+        min_bedrooms,
+        max_price,
+        columns
+    )
+
+    try:
+        cursor.execute(query, params)
+        yield from cursor
+    finally:
+        cursor.close()
+
+def search(
+    accommodation_type,
+    availability_start,
+    availability_end,
+    min_beds,
+    min_bedrooms,
+    max_price,
+    columns=None
+):
+    """Search accommodations with specified filters, returning a dict per row."""
+    return [dict(row) for row in iterSearch(
+        accommodation_type,
+        availability_start,
+        availability_end,
+        min_beds,
+        min_bedrooms,
+        max_price,
+        columns
+    )]
 
 def getCampusCoords(campus_name):
     """Get the Campus Coordinates """
-    conn = sqlite3.connect('unihaven.db')
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(
         'SELECT latitude, longitude FROM Campus WHERE name = ?',
@@ -59,30 +116,54 @@ def getCampusCoords(campus_name):
     )
     result = cursor.fetchone()
     cursor.close()
-    conn.close()
     
     if not result:
         raise ValueError(f"Campus '{campus_name}' not found")
     return result[0], result[1]
 
-def getGeocodeByAddress(address):
-    """Integrate data.gov.hk Address Lookup Service for latitude/longitude."""
+def getCampusDistances(campus_name):
+    """Get the precomputed distances from every accommodation to the Campus"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        '''
+        SELECT d.accommodation_id, d.distance
+        FROM AccommodationCampusDistance d
+        JOIN Campus c ON c.campus_id = d.campus_id
+        WHERE c.name = ?
+        ''',
+        (campus_name,)
+    )
+    distances = dict(cursor.fetchall())
+    cursor.close()
+    return distances
+
+def lookupGeocode(address):
+    """
+    Integrate data.gov.hk Address Lookup Service for latitude/longitude.
+    Returns (None, latitude, longitude), None if ALS cannot locate the address and UNAVAILABLE if the request fails.
+    """
     try:
-        response = requests.get(
-            'https://www.als.gov.hk/lookup',
-            params={'q': address},
-            timeout=10
-        )
+        response = geocodingClient.get(ALS_LOOKUP_URL, params={'q': address})
         response.raise_for_status()
-        
+    except requests.exceptions.RequestException as e:
+        print(f"Geocoding request failed for '{address}': {str(e)}")
+        return UNAVAILABLE
+    
+    try:
         # Parse XML/JSON response
         root = ET.fromstring(response.content)
         lat = root.find('.//Latitude').text
         lon = root.find('.//Longitude').text
-        return float(lat), float(lon)
-    except Exception as e:
+        return None, float(lat), float(lon)
+    except (ET.ParseError, AttributeError, TypeError, ValueError) as e:
         print(f"Geocoding failed for '{address}': {str(e)}")
-        return None, None
+        return None
+
+def getGeocodeByAddress(address):
+    """Latitude/longitude for an address, checking the in-process and GeocodeCache caches before ALS."""
+    result = geocoder.geocode_many([address], lookupGeocode)[0]
+    return (result[1], result[2]) if result else (None, None)
 
 def calcDistance(lat1, lon1, lat2, lon2):
     """Calculate line of sight distances using equirectangular approximation. """
@@ -100,6 +181,9 @@ def calcDistance(lat1, lon1, lat2, lon2):
     y = lat2 - lat1
     return math.sqrt(x**2 + y**2) * 6371  # Earth radius
 
+# Columns sortDistance needs from each search result
+SORT_COLUMNS = ['accommodation_id', 'address', 'latitude', 'longitude']
+
 def sortDistance(accommodations, campus_name):
     """Sort accommodations by distance from specified campus."""
     try:
@@ -108,7 +192,14 @@ def sortDistance(accommodations, campus_name):
         print(e)
         return accommodations
     
+    distances = getCampusDistances(campus_name)
+
     for acc in accommodations:
+        # Use the precomputed distance when the accommodation has one
+        if acc['accommodation_id'] in distances:
+            acc['distance'] = distances[acc['accommodation_id']]
+            continue
+
         # Use existing coordinates or geocode if missing
         if not acc.get('latitude') or not acc.get('longitude'):
             acc_lat, acc_lon = getGeocodeByAddress(acc['address'])
@@ -140,7 +231,8 @@ if __name__ == "__main__":
         str(availability_end),
         int(min_beds),
         int(min_bedrooms),
-        int(max_price)
+        int(max_price),
+        columns=SORT_COLUMNS + ['price']
     )
     
     # Sort by distance from Main Campus